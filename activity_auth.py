@@ -0,0 +1,246 @@
+"""
+In-memory index for activity-code authorization.
+
+AMS_Activities.get_keys_allowed() used to re-read the activity, split its
+user and weekday lists and count today's access_log rows on every code
+entry. ActivityAuthIndex keeps, per activity code, the user set, key list,
+time window and weekday bitmask, plus a per-activity count of today's uses:
+
+    get_activity_index().get_keys_allowed(session, user_id, code, now)
+
+The rules are rebuilt when activities change: triggers from
+db_migrations.py bump activity_revision.revision on every insert, update
+or delete, and each check compares it (one primary-key read). The usage
+counter is seeded once a day with a range query and then kept current from
+the access_log rows this process flushes.
+"""
+
+import threading
+from collections import Counter, namedtuple
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+ActivityRule = namedtuple(
+    "ActivityRule",
+    "id code name keys users weekdays time_from time_to frequency",
+)
+
+
+def _usage_key(activity_code):
+    # access_log.activityCode is an INTEGER column: "0042" is stored as 42
+    try:
+        return int(str(activity_code).strip())
+    except ValueError:
+        return str(activity_code)
+
+
+def weekday_mask(week_days):
+    """'0,2,4' (Monday = 0) -> bitmask with bits 0, 2 and 4 set."""
+    mask = 0
+    for day in str(week_days or "").split(","):
+        day = day.strip()
+        if day.isdigit() and int(day) < 7:
+            mask |= 1 << int(day)
+    return mask
+
+
+def _counts_as_use(access_log, day):
+    entered = access_log.activityCodeEntryTime
+    return (
+        access_log.activityCode is not None
+        and access_log.keysTaken is not None
+        and access_log.keysTaken != "[]"
+        and entered is not None
+        and entered.date() == day
+    )
+
+
+class ActivityAuthIndex(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rules = {}
+        self._revision = None
+        self.builds = 0
+
+        self._usage_day = None
+        # access_log id -> usage key, for the rows counted today
+        self._usage_ids = {}
+        self._usage = Counter()
+
+    # ---------------- Rules ----------------
+    def invalidate(self):
+        with self._lock:
+            self._revision = None
+        self.reset_usage()
+
+    def _current_revision(self, session):
+        try:
+            return session.execute(
+                text("SELECT revision FROM activity_revision WHERE id = 1")
+            ).scalar()
+        except Exception:
+            # Not migrated yet: no way to tell, rebuild every time
+            return None
+
+    def _build(self, session):
+        from model import AMS_Activities, activity_users
+
+        members = {}
+        for activity_id, user_id in session.query(
+            activity_users.c.activity_id, activity_users.c.user_id
+        ):
+            members.setdefault(activity_id, set()).add(user_id)
+
+        rules = {}
+        activities = (
+            session.query(AMS_Activities)
+            .filter(AMS_Activities.deletedAt == None)
+            .order_by(AMS_Activities.id)
+        )
+        for activity in activities:
+            # Like .first() before: the oldest activity wins a duplicate code
+            rules.setdefault(str(activity.activityCode), ActivityRule(
+                id=activity.id,
+                code=str(activity.activityCode),
+                name=activity.activityName,
+                keys=str(activity.keys),
+                users=frozenset(members.get(activity.id, ())),
+                weekdays=weekday_mask(activity.weekDays),
+                time_from=activity.timeSlotFrom,
+                time_to=activity.timeSlotTo,
+                frequency=activity.frequency or 0,
+            ))
+        self.builds += 1
+        print(f"[AUTH] Activity index built: {len(rules)} activities")
+        return rules
+
+    def rules(self, session):
+        revision = self._current_revision(session)
+        with self._lock:
+            if revision is None or revision != self._revision:
+                self._rules = self._build(session)
+                self._revision = revision
+            return self._rules
+
+    # ---------------- Daily usage ----------------
+    def _seed_usage(self, session, day):
+        from model import AMS_Access_Log
+
+        start = datetime.combine(day, time.min)
+        rows = (
+            session.query(AMS_Access_Log.id, AMS_Access_Log.activityCode)
+            .filter(
+                AMS_Access_Log.activityCodeEntryTime >= start,
+                AMS_Access_Log.activityCodeEntryTime < start + timedelta(days=1),
+                AMS_Access_Log.activityCode != None,
+                AMS_Access_Log.keysTaken != "[]",
+            )
+            .all()
+        )
+        self._usage_ids = {row_id: _usage_key(code) for row_id, code in rows}
+        self._usage = Counter(self._usage_ids.values())
+        self._usage_day = day
+
+    def reset_usage(self):
+        """Recount today's uses from access_log on the next check."""
+        with self._lock:
+            self._usage_day = None
+
+    def usage_today(self, session, activity_code):
+        day = date.today()
+        with self._lock:
+            if self._usage_day != day:
+                self._seed_usage(session, day)
+            return self._usage[_usage_key(activity_code)]
+
+    def note_access_log(self, access_log):
+        """Count (or uncount) a flushed AMS_Access_Log row."""
+        with self._lock:
+            if self._usage_day is None or access_log.id is None:
+                return
+            previous = self._usage_ids.pop(access_log.id, None)
+            if previous is not None:
+                self._usage[previous] -= 1
+            if _counts_as_use(access_log, self._usage_day):
+                key = _usage_key(access_log.activityCode)
+                self._usage_ids[access_log.id] = key
+                self._usage[key] += 1
+
+    # ---------------- Decision ----------------
+    def get_keys_allowed(self, session, userid, activity_code, access_time):
+        """Same result dicts as AMS_Activities.get_keys_allowed()."""
+        from model import (
+            ACTIVITY_ALLOWED,
+            ACTIVITY_ERROR_CODE_INCORRECT,
+            ACTIVITY_ERROR_FREQUENCY_EXCEEDED,
+            ACTIVITY_ERROR_TIME_INVALID,
+            ACTIVITY_ERROR_USER_INVALID,
+            ACTIVITY_ERROR_WEEKDAY_INVALID,
+        )
+
+        rule = self.rules(session).get(str(activity_code))
+        if rule is None:
+            return {"ResultCode": ACTIVITY_ERROR_CODE_INCORRECT, "Message": "Wrong Act. Code"}
+
+        try:
+            user_id = int(userid)
+        except (TypeError, ValueError):
+            user_id = None
+        if user_id not in rule.users:
+            return {"ResultCode": ACTIVITY_ERROR_USER_INVALID, "Message": "User not allowed"}
+
+        now = access_time.time()
+        if rule.time_from is None or rule.time_to is None or not (
+            rule.time_from <= now <= rule.time_to
+        ):
+            return {"ResultCode": ACTIVITY_ERROR_TIME_INVALID, "Message": "Wrong time slot"}
+
+        if not rule.weekdays & (1 << access_time.weekday()):
+            return {"ResultCode": ACTIVITY_ERROR_WEEKDAY_INVALID, "Message": "Not allowed today"}
+
+        if rule.frequency and self.usage_today(session, rule.code) > rule.frequency:
+            return {
+                "ResultCode": ACTIVITY_ERROR_FREQUENCY_EXCEEDED,
+                "Message": "Frequency exceed",
+            }
+
+        return {
+            "ResultCode": ACTIVITY_ALLOWED,
+            "Message": rule.keys,
+            "Description": rule.name,
+        }
+
+
+_activity_index = None
+_activity_index_guard = threading.Lock()
+
+
+def _on_flush(session, flush_context):
+    from model import AMS_Access_Log
+
+    index = _activity_index
+    if index is None:
+        return
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, AMS_Access_Log):
+            index.note_access_log(obj)
+
+
+def _on_rollback(session, previous_transaction):
+    # Counted rows may not have been committed; recount on next use
+    index = _activity_index
+    if index is not None:
+        index.reset_usage()
+
+
+def get_activity_index():
+    """Process-wide ActivityAuthIndex; tracks access_log flushes of every Session."""
+    global _activity_index
+    with _activity_index_guard:
+        if _activity_index is None:
+            _activity_index = ActivityAuthIndex()
+            event.listen(Session, "after_flush", _on_flush)
+            event.listen(Session, "after_soft_rollback", _on_rollback)
+        return _activity_index
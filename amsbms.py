@@ -1,7 +1,33 @@
-import serial
+"""
+Reader for /dev/ttyAML1, shared by the card reader and the battery monitor.
+
+The board multiplexes three line types on the one port:
+
+    BATT=11.05      battery voltage
+    CHARGE...       charging status
+    ID=0012345678   card swipe
+
+One AMSBMS owns the port and demultiplexes the lines into latest-value
+caches (get_latest / wait_latest) and per-type event streams (subscribe).
+Use get_bms() for the process-wide instance instead of opening the port
+again.
+"""
+
 import time
-from datetime import datetime
-from threading import Thread, Lock
+from threading import Condition, Lock, Thread
+
+import hal
+
+FRAME_BATTERY = "battery"
+FRAME_CHARGING = "charging"
+FRAME_ID = "id"
+
+# A card held against the reader is reported over and over; the same number
+# again within this many seconds of its last report counts as one swipe.
+CARD_REPEAT_WINDOW = 1.5
+
+# get_bms() retries a port that failed to open at most this often (seconds)
+BMS_REOPEN_INTERVAL = 10.0
 
 
 class AMSBMS:
@@ -15,37 +41,51 @@ class AMSBMS:
         self.running = False
         self.thread = None
         self.lock = Lock()
+        # Notified whenever a new line has been cached
+        self._updated = Condition(self.lock)
 
-        # latest values
+        # latest values, cleared by the get_*() readers below
         self.cardNo = None
         self.battery_voltage = None
         self.charging_status = None
 
+        # latest value of every line type: type -> (value, time.monotonic())
+        self.latest = {}
+
+        # callbacks per line type (run on the reader thread)
+        self._subscribers = {FRAME_BATTERY: [], FRAME_CHARGING: [], FRAME_ID: []}
+        self._last_card = None
+        self._last_card_at = 0.0
+        self.cards_suppressed = 0
+        self.opened_at = None
+
+        self.open()
+
+    def open(self):
+        """Open the port and start the reader thread; True if it is open."""
+        if self.ser is not None:
+            return True
+        self.opened_at = time.monotonic()
         try:
-            self.ser = serial.Serial(
-                port=self.port,
-                baudrate=self.baud,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE,
-                bytesize=serial.EIGHTBITS,
-                timeout=self.timeout
-            )
+            self.ser = hal.open_serial(self.port, baudrate=self.baud, timeout=self.timeout)
             print(f"✅ Opened {self.port} at {self.baud} baud")
             self.running = True
             self.thread = Thread(target=self._reader, daemon=True)
             self.thread.start()
+            return True
         except Exception as e:
             print(f"⚠️ Error opening {self.port}: {e}")
+            return False
 
     def _parse_message(self, line: str):
         """Parse a single line from BMS."""
         line = line.strip()
         if line.startswith("BATT="):
-            return {"type": "battery", "voltage": line.split("=")[1]}
+            return {"type": FRAME_BATTERY, "value": line.split("=")[1]}
         elif line.startswith("CHARGE"):
-            return {"type": "charging", "status": line}
+            return {"type": FRAME_CHARGING, "value": line}
         elif line.startswith("ID="):
-            return {"type": "id", "value": line.split("=")[1]}
+            return {"type": FRAME_ID, "value": line.split("=")[1]}
         else:
             return {"type": "unknown", "raw": line}
 
@@ -61,27 +101,106 @@ class AMSBMS:
                         line = str(raw)
 
                     parsed = self._parse_message(line)
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                    with self.lock:
-                        if parsed["type"] == "battery":
-                            self.battery_voltage = parsed["voltage"]
-                        elif parsed["type"] == "charging":
-                            self.charging_status = parsed["status"]
-                        elif parsed["type"] == "id":
-                            self.cardNo = parsed["value"]
-
-                    # with open(self.logfile, 'w') as f:
-                    #     f.write(f"{self.charging_status or ''},{self.battery_voltage or ''},{self.cardNo or ''}")
-                    #     f.close()
+                    if parsed["type"] in self._subscribers:
+                        self._publish(parsed["type"], parsed["value"])
+                    # Battery history is kept by battery_telemetry.py
+                    continue
 
             except Exception as e:
                 print(f"⚠️ Error reading: {e}")
+            # Only back off when nothing arrived; readline() already blocks
             time.sleep(0.1)
 
+    def _publish(self, kind, value):
+        now = time.monotonic()
+        with self.lock:
+            if kind == FRAME_ID:
+                repeat = (
+                    value == self._last_card
+                    and now - self._last_card_at < CARD_REPEAT_WINDOW
+                )
+                self._last_card = value
+                self._last_card_at = now
+                if repeat:
+                    self.cards_suppressed += 1
+                    return
+                self.cardNo = value
+            elif kind == FRAME_BATTERY:
+                self.battery_voltage = value
+            else:
+                self.charging_status = value
+            self.latest[kind] = (value, now)
+            self._updated.notify_all()
+
+        for callback in list(self._subscribers[kind]):
+            try:
+                callback(value)
+            except Exception as e:
+                print(f"⚠️ {kind} subscriber failed: {e}")
+
+    # ---------------- Event streams ----------------
+    def subscribe(self, kind, callback):
+        """callback(value) for every FRAME_* line of that kind (reader thread)."""
+        if callback not in self._subscribers[kind]:
+            self._subscribers[kind].append(callback)
+
+    def unsubscribe(self, kind, callback):
+        if callback in self._subscribers[kind]:
+            self._subscribers[kind].remove(callback)
+
+    def subscribe_cards(self, callback):
+        """callback(card_no) once per swipe, on the reader thread."""
+        self.subscribe(FRAME_ID, callback)
+
+    def unsubscribe_cards(self, callback):
+        self.unsubscribe(FRAME_ID, callback)
+
+    # ---------------- Latest values ----------------
+    def get_latest(self, kind, max_age=None):
+        """Last value of a line type without consuming it (None if older than max_age)."""
+        with self.lock:
+            entry = self.latest.get(kind)
+        if entry is None:
+            return None
+        value, at = entry
+        if max_age is not None and time.monotonic() - at > max_age:
+            return None
+        return value
+
+    def wait_latest(self, kind, timeout):
+        """get_latest(), waiting up to timeout s for the first value to arrive."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while kind not in self.latest:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return None
+                self._updated.wait(remaining)
+            return self.latest[kind][0]
+
+    def wait_card(self, timeout, max_age=None):
+        """
+        Take the pending swipe, waiting up to timeout s for one. A pending
+        swipe older than max_age s is discarded instead of returned.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                if self.cardNo is not None:
+                    card_no, self.cardNo = self.cardNo, None
+                    at = self.latest[FRAME_ID][1]
+                    if max_age is None or time.monotonic() - at <= max_age:
+                        return card_no
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return None
+                self._updated.wait(remaining)
+
     def stop(self):
         """Stop background thread and close serial."""
         self.running = False
+        with self.lock:
+            self._updated.notify_all()
         if self.thread:
             self.thread.join(timeout=1)
         if self.ser:
@@ -106,6 +225,34 @@ class AMSBMS:
             self.cardNo = None
             return value
 
+
+_bms = None
+_bms_guard = Lock()
+
+
+def get_bms():
+    """
+    Process-wide AMSBMS on /dev/ttyAML1, opened on first use. If the port
+    could not be opened, later calls try again (every BMS_REOPEN_INTERVAL
+    seconds at most) on the same instance, so subscribers stay attached.
+    """
+    global _bms
+    with _bms_guard:
+        if _bms is None:
+            _bms = AMSBMS()
+        elif _bms.ser is None and time.monotonic() - _bms.opened_at >= BMS_REOPEN_INTERVAL:
+            _bms.open()
+        return _bms
+
+
+def stop_bms():
+    global _bms
+    with _bms_guard:
+        bms, _bms = _bms, None
+    if bms is not None:
+        bms.stop()
+
+
 if __name__ == "__main__":
     bms = AMSBMS()
 
@@ -2,9 +2,19 @@ from time import sleep
 import can
 import ctypes
 import logging
+import subprocess
 import threading
+import time
+import queue
+from collections import namedtuple
+
+import hal
+from amscan_stats import CanStats
+from amscan_trace import TRACE_DEFAULT_RECORDS, CanRecorder
 
 CHANNEL_NAME = "can0"
+CAN_INTERFACE = "socketcan"
+CAN_BITRATE = 125000
 CAN_SOURCE_MASK = 0x0FF00000
 CAN_DESTINATION_MASK = 0x000FF000
 CAN_MSG_TYPE_MASK = 0x00000E00
@@ -48,15 +58,252 @@ CAN_KEY_UNLOCKED = 1
 CAN_AMS_DOOR_CLOSED = 0
 CAN_AMS_DOOR_OPEN = 1
 
+# How long a command waits for its ACK/RESPONSE (seconds) until a strip has
+# answered a few times. After that each strip gets its own timeout from its
+# smoothed round-trip time (srtt + 4 * rttvar), kept within
+# [CAN_RTO_MIN, CAN_RTO_MAX] and doubled after every timeout.
+CAN_RESPONSE_TIMEOUT = 0.2
+CAN_RTO_MIN = 0.03
+CAN_RTO_MAX = 1.0
+
+# Idempotent commands are re-sent this many times before they count as failed.
+CAN_MAX_RETRANSMITS = 2
+
+# Replies only identify a command by (strip id, function), so only one may
+# be in flight per pair, from the blocking and the async API alike. A send
+# waits this long (seconds) for the pair to be free before it fails.
+CAN_KEY_CLAIM_TIMEOUT = 2.0
+
+# Most frames execute_batch keeps in flight at once; keeps bursts (e.g. a
+# 4 x 14 peg scan) inside the CAN controller's transmit queue.
+CAN_MAX_IN_FLIGHT = 8
+
+# Extra rounds scan_strip()/scan_all() spend on slots that did not answer.
+CAN_SCAN_RETRIES = 2
+SLOTS_PER_STRIP = 14
+
+# Strip ids probed at boot and how long discovery waits for them (seconds).
+CAN_STRIP_CANDIDATES = (1, 2, 3, 4)
+CAN_DISCOVERY_TIMEOUT = 0.5
+
+# Acknowledged LED/lock state older than this (seconds) is treated as
+# unknown, so the next command for it is sent even if it looks redundant.
+CAN_SHADOW_MAX_AGE = 30.0
+
+SHADOW_LED = "led"
+SHADOW_LOCK = "lock"
+
+# Bus supervisor: health check period (seconds), failed sends in a row that
+# mark the bus dead, how long error-passive may last before the bus is
+# re-created, and the longest wait between failed recovery attempts.
+CAN_SUPERVISOR_INTERVAL = 1.0
+CAN_SEND_ERROR_LIMIT = 3
+CAN_ERROR_PASSIVE_GRACE = 10.0
+CAN_RECOVERY_BACKOFF_MAX = 30.0
+
+BUS_STATE_ACTIVE = "active"
+BUS_STATE_PASSIVE = "passive"
+BUS_STATE_OFF = "bus-off"
+
+# SocketCAN error frame bits (linux/can/error.h)
+CAN_ERR_CRTL = 0x004
+CAN_ERR_BUSOFF = 0x040
+CAN_ERR_RESTARTED = 0x100
+CAN_ERR_CRTL_RX_PASSIVE = 0x10
+CAN_ERR_CRTL_TX_PASSIVE = 0x20
+CAN_ERR_CRTL_ACTIVE = 0x40
+
+KEY_EVENT_TAKEN = "taken"
+KEY_EVENT_INSERTED = "inserted"
+
+# Key events waiting for a get_key_event() consumer. The queue only exists
+# once something has called get_key_event(); when full the oldest event is
+# dropped and counted in AMS_CAN.key_events_dropped.
+KEY_EVENT_QUEUE_SIZE = 256
+
+# kind: KEY_EVENT_TAKEN / KEY_EVENT_INSERTED, peg_id: int, strip: strip id,
+# slot: 1–14, timestamp: time.time() when the frame was decoded.
+KeyEvent = namedtuple("KeyEvent", ["kind", "peg_id", "strip", "slot", "timestamp"])
+
+
+CAN_RX_FILTERS = [
+    {"can_id": CAN_IMX_ID << 12, "can_mask": CAN_DESTINATION_MASK, "extended": True},
+    {"can_id": CAN_IMX_ID << 20, "can_mask": CAN_SOURCE_MASK, "extended": True},
+]
+
+# Functions whose low nibble carries the key position (KEY_ID, KEY_TAKEN,
+# KEY_INSERTED) collapse to their base code; every other function is its
+# own class. Indexed by the 9-bit function field of the arbitration id.
+_FUNCTION_CLASS = tuple(
+    function & (CAN_FUNCTION_MASK & ~CAN_KEY_POSITION_MASK)
+    if function >= CAN_FUNCTION_KEY_ID
+    else function
+    for function in range(CAN_FUNCTION_MASK + 1)
+)
+
+# Names used for per-function statistics, by function class.
+_FUNCTION_NAMES = {
+    CAN_FUNCTION_NEW_DEVICE: "NEW_DEVICE",
+    CAN_FUNCTION_VERSION: "VERSION",
+    CAN_FUNCTION_SINGLE_LED: "SINGLE_LED",
+    CAN_FUNCTION_ALL_LEDS: "ALL_LEDS",
+    CAN_FUNCTION_SINGLE_KEYLOCK: "SINGLE_KEYLOCK",
+    CAN_FUNCTION_ALL_KEYLOCKS: "ALL_KEYLOCKS",
+    CAN_FUNCTION_BOXLOCK: "BOXLOCK",
+    CAN_FUNCTION_BOX_DOOR_SENSOR: "BOX_DOOR_SENSOR",
+    CAN_FUNCTION_UNIQUE_ID: "UNIQUE_ID",
+    CAN_FUNCTION_KEY_ID: "KEY_ID",
+    CAN_FUNCTION_KEY_TAKEN: "KEY_TAKEN",
+    CAN_FUNCTION_KEY_INSERTED: "KEY_INSERTED",
+}
+
+# Commands that are safe to send twice (the strip ends up in the same state).
+_RETRANSMIT_COMMANDS = frozenset((
+    "get_version_number",
+    "set_all_LED_ON",
+    "set_all_LED_OFF",
+    "set_single_LED_state",
+    "set_single_key_lock_state",
+    "lock_all_positions",
+    "unlock_all_positions",
+))
+
+# Functions we send commands for and therefore expect ACK/RESPONSE frames.
+_COMMAND_FUNCTION_CLASSES = (
+    CAN_FUNCTION_VERSION,
+    CAN_FUNCTION_SINGLE_LED,
+    CAN_FUNCTION_ALL_LEDS,
+    CAN_FUNCTION_SINGLE_KEYLOCK,
+    CAN_FUNCTION_ALL_KEYLOCKS,
+    CAN_FUNCTION_BOXLOCK,
+    CAN_FUNCTION_BOX_DOOR_SENSOR,
+    CAN_FUNCTION_KEY_ID,
+)
+
 
 def _get_message(msg):
     return msg
 
 
-class AMS_CAN(object):
+def create_arbitration_id(source, destination, message_type, function):
+    arbitration_id = 0x0
+    arbitration_id |= (source & 0xFF) << 20
+    arbitration_id |= (destination & 0xFF) << 12
+    arbitration_id |= (message_type & 0x7) << 9
+    arbitration_id |= function & CAN_FUNCTION_MASK
+    return arbitration_id
+
+
+class _PendingRequest(object):
+    """A command in flight, completed by the notifier thread on ACK/RESPONSE."""
+
+    __slots__ = ("list_id", "function", "expect_data", "event", "data",
+                 "sent_at", "replied_at", "on_reply", "attempt")
+
+    def __init__(self, list_id, function, expect_data=False, on_reply=None,
+                 attempt=0):
+        self.list_id = list_id
+        self.function = function
+        self.expect_data = expect_data
+        # 0 for the first transmission, n for the n-th retransmission
+        self.attempt = attempt
+        self.event = threading.Event()
+        # Called (on the notifier thread) once the reply is in, for
+        # callers that do not block on event (see amscan_async).
+        self.on_reply = on_reply
+        self.data = None
+        self.sent_at = None
+        self.replied_at = None
+
+    @property
+    def key(self):
+        return (self.list_id, self.function)
+
+
+class _RttEstimator(object):
+    """Smoothed round-trip time of one strip and the timeout derived from it.
+
+    Same scheme as TCP (RFC 6298): srtt/rttvar are updated from replies to
+    first transmissions only, and the timeout doubles after each miss.
+    """
+
+    __slots__ = ("srtt", "rttvar", "rto")
+
+    def __init__(self, initial_rto):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, CAN_RTO_MIN), CAN_RTO_MAX)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, CAN_RTO_MAX)
+
+
+class _StripShadow(object):
+    """Last acknowledged LED and lock state of one strip.
+
+    Each value is stored as (state, acked_at). An ALL_LEDS/ALL_KEYLOCKS
+    command sets the strip-wide value and clears the per-position ones.
+    """
+
     def __init__(self):
+        self.all = {SHADOW_LED: None, SHADOW_LOCK: None}
+        self.slots = {SHADOW_LED: {}, SHADOW_LOCK: {}}
+
+    def matches(self, kind, position, state, max_age, now):
+        """True if the strip is known (recently enough) to be in this state."""
+        def fresh(entry):
+            return (
+                entry is not None
+                and entry[0] == state
+                and now - entry[1] <= max_age
+            )
+
+        if position is None:
+            return fresh(self.all[kind]) and all(
+                fresh(entry) for entry in self.slots[kind].values()
+            )
+        entry = self.slots[kind].get(position, self.all[kind])
+        return fresh(entry)
+
+    def set(self, kind, position, state, now):
+        if position is None:
+            self.all[kind] = (state, now)
+            self.slots[kind].clear()
+        else:
+            self.slots[kind][position] = (state, now)
 
-        self._channel_name = CHANNEL_NAME
+    def forget(self, kind, position):
+        if position is None:
+            self.all[kind] = None
+            self.slots[kind].clear()
+        else:
+            # Unknown, even if the strip-wide value says otherwise
+            self.slots[kind][position] = None
+
+
+class AMS_CAN(object):
+    def __init__(self, response_timeout=CAN_RESPONSE_TIMEOUT,
+                 channel=None, interface=None,
+                 shadow_max_age=CAN_SHADOW_MAX_AGE, record_path=None,
+                 max_retransmits=CAN_MAX_RETRANSMITS):
+
+        # channel/interface can point at a vcan device or python-can's
+        # "virtual" bus to run against amscan_sim instead of real strips.
+        # Without either, the HAL picks can0 or its fake bus (AMS_HAL).
+        if channel is None and interface is None:
+            bus = hal.can_bus_kwargs(CHANNEL_NAME, CAN_INTERFACE)
+            channel, interface = bus["channel"], bus["interface"]
+        self._channel_name = channel or CHANNEL_NAME
+        self._interface = interface or CAN_INTERFACE
         self._can_controller_id = CAN_IMX_ID
         self._Is_initialized = False
         self._current_function = None
@@ -69,424 +316,1110 @@ class AMS_CAN(object):
         # so background threads cannot interleave CAN messages.
         self._can_lock = threading.Lock()
 
-        # Key events (written by notifier thread, read by poll thread)
-        self.key_inserted_event = False
-        self.key_inserted_id = None          # peg id (int)
-        self.key_taken_event = False
-        self.key_taken_id = None             # peg id (int)
+        # In-flight commands keyed by (strip id, function code). The notifier
+        # thread completes them the moment the matching ACK/RESPONSE arrives.
+        # response_timeout is the starting timeout of every strip; see
+        # request_timeout() for the adaptive one.
+        self.response_timeout = response_timeout
+        self.max_retransmits = max_retransmits
+        self._rtt = {}
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # Notified whenever a (strip, function) pair is released
+        self._pending_released = threading.Condition(self._pending_lock)
+        self.key_claim_timeouts = 0
 
-        # Physical positions
-        self.key_inserted_position_slot = None   # 1–14
-        self.key_taken_position_slot = None
-        self.key_inserted_position_list = None   # strip id (1,2,...)
-        self.key_taken_position_list = None
+        # Shadow of each strip's LED/lock state, updated on ACK (strip id ->
+        # _StripShadow). Commands that would not change it are skipped
+        # unless force=True; entries expire after shadow_max_age seconds.
+        self.shadow_max_age = shadow_max_age
+        self._shadow = {}
+        self.shadow_skipped = 0
+
+        # Round-trip latency histograms, timeouts, retransmits, bus errors
+        self.stats = CanStats()
+
+        # Optional ring-file recording of every frame sent and received
+        # (amscan_trace.py dumps and replays it).
+        self.recorder = None
+        if record_path:
+            self.start_recording(record_path)
+
+        # Key events (written by notifier thread, consumed with get_key_event()
+        # or delivered to subscribers registered with subscribe_key_events()).
+        # The queue is created by the first get_key_event(), so nothing piles
+        # up in it when every consumer subscribes instead.
+        self._key_events = None
+        self._key_events_guard = threading.Lock()
+        self._key_event_subscribers = []
+        self.key_events_dropped = 0
 
         self.key_lists = []
         self.key_lists_version = {}
 
-        self.bus = can.Bus(channel="can0", bustype="socketcan", bitrate=125000)
+        # Set once discover_strips() has finished; other components wait on
+        # it with wait_until_ready() instead of probing strips themselves.
+        self.ready = threading.Event()
+
+        self._dispatch = self._build_dispatch_table()
+
+        # Bus health, watched by the supervisor (start_supervisor())
+        self.bus_state = BUS_STATE_ACTIVE
+        self.bus_recoveries = 0
+        self._passive_since = None
+        self._send_errors = 0
+        self._supervisor_thread = None
+        self._supervisor_stop = threading.Event()
+
+        self._open_bus()
+
+    def _open_bus(self):
+        # Kernel-side filters: only frames addressed to us, or strips echoing
+        # our own GET (source == CAN_IMX_ID), are delivered to Python.
+        self.bus = can.Bus(
+            channel=self._channel_name,
+            bustype=self._interface,
+            bitrate=CAN_BITRATE,
+            can_filters=CAN_RX_FILTERS,
+        )
 
         self.buffer = can.BufferedReader()
         self.buffer.on_message_received = self._on_message_received
         self.notifier = can.Notifier(self.bus, [_get_message, self.buffer])
 
+    def _close_bus(self):
+        try:
+            self.notifier.stop(timeout=1)
+        except Exception as e:
+            print("AMS_CAN: stopping notifier failed: " + str(e))
+        try:
+            self.bus.shutdown()
+        except Exception as e:
+            print("AMS_CAN: bus shutdown failed: " + str(e))
+
     def create_arbitration_id(self, source, destination, message_type, function):
-        arbitration_id = 0x0
-        arbitration_id |= (source & 0xFF) << 20
-        arbitration_id |= (destination & 0xFF) << 12
-        arbitration_id |= (message_type & 0x7) << 9
-        arbitration_id |= function & CAN_FUNCTION_MASK
-        return arbitration_id
+        return create_arbitration_id(source, destination, message_type, function)
+
+    def _build_dispatch_table(self):
+        """Map (message type, function class) to the handler for that frame."""
+        table = {}
+
+        # INIT PROCEDURE
+        for message_type in range((CAN_MSG_TYPE_MASK >> 9) + 1):
+            table[(message_type, CAN_FUNCTION_UNIQUE_ID)] = self._on_unique_id
+        table[(CAN_MSG_TYPE_GET, CAN_FUNCTION_NEW_DEVICE)] = self._on_new_device_get
+        table[(CAN_MSG_TYPE_ACK, CAN_FUNCTION_NEW_DEVICE)] = self._on_new_device_ack
+
+        # Replies to our own commands
+        for function in _COMMAND_FUNCTION_CLASSES:
+            table[(CAN_MSG_TYPE_ACK, function)] = self._on_ack
+            table[(CAN_MSG_TYPE_RESPONSE, function)] = self._on_response
+            table[(CAN_MSG_TYPE_GET, function)] = self._on_echoed_get
+
+        # Key events
+        table[(CAN_MSG_TYPE_SET, CAN_FUNCTION_KEY_TAKEN)] = self._on_key_taken
+        table[(CAN_MSG_TYPE_SET, CAN_FUNCTION_KEY_INSERTED)] = self._on_key_inserted
+        return table
 
     def _on_message_received(self, msg):
         # print("\nCAN MESSAGE RECEIVED : " + str(msg))
-        source_list = (msg.arbitration_id & CAN_SOURCE_MASK) >> 20
-        destination = (msg.arbitration_id & CAN_DESTINATION_MASK) >> 12
-        message_type = (msg.arbitration_id & CAN_MSG_TYPE_MASK) >> 9
-        function_type = msg.arbitration_id & CAN_FUNCTION_MASK
+        if self.recorder is not None:
+            self.recorder.record(msg)
+        if msg.is_error_frame:
+            self._on_error_frame(msg)
+            return
+        arbitration_id = msg.arbitration_id
+        message_type = (arbitration_id & CAN_MSG_TYPE_MASK) >> 9
+        function_type = arbitration_id & CAN_FUNCTION_MASK
+        handler = self._dispatch.get(
+            (message_type, _FUNCTION_CLASS[function_type])
+        )
+        if handler is None:
+            return
+        source_list = (arbitration_id & CAN_SOURCE_MASK) >> 20
+        destination = (arbitration_id & CAN_DESTINATION_MASK) >> 12
+        handler(msg, source_list, destination, function_type)
 
-        # INIT PROCEDURE - Process query from Key-List(s) and send ACK
-        new_device_id = 0
-        if (
-            source_list == 0
-            and function_type == CAN_FUNCTION_UNIQUE_ID
-            and destination == CAN_IMX_ID
+    def _on_error_frame(self, msg):
+        """Track the controller state from SocketCAN error frames."""
+        self.stats.record_bus_error()
+        error_class = msg.arbitration_id
+        controller = msg.data[1] if len(msg.data) > 1 else 0
+        if error_class & CAN_ERR_BUSOFF:
+            if self.bus_state != BUS_STATE_OFF:
+                print("#### AMS_CAN - CAN controller is bus-off")
+            self.bus_state = BUS_STATE_OFF
+        elif error_class & CAN_ERR_RESTARTED or (
+            error_class & CAN_ERR_CRTL and controller & CAN_ERR_CRTL_ACTIVE
         ):
-            # Send ACK to UNIQUE ID message
-            print("\nINIT--RECV--[1]: LIST -> IMX - UNIQUE ID Message Received")
-            arb_id = self.create_arbitration_id(
-                CAN_IMX_ID, 0x0, CAN_MSG_TYPE_ACK, CAN_FUNCTION_UNIQUE_ID
-            )
+            self.bus_state = BUS_STATE_ACTIVE
+            self._passive_since = None
+        elif error_class & CAN_ERR_CRTL and controller & (
+            CAN_ERR_CRTL_RX_PASSIVE | CAN_ERR_CRTL_TX_PASSIVE
+        ):
+            if self.bus_state == BUS_STATE_ACTIVE:
+                print("#### AMS_CAN - CAN controller is error-passive")
+                self._passive_since = time.monotonic()
+            self.bus_state = BUS_STATE_PASSIVE
 
-            msg_out = can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
-            self._current_function = CAN_FUNCTION_UNIQUE_ID
-            self._current_function_ack = True
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg_out)
-            sleep(0.2)
-            print(
-                "\nINIT--SENT--[2]: IMS -> LIST - ACK message sent to UNIQUE ID Message"
-            )
+    # INIT PROCEDURE - Process query from Key-List(s) and send ACK
+    def _on_unique_id(self, msg, source_list, destination, function_type):
+        if source_list != 0 or destination != CAN_IMX_ID:
+            return
+        # Send ACK to UNIQUE ID message
+        print("\nINIT--RECV--[1]: LIST -> IMX - UNIQUE ID Message Received")
+        arb_id = self.create_arbitration_id(
+            CAN_IMX_ID, 0x0, CAN_MSG_TYPE_ACK, CAN_FUNCTION_UNIQUE_ID
+        )
 
-            # Send device id to list
-            arb_id = self.create_arbitration_id(
-                CAN_IMX_ID, 0x0, CAN_MSG_TYPE_SET, CAN_FUNCTION_NEW_DEVICE
-            )
+        msg_out = can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
+        self._current_function = CAN_FUNCTION_UNIQUE_ID
+        self._current_function_ack = True
+        self._current_function_response = False
+        self._current_function_response_data = None
+        self.send_message(msg_out)
+        sleep(0.2)
+        print(
+            "\nINIT--SENT--[2]: IMS -> LIST - ACK message sent to UNIQUE ID Message"
+        )
 
-            new_device_id = len(self.key_lists) + 1
-            self.key_lists.append(new_device_id)
-            msg_out = can.Message(
-                arbitration_id=arb_id, data=[new_device_id], is_extended_id=True
-            )
-            self._current_function = CAN_FUNCTION_NEW_DEVICE
-            self._current_function_list_id = new_device_id
-            self._current_function_ack = True
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg_out)
-            sleep(0.2)
-            print(
-                "\nINIT--SENT--[3]: IMS -> LIST - DEVICE ID message sent 1st Time [LIST Id - "
-                + str(new_device_id)
-            )
+        # Send device id to list
+        arb_id = self.create_arbitration_id(
+            CAN_IMX_ID, 0x0, CAN_MSG_TYPE_SET, CAN_FUNCTION_NEW_DEVICE
+        )
 
-        if (
-            source_list == 0
-            and function_type == CAN_FUNCTION_NEW_DEVICE
-            and message_type == CAN_MSG_TYPE_ACK
-        ):
+        new_device_id = len(self.key_lists) + 1
+        self.key_lists.append(new_device_id)
+        msg_out = can.Message(
+            arbitration_id=arb_id, data=[new_device_id], is_extended_id=True
+        )
+        self._current_function = CAN_FUNCTION_NEW_DEVICE
+        self._current_function_list_id = new_device_id
+        self._current_function_ack = True
+        self._current_function_response = False
+        self._current_function_response_data = None
+        self.send_message(msg_out)
+        sleep(0.2)
+        print(
+            "\nINIT--SENT--[3]: IMS -> LIST - DEVICE ID message sent 1st Time [LIST Id - "
+            + str(new_device_id)
+        )
+
+    def _on_new_device_get(self, msg, source_list, destination, function_type):
+        if source_list == 0:
+            return
+        # The strip has (re)booted: its LEDs and locks are back to defaults
+        self.invalidate_shadow(source_list)
+        # Send ACK to List
+        arb_id = self.create_arbitration_id(
+            CAN_IMX_ID, source_list, CAN_MSG_TYPE_ACK, CAN_FUNCTION_NEW_DEVICE
+        )
+        msg_out = can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
+        self._current_function = CAN_FUNCTION_NEW_DEVICE
+        self._current_function_list_id = source_list
+        self._current_function_ack = True
+        self._current_function_response = False
+        self._current_function_response_data = None
+        self.send_message(msg_out)
+        print(
+            "\nINIT--SENT--[5]: IMX -> ACK message to LIST [LIST ID - "
+            + str(source_list)
+        )
+
+        # Send device id to list - 2nd time
+        arb_id = self.create_arbitration_id(
+            CAN_IMX_ID, source_list, CAN_MSG_TYPE_SET, CAN_FUNCTION_NEW_DEVICE
+        )
+
+        msg_out = can.Message(
+            arbitration_id=arb_id, data=[source_list], is_extended_id=True
+        )
+
+        self._current_function = CAN_FUNCTION_NEW_DEVICE
+        self._current_function_list_id = source_list
+        self._current_function_ack = False
+        self._current_function_response = True
+        self._current_function_response_data = None
+        self.send_message(msg_out)
+        sleep(0.2)
+        print(
+            "\nINIT--SENT--[6]: IMX -> LIST - ACK for LIST DEVICE ID message sent [LIST Id - "
+            + str(source_list)
+        )
+
+    # INIT PROCEDURE - Process response from Key-List and add the list to AMS-CAN key-list[]
+    def _on_new_device_ack(self, msg, source_list, destination, function_type):
+        if source_list == 0:
             self._current_function = CAN_FUNCTION_NEW_DEVICE
             self._current_function_list_id = source_list
             print(
                 "\nINIT--RECV--[4]: LIST -> IMS - ACK for DEVICE ID message received from LIST [LIST Id - "
                 + str(source_list)
             )
-        if (
-            source_list != 0
-            and function_type == CAN_FUNCTION_NEW_DEVICE
-            and message_type == CAN_MSG_TYPE_GET
+            return
+
+        print(
+            "\nINIT--RECV--[7]: LIST -> IMX - ACK  received from LIST for 2nd DEVICE ID message [LIST Id - "
+            + str(source_list)
+        )
+        self._current_function = None
+        self._current_function_list_id = source_list
+        self._current_function_ack = True
+        self._current_function_response = False
+        self._current_function_response_data = None
+
+    # HARDWARE BUG WORKAROUND:
+    # The key strips sometimes respond to a CAN_MSG_TYPE_GET request by echoing 
+    # the exact requested arbitration ID and appending the data payload.
+    # In this echoed ID, source is CAN_IMX_ID and destination is the list_ID!
+    def _on_echoed_get(self, msg, source_list, destination, function_type):
+        if len(msg.data) > 0 and self._complete_request(
+            destination, function_type, msg.data
         ):
-            # Send ACK to List
-            arb_id = self.create_arbitration_id(
-                CAN_IMX_ID, source_list, CAN_MSG_TYPE_ACK, CAN_FUNCTION_NEW_DEVICE
+            if function_type == CAN_FUNCTION_VERSION:
+                if destination not in self.key_lists:
+                    self.key_lists.append(destination)
+
+    # Normal commands to IMX
+    def _on_ack(self, msg, source_list, destination, function_type):
+        if destination == CAN_IMX_ID:
+            self._complete_request(source_list, function_type)
+
+    def _on_response(self, msg, source_list, destination, function_type):
+        if destination != CAN_IMX_ID:
+            return
+        self._complete_request(source_list, function_type, msg.data)
+        if function_type == CAN_FUNCTION_VERSION:
+            if source_list not in self.key_lists:
+                self.key_lists.append(source_list)
+
+    # KEY TAKEN
+    def _on_key_taken(self, msg, source_list, destination, function_type):
+        if destination != CAN_IMX_ID:
+            return
+        slot = (function_type & CAN_KEY_POSITION_MASK) + 1
+        print("#### Key taken from slot no: " + str(slot))
+        self._publish_key_event(KEY_EVENT_TAKEN, msg.data, source_list, slot)
+
+    # KEY INSERTED
+    def _on_key_inserted(self, msg, source_list, destination, function_type):
+        if destination != CAN_IMX_ID:
+            return
+        slot = (function_type & CAN_KEY_POSITION_MASK) + 1
+        print("#### AMS_CAN - Key inserted at slot no: " + str(slot))
+        self._publish_key_event(KEY_EVENT_INSERTED, msg.data, source_list, slot)
+
+    # ---------------------------------------------------------
+    # KEY EVENTS
+    # ---------------------------------------------------------
+    def _publish_key_event(self, kind, data, strip, slot):
+        """Queue a key event and hand it to subscribers (notifier thread)."""
+        try:
+            peg_id = int(self._decode_key_fob_id(data))
+        except ValueError:
+            print("#### AMS_CAN - Key event without peg id on strip "
+                  + str(strip) + " slot " + str(slot))
+            return
+        event = KeyEvent(kind, peg_id, strip, slot, time.time())
+
+        events = self._key_events
+        if events is not None:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Only the notifier thread produces, so after discarding the
+                # oldest entry there is room again.
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+                self.key_events_dropped += 1
+                print("#### AMS_CAN - Key event queue full, dropped oldest event")
+                events.put_nowait(event)
+
+        for callback in list(self._key_event_subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                print("#### AMS_CAN - Key event subscriber failed: " + str(e))
+
+    def get_key_event(self, timeout=None):
+        """Return the next KeyEvent, blocking up to timeout seconds (None = forever).
+
+        Events are only queued from the first call on; earlier ones went
+        to subscribers only.
+
+        Returns None if no event arrived in time.
+        """
+        events = self._key_events
+        if events is None:
+            with self._key_events_guard:
+                if self._key_events is None:
+                    self._key_events = queue.Queue(maxsize=KEY_EVENT_QUEUE_SIZE)
+                events = self._key_events
+        try:
+            return events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear_key_events(self):
+        """Discard queued key events, e.g. before a new session starts."""
+        events = self._key_events
+        while events is not None:
+            try:
+                events.get_nowait()
+            except queue.Empty:
+                return
+
+    def subscribe_key_events(self, callback):
+        """Call callback(event) for every KeyEvent. Runs on the notifier thread."""
+        if callback not in self._key_event_subscribers:
+            self._key_event_subscribers.append(callback)
+
+    def unsubscribe_key_events(self, callback):
+        if callback in self._key_event_subscribers:
+            self._key_event_subscribers.remove(callback)
+
+    # ---------------------------------------------------------
+    # REQUEST / RESPONSE MATCHING
+    # ---------------------------------------------------------
+    def _complete_request(self, list_ID, function, data=None):
+        """Called from the notifier thread when a reply for (list_ID, function) arrives.
+
+        An ACK without payload does not complete a request that expects data
+        (e.g. VERSION or KEY_ID); the caller keeps waiting for the RESPONSE.
+        """
+        with self._pending_lock:
+            pending = self._pending.get((list_ID, function))
+        if pending is None:
+            return False
+        if data is not None and len(data) > 0:
+            pending.data = data
+        elif pending.expect_data:
+            return False
+        pending.replied_at = time.monotonic()
+        pending.event.set()
+        if pending.on_reply is not None:
+            pending.on_reply()
+        return True
+
+    def _send_request(self, list_ID, message_type, function, data=None,
+                      expect_data=False, remote=False, on_reply=None, attempt=0,
+                      claim_timeout=CAN_KEY_CLAIM_TIMEOUT):
+        """Register a pending request and put its frame on the bus.
+
+        If another command (blocking or async) is in flight for the same
+        (strip, function), waits up to claim_timeout seconds for it to
+        finish first, since its reply could not be told apart from ours.
+
+        Returns the _PendingRequest, or None if the frame could not be sent.
+        """
+        arb_id = self.create_arbitration_id(
+            self._can_controller_id, list_ID, message_type, function
+        )
+        if remote:
+            msg = can.Message(
+                arbitration_id=arb_id,
+                data=[],
+                is_extended_id=True,
+                is_remote_frame=True,
+                dlc=5,
             )
-            msg_out = can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
-            self._current_function = CAN_FUNCTION_NEW_DEVICE
-            self._current_function_list_id = source_list
-            self._current_function_ack = True
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg_out)
-            print(
-                "\nINIT--SENT--[5]: IMX -> ACK message to LIST [LIST ID - "
-                + str(source_list)
+        else:
+            msg = can.Message(
+                arbitration_id=arb_id, data=data or [], is_extended_id=True
             )
 
-            # Send device id to list - 2nd time
-            arb_id = self.create_arbitration_id(
-                CAN_IMX_ID, source_list, CAN_MSG_TYPE_SET, CAN_FUNCTION_NEW_DEVICE
-            )
+        pending = _PendingRequest(list_ID, function, expect_data, on_reply, attempt)
+        deadline = time.monotonic() + claim_timeout
+        with self._pending_lock:
+            while pending.key in self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.key_claim_timeouts += 1
+                    print("AMS_CAN: strip " + str(list_ID) + " "
+                          + self._function_name(function)
+                          + " still busy, command not sent")
+                    return None
+                self._pending_released.wait(remaining)
+            self._pending[pending.key] = pending
+        pending.sent_at = time.monotonic()
+        if not self.send_message(msg):
+            self._release_request(pending)
+            return None
+        return pending
 
-            msg_out = can.Message(
-                arbitration_id=arb_id, data=[source_list], is_extended_id=True
-            )
+    def _wait_request(self, pending, timeout=None):
+        """Block until the reply for pending arrives or the timeout expires.
 
-            self._current_function = CAN_FUNCTION_NEW_DEVICE
-            self._current_function_list_id = source_list
-            self._current_function_ack = False
-            self._current_function_response = True
-            self._current_function_response_data = None
-            self.send_message(msg_out)
-            sleep(0.2)
-            print(
-                "\nINIT--SENT--[6]: IMX -> LIST - ACK for LIST DEVICE ID message sent [LIST Id - "
-                + str(source_list)
-            )
+        timeout=None waits until the strip's adaptive timeout, counted from
+        when the frame was sent.
+        """
+        if pending is None:
+            return False
+        if timeout is None:
+            timeout = max(0.0, pending.sent_at + self.request_timeout(pending.list_id)
+                          - time.monotonic())
+        try:
+            replied = pending.event.wait(timeout)
+        finally:
+            self._release_request(pending)
 
-        # INIT PROCEDURE - Process response from Key-List and add the list to AMS-CAN key-list[]
-        if (
-            source_list != 0
-            and function_type == CAN_FUNCTION_NEW_DEVICE
-            and message_type == CAN_MSG_TYPE_ACK
-        ):
-            print(
-                "\nINIT--RECV--[7]: LIST -> IMX - ACK  received from LIST for 2nd DEVICE ID message [LIST Id - "
-                + str(source_list)
+        function_name = self._function_name(pending.function)
+        rtt = self._rtt.get(pending.list_id)
+        if rtt is None:
+            rtt = self._rtt[pending.list_id] = _RttEstimator(self.response_timeout)
+        if replied:
+            round_trip = pending.replied_at - pending.sent_at
+            self.stats.record_latency(pending.list_id, function_name, round_trip)
+            # A reply to a retransmission may belong to the first frame
+            if pending.attempt == 0:
+                rtt.sample(round_trip)
+        else:
+            self.stats.record_timeout(pending.list_id, function_name)
+            rtt.backoff()
+        return replied
+
+    def request_timeout(self, list_ID):
+        """Current reply timeout for a strip, in seconds."""
+        rtt = self._rtt.get(list_ID)
+        return rtt.rto if rtt is not None else self.response_timeout
+
+    def get_rtt(self, list_ID):
+        """(smoothed rtt, rtt variance, timeout) of a strip in seconds; None before any reply."""
+        rtt = self._rtt.get(list_ID)
+        if rtt is None or rtt.srtt is None:
+            return None
+        return (rtt.srtt, rtt.rttvar, rtt.rto)
+
+    def _release_request(self, pending):
+        with self._pending_lock:
+            if self._pending.get(pending.key) is pending:
+                del self._pending[pending.key]
+                self._pending_released.notify_all()
+
+    def _transact(self, list_ID, message_type, function, data=None,
+                  expect_data=False, remote=False, timeout=None, retries=0):
+        """Send one command and wait for its reply, re-sending it up to
+        retries times on timeout. Returns the request or None."""
+        for attempt in range(retries + 1):
+            if attempt:
+                self.stats.record_retransmit(list_ID, self._function_name(function))
+            pending = self._send_request(
+                list_ID, message_type, function, data, expect_data, remote,
+                attempt=attempt,
             )
-            self._current_function = None
-            self._current_function_list_id = source_list
-            self._current_function_ack = True
-            self._current_function_response = False
-            self._current_function_response_data = None
-
-        # HARDWARE BUG WORKAROUND:
-        # The key strips sometimes respond to a CAN_MSG_TYPE_GET request by echoing 
-        # the exact requested arbitration ID and appending the data payload.
-        # In this echoed ID, source is CAN_IMX_ID and destination is the list_ID!
-        if (
-            message_type == CAN_MSG_TYPE_GET
-            and len(msg.data) > 0
-            and function_type == self._current_function
-            and destination == self._current_function_list_id
-        ):
-            self._current_function_response = True
-            self._current_function_response_data = msg.data
-            if function_type == CAN_FUNCTION_VERSION:
-                if destination not in self.key_lists:
-                    self.key_lists.append(destination)
+            if self._wait_request(pending, timeout):
+                return pending
+        return None
 
-        # Normal commands to IMX
-        if (
-            destination == CAN_IMX_ID
-            and function_type != CAN_FUNCTION_NEW_DEVICE
-            and function_type != CAN_FUNCTION_UNIQUE_ID
-        ):
-            if (
-                message_type == CAN_MSG_TYPE_ACK
-                and function_type == self._current_function
-            ):
-                self._current_function_ack = True
-                self._current_function_response = True
-            elif (
-                message_type == CAN_MSG_TYPE_RESPONSE
-                and function_type == self._current_function
-            ):
-                self._current_function_response = True
-                self._current_function_response_data = msg.data
-                if function_type == CAN_FUNCTION_VERSION:
-                    if source_list not in self.key_lists:
-                        self.key_lists.append(source_list)
-
-            # KEY TAKEN
-            elif (
-                message_type == CAN_MSG_TYPE_SET
-                and (function_type & 0xF0) == CAN_FUNCTION_KEY_TAKEN
-            ):
-                self._current_function = CAN_FUNCTION_KEY_TAKEN
-                self.key_taken_position_list = source_list
-                self.key_taken_position_slot = (function_type & 0xF) + 1
-                print(
-                    "#### Key taken from slot no: "
-                    + str(self.key_taken_position_slot)
-                )
-                self._current_function_response = True
-                self._current_function_response_data = msg.data
-                self.key_taken_event = True
-                result_list = list(self._current_function_response_data)
-                key_fob_id = ""
-                for num in result_list[:5]:
-                    key_fob_id += str(num)
-                self.key_taken_id = int(key_fob_id)
-
-            # KEY INSERTED
-            elif (
-                message_type == CAN_MSG_TYPE_SET
-                and (function_type & 0xFF0) == CAN_FUNCTION_KEY_INSERTED
-            ):
-                self._current_function = CAN_FUNCTION_KEY_INSERTED
-                self.key_inserted_position_list = source_list
-                self.key_inserted_position_slot = (function_type & 0xF) + 1
-                print(
-                    "#### AMS_CAN - Key inserted at slot no: "
-                    + str(self.key_inserted_position_slot)
-                )
-                self._current_function_response = True
-                self._current_function_response_data = msg.data
-                self.key_inserted_event = True
-                result_list = list(self._current_function_response_data)
-                key_fob_id = ""
-                for num in result_list[:5]:
-                    key_fob_id += str(num)
-
-                # store inserted id as int (do NOT overwrite key_taken_id)
-                self.key_inserted_id = int(key_fob_id)
-
-    def unlock_single_key(self, strip_id, position):
+    def _command_retries(self, name):
+        return self.max_retransmits if name in _RETRANSMIT_COMMANDS else 0
+
+    @staticmethod
+    def _decode_key_fob_id(data):
+        key_fob_id = ""
+        for num in list(data)[:5]:
+            key_fob_id += str(num)
+        return key_fob_id
+
+    # ---------------------------------------------------------
+    # COMMAND TABLE (shared by the single-command API and execute_batch)
+    # ---------------------------------------------------------
+    def _command_spec(self, name, *args):
+        """Translate a command name + arguments into a _send_request() call."""
+        if name == "get_version_number":
+            (list_ID,) = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_GET,
+                        function=CAN_FUNCTION_VERSION, expect_data=True)
+        if name == "set_all_LED_ON":
+            list_ID, blinking = args
+            data = [0x22] * 7 if blinking else [0x11] * 7
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_ALL_LEDS, data=data)
+        if name == "set_all_LED_OFF":
+            (list_ID,) = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_ALL_LEDS, data=[0x00] * 7)
+        if name == "set_single_LED_state":
+            list_ID, led_ID, led_state = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_SINGLE_LED, data=[led_ID, led_state])
+        if name == "set_single_key_lock_state":
+            list_ID, position, lock_status = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_SINGLE_KEYLOCK,
+                        data=[position, lock_status])
+        if name == "lock_all_positions":
+            (list_ID,) = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_ALL_KEYLOCKS, data=[0x00] * 7)
+        if name == "unlock_all_positions":
+            (list_ID,) = args
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_SET,
+                        function=CAN_FUNCTION_ALL_KEYLOCKS, data=[0x11] * 7)
+        if name == "get_key_id":
+            list_ID, key_position = args
+            # Decrementing pos/slot as KMS position ranges from 0 to 13
+            return dict(list_ID=list_ID, message_type=CAN_MSG_TYPE_GET,
+                        function=CAN_FUNCTION_KEY_ID | (key_position - 1),
+                        expect_data=True, remote=True)
+        raise ValueError("Unknown AMS_CAN command: " + str(name))
+
+    def _command_result(self, name, pending):
+        """Return value of a finished command, as the single-command API reports it."""
+        if name == "get_version_number":
+            return list(pending.data) if pending is not None else None
+        if name == "get_key_id":
+            if pending is None:
+                return False
+            return self._decode_key_fob_id(pending.data)
+        return pending is not None
+
+    def _command_shadow(self, name, *args):
+        """(kind, position, state) a command leaves the strip in, or None."""
+        if name == "set_all_LED_ON":
+            return (SHADOW_LED, None, CAN_LED_STATE_BLINK if args[1] else CAN_LED_STATE_ON)
+        if name == "set_all_LED_OFF":
+            return (SHADOW_LED, None, CAN_LED_STATE_OFF)
+        if name == "set_single_LED_state":
+            return (SHADOW_LED, args[1], args[2])
+        if name == "set_single_key_lock_state":
+            return (SHADOW_LOCK, args[1], args[2])
+        if name == "lock_all_positions":
+            return (SHADOW_LOCK, None, CAN_KEY_LOCKED)
+        if name == "unlock_all_positions":
+            return (SHADOW_LOCK, None, CAN_KEY_UNLOCKED)
+        return None
+
+    def _shadow_is_current(self, list_ID, shadow):
+        strip = self._shadow.get(list_ID)
+        if strip is None:
+            return False
+        kind, position, state = shadow
+        return strip.matches(
+            kind, position, state, self.shadow_max_age, time.monotonic()
+        )
+
+    def _update_shadow(self, list_ID, shadow, acked):
+        kind, position, state = shadow
+        strip = self._shadow.setdefault(list_ID, _StripShadow())
+        if acked:
+            strip.set(kind, position, state, time.monotonic())
+        else:
+            # No ACK: the strip may or may not have applied it
+            strip.forget(kind, position)
+
+    def invalidate_shadow(self, list_ID=None):
+        """Forget the cached state of one strip (or all), forcing the next writes out."""
+        if list_ID is None:
+            self._shadow = {}
+        else:
+            self._shadow.pop(list_ID, None)
+
+    def resync_shadow(self, list_ID=None):
+        """Re-send the last acknowledged LED/lock state to one strip (or all).
+
+        Strip-wide values go out first, then per-position overrides, all with
+        force=True so the strips end up matching the shadow again.
+        """
+        strip_ids = [list_ID] if list_ID is not None else list(self._shadow)
+        strip_wide = []
+        per_slot = []
+        for strip_id in strip_ids:
+            strip = self._shadow.get(strip_id)
+            if strip is None:
+                continue
+            led = strip.all[SHADOW_LED]
+            if led is not None:
+                if led[0] == CAN_LED_STATE_OFF:
+                    strip_wide.append(("set_all_LED_OFF", strip_id))
+                else:
+                    strip_wide.append(
+                        ("set_all_LED_ON", strip_id, led[0] == CAN_LED_STATE_BLINK)
+                    )
+            lock = strip.all[SHADOW_LOCK]
+            if lock is not None:
+                if lock[0] == CAN_KEY_LOCKED:
+                    strip_wide.append(("lock_all_positions", strip_id))
+                else:
+                    strip_wide.append(("unlock_all_positions", strip_id))
+            for position, entry in strip.slots[SHADOW_LED].items():
+                if entry is not None:
+                    per_slot.append(
+                        ("set_single_LED_state", strip_id, position, entry[0])
+                    )
+            for position, entry in strip.slots[SHADOW_LOCK].items():
+                if entry is not None:
+                    per_slot.append(
+                        ("set_single_key_lock_state", strip_id, position, entry[0])
+                    )
+
+        results = self.execute_batch(strip_wide, force=True)
+        results += self.execute_batch(per_slot, force=True)
+        return all(results)
+
+    def get_shadow_state(self, list_ID, kind, position=None):
+        """Last acknowledged LED/lock state of a position (or the whole strip), or None."""
+        strip = self._shadow.get(list_ID)
+        if strip is None:
+            return None
+        if position is None:
+            entry = strip.all[kind]
+        else:
+            entry = strip.slots[kind].get(position, strip.all[kind])
+        return entry[0] if entry else None
+
+    def _run_command(self, name, *args, force=False):
+        shadow = self._command_shadow(name, *args)
+        if shadow and not force and self._shadow_is_current(args[0], shadow):
+            self.shadow_skipped += 1
+            return True
+        pending = self._transact(
+            retries=self._command_retries(name), **self._command_spec(name, *args)
+        )
+        if shadow:
+            self._update_shadow(args[0], shadow, pending is not None)
+        return self._command_result(name, pending)
+
+    # ---------------------------------------------------------
+    # COMMANDS
+    # ---------------------------------------------------------
+    # LED and lock commands are skipped when the shadow state says the strip
+    # is already there; pass force=True to send them regardless.
+    def unlock_single_key(self, strip_id, position, force=False):
         """Unlock one key position and turn its LED on."""
         print(f"AMS_CAN: unlocking strip {strip_id}, position {position}")
         with self._can_lock:
-            led_ok = self._set_single_LED_state_unlocked(strip_id, position, CAN_LED_STATE_ON)
-            lock_ok = self._set_single_key_lock_state_unlocked(strip_id, position, CAN_KEY_UNLOCKED)
+            led_ok = self._set_single_LED_state_unlocked(
+                strip_id, position, CAN_LED_STATE_ON, force
+            )
+            lock_ok = self._set_single_key_lock_state_unlocked(
+                strip_id, position, CAN_KEY_UNLOCKED, force
+            )
         return bool(led_ok and lock_ok)
 
     def get_version_number(self, list_ID):
         with self._can_lock:
-            arb_id = self.create_arbitration_id(
-                self._can_controller_id, list_ID, CAN_MSG_TYPE_GET, CAN_FUNCTION_VERSION
-            )
-            msg = can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
-            self._current_function = CAN_FUNCTION_VERSION
-            self._current_function_list_id = list_ID
-            self._current_function_ack = False
-            self._current_function_response = False
-            self._current_function_response_data = ""
-            self.send_message(msg)
-            sleep(0.2)
-            if self._current_function_response and self._current_function_response_data:
-                return list(self._current_function_response_data)
-            else:
-                return None
-
-    def set_all_LED_ON(self, list_ID, blinking):
+            return self._run_command("get_version_number", list_ID)
+
+    def set_all_LED_ON(self, list_ID, blinking, force=False):
         with self._can_lock:
-            arb_id = self.create_arbitration_id(
-                self._can_controller_id, list_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_ALL_LEDS
+            return self._run_command(
+                "set_all_LED_ON", list_ID, blinking, force=force
             )
-            data = [0x22] * 7 if blinking else [0x11] * 7
-            msg = can.Message(arbitration_id=arb_id, data=data, is_extended_id=True)
-            self._current_function = CAN_FUNCTION_ALL_LEDS
-            self._current_function_list_id = list_ID
-            self._current_function_ack = False
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg)
-            sleep(0.2)
-            return bool(self._current_function_response)
-
-    def set_all_LED_OFF(self, list_ID):
+
+    def set_all_LED_OFF(self, list_ID, force=False):
         with self._can_lock:
-            arb_id = self.create_arbitration_id(
-                self._can_controller_id, list_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_ALL_LEDS
-            )
-            msg = can.Message(
-                arbitration_id=arb_id, data=[0x00] * 7, is_extended_id=True,
-            )
-            self._current_function = CAN_FUNCTION_ALL_LEDS
-            self._current_function_list_id = list_ID
-            self._current_function_ack = False
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg)
-            sleep(0.2)
-            return bool(self._current_function_response)
+            return self._run_command("set_all_LED_OFF", list_ID, force=force)
 
     # Note that LED/POSITIONS range from 0 to 13
-    def set_single_LED_state(self, list_ID, led_ID, led_state):
+    def set_single_LED_state(self, list_ID, led_ID, led_state, force=False):
         """Thread-safe single LED command."""
         with self._can_lock:
-            return self._set_single_LED_state_unlocked(list_ID, led_ID, led_state)
+            return self._set_single_LED_state_unlocked(
+                list_ID, led_ID, led_state, force
+            )
 
-    def _set_single_LED_state_unlocked(self, list_ID, led_ID, led_state):
+    def _set_single_LED_state_unlocked(self, list_ID, led_ID, led_state, force=False):
         """Inner implementation — call only when _can_lock is held."""
-        arb_id = self.create_arbitration_id(
-            self._can_controller_id, list_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_SINGLE_LED
-        )
-        msg = can.Message(
-            arbitration_id=arb_id, data=[led_ID, led_state], is_extended_id=True
+        return self._run_command(
+            "set_single_LED_state", list_ID, led_ID, led_state, force=force
         )
-        self._current_function = CAN_FUNCTION_SINGLE_LED
-        self._current_function_list_id = list_ID
-        self._current_function_ack = False
-        self._current_function_response = False
-        self._current_function_response_data = None
-        self.send_message(msg)
-        sleep(0.2)
-        return bool(self._current_function_response)
 
-    def set_single_key_lock_state(self, list_ID, position, lock_status):
+    def set_single_key_lock_state(self, list_ID, position, lock_status, force=False):
         """Thread-safe single key lock command."""
         with self._can_lock:
-            return self._set_single_key_lock_state_unlocked(list_ID, position, lock_status)
+            return self._set_single_key_lock_state_unlocked(
+                list_ID, position, lock_status, force
+            )
 
-    def _set_single_key_lock_state_unlocked(self, list_ID, position, lock_status):
+    def _set_single_key_lock_state_unlocked(self, list_ID, position, lock_status,
+                                            force=False):
         """Inner implementation — call only when _can_lock is held."""
-        arb_id = self.create_arbitration_id(
-            self._can_controller_id,
-            list_ID,
-            CAN_MSG_TYPE_SET,
-            CAN_FUNCTION_SINGLE_KEYLOCK,
-        )
-        msg = can.Message(
-            arbitration_id=arb_id, data=[position, lock_status], is_extended_id=True
+        return self._run_command(
+            "set_single_key_lock_state", list_ID, position, lock_status, force=force
         )
-        self._current_function = CAN_FUNCTION_SINGLE_KEYLOCK
-        self._current_function_list_id = list_ID
-        self._current_function_ack = False
-        self._current_function_response = False
-        self._current_function_response_data = None
-        self.send_message(msg)
-        sleep(0.2)
-        return bool(self._current_function_response)
 
-    def lock_all_positions(self, list_ID):
+    def lock_all_positions(self, list_ID, force=False):
         with self._can_lock:
-            arb_id = self.create_arbitration_id(
-                self._can_controller_id, list_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_ALL_KEYLOCKS,
-            )
-            msg = can.Message(arbitration_id=arb_id, data=[0x00] * 7, is_extended_id=True)
-            self._current_function = CAN_FUNCTION_ALL_KEYLOCKS
-            self._current_function_list_id = list_ID
-            self._current_function_ack = False
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg)
-            sleep(0.2)
-            return bool(self._current_function_response)
-
-    def unlock_all_positions(self, list_ID):
+            return self._run_command("lock_all_positions", list_ID, force=force)
+
+    def unlock_all_positions(self, list_ID, force=False):
         with self._can_lock:
-            arb_id = self.create_arbitration_id(
-                self._can_controller_id, list_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_ALL_KEYLOCKS,
-            )
-            msg = can.Message(arbitration_id=arb_id, data=[0x11] * 7, is_extended_id=True)
-            self._current_function = CAN_FUNCTION_ALL_KEYLOCKS
-            self._current_function_list_id = list_ID
-            self._current_function_ack = False
-            self._current_function_response = False
-            self._current_function_response_data = None
-            self.send_message(msg)
-            sleep(0.2)
-            return bool(self._current_function_response)
+            return self._run_command("unlock_all_positions", list_ID, force=force)
 
     def get_key_id(self, list_ID, key_position):
+        with self._can_lock:
+            return self._run_command("get_key_id", list_ID, key_position)
 
-        # Decrementing pos/slot as KMS position ranges from 0 to 13
-        key_position -= 1
-        can_function = CAN_FUNCTION_KEY_ID | key_position
-        arb_id = self.create_arbitration_id(
-            self._can_controller_id, list_ID, CAN_MSG_TYPE_GET, can_function
-        )
-        msg = can.Message(
-            arbitration_id=arb_id, 
-            data=[], 
-            is_extended_id=True,
-            is_remote_frame=True,
-            dlc=5
+    # ---------------------------------------------------------
+    # PEG SCAN
+    # ---------------------------------------------------------
+    def scan_strip(self, strip_id, retries=CAN_SCAN_RETRIES):
+        """Read the peg id in every slot of one strip. Returns {slot: peg_id or None}."""
+        return self.scan_all([strip_id], retries)[strip_id]
+
+    def scan_all(self, strips=None, retries=CAN_SCAN_RETRIES):
+        """Read the peg ids of every slot on every strip (default: key_lists).
+
+        KEY_ID remote frames for all positions go out back-to-back (each
+        position has its own function code, so replies are matched
+        unambiguously); slots that did not answer are re-requested up to
+        retries more times. Empty slots stay None.
+
+        Returns {strip_id: {slot: peg_id or None}} with slots 1–14 and peg
+        ids as strings, as get_key_id() returns them.
+        """
+        if strips is None:
+            strips = list(self.key_lists)
+        slots = range(1, SLOTS_PER_STRIP + 1)
+        result = {strip: {slot: None for slot in slots} for strip in strips}
+
+        missing = [(strip, slot) for strip in strips for slot in slots]
+        for attempt in range(retries + 1):
+            if not missing:
+                break
+            if attempt:
+                for strip, _slot in missing:
+                    self.stats.record_retransmit(strip, "KEY_ID")
+            peg_ids = self.execute_batch(
+                [("get_key_id", strip, slot) for strip, slot in missing]
+            )
+            still_missing = []
+            for (strip, slot), peg_id in zip(missing, peg_ids):
+                if peg_id:
+                    result[strip][slot] = peg_id
+                else:
+                    still_missing.append((strip, slot))
+            missing = still_missing
+        return result
+
+    # ---------------------------------------------------------
+    # BATCHES
+    # ---------------------------------------------------------
+    def execute_batch(self, commands, timeout=None, force=False, retries=None):
+        """Run many independent commands with their frames in flight together.
+
+        commands is a list of tuples naming a command method and its
+        arguments, e.g. ("set_all_LED_ON", 2, False) or
+        ("set_single_key_lock_state", 1, 4, CAN_KEY_UNLOCKED).
+
+        Strips only identify a reply by (strip id, function code), so two
+        commands sharing that pair cannot be told apart on the bus. Those are
+        sent in successive waves, in the order given; everything else in the
+        batch (other strips, other functions) goes out in the same wave and
+        its ACKs are collected concurrently, at most CAN_MAX_IN_FLIGHT frames
+        at a time. Commands that depend on each other across functions
+        (e.g. lock all, then unlock one) belong in separate batches.
+
+        LED/lock commands the shadow state shows as redundant are skipped
+        (reported as successful) unless force=True. Because that check runs
+        per wave, repeating a command within one batch sends it only once.
+
+        Each reply is awaited for its strip's adaptive timeout, or for
+        timeout seconds from the start of the wave if given. Idempotent
+        commands that time out are re-sent up to retries times (default
+        max_retransmits) before they count as failed.
+
+        Returns a list of results in the same order as commands, each as the
+        corresponding single-command method would return it.
+        """
+        specs = [self._command_spec(cmd[0], *cmd[1:]) for cmd in commands]
+
+        # Assign every command to the first wave after the last one that
+        # already uses its reply key.
+        waves = []
+        last_wave = {}
+        for index, spec in enumerate(specs):
+            key = (spec["list_ID"], spec["function"])
+            wave_no = last_wave.get(key, -1) + 1
+            last_wave[key] = wave_no
+            if wave_no == len(waves):
+                waves.append([])
+            waves[wave_no].append(index)
+        waves = [
+            wave[start:start + CAN_MAX_IN_FLIGHT]
+            for wave in waves
+            for start in range(0, len(wave), CAN_MAX_IN_FLIGHT)
+        ]
+
+        shadows = [self._command_shadow(cmd[0], *cmd[1:]) for cmd in commands]
+
+        results = [None] * len(commands)
+        with self._can_lock:
+            for wave in waves:
+                to_send = []
+                for i in wave:
+                    list_ID = specs[i]["list_ID"]
+                    if (
+                        shadows[i]
+                        and not force
+                        and self._shadow_is_current(list_ID, shadows[i])
+                    ):
+                        self.shadow_skipped += 1
+                        results[i] = True
+                        continue
+                    to_send.append(i)
+
+                attempt = 0
+                while to_send:
+                    if attempt:
+                        for i in to_send:
+                            self.stats.record_retransmit(
+                                specs[i]["list_ID"],
+                                self._function_name(specs[i]["function"]),
+                            )
+                    in_flight = [
+                        (i, self._send_request(attempt=attempt, **specs[i]))
+                        for i in to_send
+                    ]
+
+                    deadline = time.monotonic() + timeout if timeout is not None else None
+                    to_send = []
+                    for i, pending in in_flight:
+                        remaining = None
+                        if deadline is not None:
+                            remaining = max(0.0, deadline - time.monotonic())
+                        if not self._wait_request(pending, remaining):
+                            name = commands[i][0]
+                            limit = retries if retries is not None else self._command_retries(name)
+                            if attempt < limit and name in _RETRANSMIT_COMMANDS:
+                                to_send.append(i)
+                                continue
+                            pending = None
+                        if shadows[i]:
+                            self._update_shadow(
+                                specs[i]["list_ID"], shadows[i], pending is not None
+                            )
+                        results[i] = self._command_result(commands[i][0], pending)
+                    attempt += 1
+        return results
+
+    # ---------------------------------------------------------
+    # STRIP DISCOVERY
+    # ---------------------------------------------------------
+    def discover_strips(self, candidates=CAN_STRIP_CANDIDATES,
+                        timeout=CAN_DISCOVERY_TIMEOUT):
+        """Probe all candidate strip ids at once and record the ones that answer.
+
+        VERSION requests for every candidate go out in a single batch; strips
+        that have not answered are re-probed until all have replied or the
+        timeout expires. Sets the ready event when done.
+
+        Returns the sorted list of strip ids that answered.
+        """
+        self.ready.clear()
+        deadline = time.monotonic() + timeout
+        missing = list(candidates)
+        found = []
+
+        while missing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Absent candidates are expected: re-probe rounds replace retransmits
+            results = self.execute_batch(
+                [("get_version_number", strip) for strip in missing],
+                timeout=min(self.response_timeout, remaining),
+                retries=0,
+            )
+            still_missing = []
+            for strip, version in zip(missing, results):
+                if version:
+                    self.key_lists_version[strip] = version
+                    if strip not in self.key_lists:
+                        self.key_lists.append(strip)
+                    found.append(strip)
+                else:
+                    still_missing.append(strip)
+            missing = still_missing
+
+        print(
+            "AMS_CAN: discovery found strips " + str(sorted(found))
+            + (" (no reply from " + str(missing) + ")" if missing else "")
         )
-        self._current_function = can_function
-        self._current_function_list_id = list_ID
-        self._current_function_ack = False
-        self._current_function_response = False
-        self._current_function_response_data = None
-        self.send_message(msg)
-        sleep(0.2)
-        if self._current_function_response:
-            if self._current_function_response_data is not None:
-                result_list = list(self._current_function_response_data)
-                key_fob_id = ""
-                for num in result_list[:5]:
-                    key_fob_id += str(num)
-                return key_fob_id
-        else:
-            return False
+        self.ready.set()
+        return sorted(found)
+
+    def wait_until_ready(self, timeout=None):
+        """Block until discover_strips() has finished. Returns False on timeout."""
+        return self.ready.wait(timeout)
 
     def send_message(self, message):
         try:
             self.bus.send(message)
+            if self.recorder is not None:
+                self.recorder.record(message, tx=True)
+            self._send_errors = 0
             return True
-        except can.CanError:
+        except (can.CanError, OSError, ValueError):
+            # ValueError/OSError: bus closed underneath us during a recovery
+            self.stats.record_bus_error()
+            self._send_errors += 1
             print("message not sent!")
             return False
 
+    # ---------------------------------------------------------
+    # BUS SUPERVISOR
+    # ---------------------------------------------------------
+    def _link_state(self):
+        """operstate of the SocketCAN interface, or None if not applicable."""
+        if self._interface != "socketcan":
+            return None
+        try:
+            with open("/sys/class/net/" + self._channel_name + "/operstate") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def check_bus(self):
+        """Return why the bus needs recovering, or None if it looks healthy."""
+        if self.notifier.exception is not None:
+            return "notifier thread died: " + repr(self.notifier.exception)
+        if self.bus_state == BUS_STATE_OFF:
+            return "bus-off"
+        if (
+            self.bus_state == BUS_STATE_PASSIVE
+            and self._passive_since is not None
+            and time.monotonic() - self._passive_since > CAN_ERROR_PASSIVE_GRACE
+        ):
+            return "error-passive for more than " + str(CAN_ERROR_PASSIVE_GRACE) + " s"
+        if self._send_errors >= CAN_SEND_ERROR_LIMIT:
+            return str(self._send_errors) + " failed sends in a row"
+        link = self._link_state()
+        if link is not None and link not in ("up", "unknown"):
+            return "link " + link
+        return None
+
+    def _reset_link(self):
+        """Bounce the SocketCAN interface (bus-off needs a controller restart)."""
+        if self._interface != "socketcan":
+            return
+        for command in (
+            ["sudo", "ip", "link", "set", self._channel_name, "down"],
+            ["sudo", "ip", "link", "set", self._channel_name, "up",
+             "type", "can", "bitrate", str(CAN_BITRATE)],
+        ):
+            try:
+                subprocess.run(command, timeout=5, check=False)
+            except (OSError, subprocess.SubprocessError) as e:
+                print("AMS_CAN: " + " ".join(command) + " failed: " + str(e))
+
+    def recover_bus(self, reason=""):
+        """Re-create bus and notifier, re-discover strips and re-apply LED/lock state.
+
+        Raises if the bus cannot be opened again (the supervisor retries).
+        """
+        print("AMS_CAN: recovering CAN bus" + (" (" + reason + ")" if reason else ""))
+        with self._can_lock:
+            self._close_bus()
+            with self._pending_lock:
+                self._pending = {}
+                self._pending_released.notify_all()
+            self._reset_link()
+            self._open_bus()
+            self.bus_state = BUS_STATE_ACTIVE
+            self._passive_since = None
+            self._send_errors = 0
+            self.bus_recoveries += 1
+
+        # Strips may have rebooted while the bus was down
+        self.discover_strips(sorted(set(CAN_STRIP_CANDIDATES) | set(self.key_lists)))
+        self.resync_shadow()
+        print("AMS_CAN: CAN bus recovered")
+
+    def start_supervisor(self, interval=CAN_SUPERVISOR_INTERVAL):
+        """Check bus health every interval seconds and recover it when needed."""
+        self.stop_supervisor()
+        self._supervisor_stop.clear()
+
+        def loop():
+            backoff = interval
+            while not self._supervisor_stop.wait(backoff):
+                reason = self.check_bus()
+                if reason is None:
+                    backoff = interval
+                    continue
+                try:
+                    self.recover_bus(reason)
+                    backoff = interval
+                except Exception as e:
+                    print("AMS_CAN: CAN bus recovery failed: " + str(e))
+                    backoff = min(backoff * 2, CAN_RECOVERY_BACKOFF_MAX)
+
+        self._supervisor_thread = threading.Thread(target=loop, daemon=True)
+        self._supervisor_thread.start()
+
+    def stop_supervisor(self):
+        if self._supervisor_thread:
+            self._supervisor_stop.set()
+            self._supervisor_thread.join(timeout=1)
+            self._supervisor_thread = None
+
+    # ---------------------------------------------------------
+    # STATISTICS
+    # ---------------------------------------------------------
+    @staticmethod
+    def _function_name(function):
+        function_class = _FUNCTION_CLASS[function & CAN_FUNCTION_MASK]
+        return _FUNCTION_NAMES.get(function_class, hex(function_class))
+
+    def _stats_extra(self):
+        rtt_ms = {}
+        for list_ID in list(self.key_lists):
+            rtt = self.get_rtt(list_ID)
+            if rtt is not None:
+                rtt_ms[str(list_ID)] = {
+                    "srtt_ms": round(rtt[0] * 1000.0, 3),
+                    "rttvar_ms": round(rtt[1] * 1000.0, 3),
+                    "timeout_ms": round(rtt[2] * 1000.0, 3),
+                }
+        return {
+            "key_events_dropped": self.key_events_dropped,
+            "shadow_skipped": self.shadow_skipped,
+            "key_claim_timeouts": self.key_claim_timeouts,
+            "strips": list(self.key_lists),
+            "rtt": rtt_ms,
+            "bus_state": self.bus_state,
+            "bus_recoveries": self.bus_recoveries,
+        }
+
+    def get_stats(self):
+        """Snapshot of per-(strip, function) latency histograms and error counters."""
+        return self.stats.snapshot(self._stats_extra())
+
+    def dump_stats(self, path):
+        self.stats.dump(path, self._stats_extra())
+
+    def start_stats_dump(self, path, interval=60.0):
+        """Write get_stats() to path as JSON every interval seconds."""
+        self.stats.start_periodic_dump(path, interval, self._stats_extra)
+
+    # ---------------------------------------------------------
+    # RECORDING
+    # ---------------------------------------------------------
+    def start_recording(self, path, max_records=TRACE_DEFAULT_RECORDS):
+        """Record every frame into a ring file at path (last max_records frames)."""
+        self.stop_recording()
+        self.recorder = CanRecorder(path, max_records)
+
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+
     def flush_buffer(self):
         msg = self.buffer.get_message()
         while msg is not None:
             msg = self.buffer.get_message()
 
     def cleanup(self):
+        self.stop_supervisor()
+        self.stats.stop_periodic_dump()
         self.notifier.stop()
         self.bus.shutdown()
+        self.stop_recording()
 
 
 def main():
@@ -0,0 +1,236 @@
+"""
+Asyncio front-end for AMS_CAN.
+
+Wraps an existing AMS_CAN so UI flows can run hardware operations as
+coroutines on one event loop instead of a thread per operation:
+
+    can = AsyncAMS_CAN(ams_can)
+    await can.unlock(strip, pos)
+    async for event in can.key_events():
+        ...
+
+Frames are still received and decoded by the AMS_CAN notifier thread; replies
+and key events are handed to the loop with call_soon_threadsafe, so awaiting
+a command costs no thread. Commands that do not share a (strip, function)
+reply key run concurrently; those that do are queued in call order, and
+also wait for a blocking AMS_CAN command on the same key to finish.
+
+Kivy screens run coroutines on a CanLoopThread and cancel the returned
+futures when they leave the screen.
+"""
+
+import asyncio
+import functools
+import threading
+
+from amscan import (
+    CAN_KEY_LOCKED,
+    CAN_KEY_UNLOCKED,
+    CAN_LED_STATE_OFF,
+    CAN_LED_STATE_ON,
+    CAN_SCAN_RETRIES,
+    SLOTS_PER_STRIP,
+)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def _release_sent(ams_can):
+    """Done-callback that drops a request whose sender was cancelled."""
+    def release(sending):
+        if not sending.cancelled() and sending.exception() is None:
+            pending = sending.result()
+            if pending is not None:
+                ams_can._release_request(pending)
+    return release
+
+
+class AsyncAMS_CAN(object):
+    def __init__(self, ams_can):
+        self.ams_can = ams_can
+        self._key_locks = {}
+
+    @property
+    def key_lists(self):
+        return self.ams_can.key_lists
+
+    def _key_lock(self, key):
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        return lock
+
+    # ---------------------------------------------------------
+    # CORE
+    # ---------------------------------------------------------
+    async def command(self, name, *args, timeout=None, force=False):
+        """Run one AMS_CAN command (see AMS_CAN._command_spec) and await its reply.
+
+        Waits for the strip's adaptive timeout unless timeout is given, and
+        re-sends idempotent commands like the blocking API does. Returns what
+        the blocking method of the same name returns.
+        """
+        ams_can = self.ams_can
+        spec = ams_can._command_spec(name, *args)
+        shadow = ams_can._command_shadow(name, *args)
+        list_ID = spec["list_ID"]
+
+        async with self._key_lock((list_ID, spec["function"])):
+            if shadow and not force and ams_can._shadow_is_current(list_ID, shadow):
+                ams_can.shadow_skipped += 1
+                return True
+
+            loop = asyncio.get_running_loop()
+            pending = None
+            for attempt in range(ams_can._command_retries(name) + 1):
+                if attempt:
+                    ams_can.stats.record_retransmit(
+                        list_ID, ams_can._function_name(spec["function"])
+                    )
+                replied = loop.create_future()
+                # Claiming the (strip, function) pair may wait for a blocking
+                # command on it to finish; do that off the loop thread
+                sending = loop.run_in_executor(None, functools.partial(
+                    ams_can._send_request,
+                    attempt=attempt,
+                    on_reply=lambda replied=replied: loop.call_soon_threadsafe(_resolve, replied),
+                    **spec
+                ))
+                try:
+                    pending = await asyncio.shield(sending)
+                except asyncio.CancelledError:
+                    sending.add_done_callback(_release_sent(ams_can))
+                    raise
+                if pending is None:
+                    continue
+                wait = timeout if timeout is not None else ams_can.request_timeout(list_ID)
+                try:
+                    await asyncio.wait_for(replied, wait)
+                except asyncio.TimeoutError:
+                    pass
+                except asyncio.CancelledError:
+                    ams_can._release_request(pending)
+                    raise
+                # Reply (or not) is already in: releases it and records stats
+                if ams_can._wait_request(pending, 0):
+                    break
+                pending = None
+
+            if shadow:
+                ams_can._update_shadow(list_ID, shadow, pending is not None)
+            return ams_can._command_result(name, pending)
+
+    async def batch(self, commands, timeout=None, force=False):
+        """Async counterpart of AMS_CAN.execute_batch(); results in command order."""
+        return await asyncio.gather(*[
+            self.command(cmd[0], *cmd[1:], timeout=timeout, force=force)
+            for cmd in commands
+        ])
+
+    # ---------------------------------------------------------
+    # COMMANDS
+    # ---------------------------------------------------------
+    async def unlock(self, strip_id, position, force=False):
+        """Unlock one key position and turn its LED on."""
+        led_ok, lock_ok = await self.batch([
+            ("set_single_LED_state", strip_id, position, CAN_LED_STATE_ON),
+            ("set_single_key_lock_state", strip_id, position, CAN_KEY_UNLOCKED),
+        ], force=force)
+        return bool(led_ok and lock_ok)
+
+    async def lock(self, strip_id, position, force=False):
+        """Lock one key position and turn its LED off."""
+        led_ok, lock_ok = await self.batch([
+            ("set_single_LED_state", strip_id, position, CAN_LED_STATE_OFF),
+            ("set_single_key_lock_state", strip_id, position, CAN_KEY_LOCKED),
+        ], force=force)
+        return bool(led_ok and lock_ok)
+
+    async def set_led(self, strip_id, position, state, force=False):
+        return await self.command("set_single_LED_state", strip_id, position,
+                                  state, force=force)
+
+    async def set_all_leds(self, strip_id, on, blinking=False, force=False):
+        if on:
+            return await self.command("set_all_LED_ON", strip_id, blinking, force=force)
+        return await self.command("set_all_LED_OFF", strip_id, force=force)
+
+    async def lock_all(self, strip_id, force=False):
+        return await self.command("lock_all_positions", strip_id, force=force)
+
+    async def unlock_all(self, strip_id, force=False):
+        return await self.command("unlock_all_positions", strip_id, force=force)
+
+    async def get_version(self, strip_id):
+        return await self.command("get_version_number", strip_id)
+
+    async def get_key_id(self, strip_id, position):
+        return await self.command("get_key_id", strip_id, position)
+
+    async def scan_strip(self, strip_id, retries=CAN_SCAN_RETRIES):
+        """Async counterpart of AMS_CAN.scan_strip()."""
+        result = {slot: None for slot in range(1, SLOTS_PER_STRIP + 1)}
+        missing = list(result)
+        for attempt in range(retries + 1):
+            if not missing:
+                break
+            if attempt:
+                for _slot in missing:
+                    self.ams_can.stats.record_retransmit(strip_id, "KEY_ID")
+            peg_ids = await self.batch(
+                [("get_key_id", strip_id, slot) for slot in missing]
+            )
+            for slot, peg_id in zip(missing, peg_ids):
+                if peg_id:
+                    result[slot] = peg_id
+            missing = [slot for slot in missing if result[slot] is None]
+        return result
+
+    # ---------------------------------------------------------
+    # KEY EVENTS
+    # ---------------------------------------------------------
+    async def key_events(self):
+        """Yield KeyEvents as they arrive until the consuming task is cancelled.
+
+        Events are delivered from the moment iteration starts; the blocking
+        get_key_event() queue is left untouched.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def deliver(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        self.ams_can.subscribe_key_events(deliver)
+        try:
+            while True:
+                yield await events.get()
+        finally:
+            self.ams_can.unsubscribe_key_events(deliver)
+
+
+class CanLoopThread(object):
+    """An asyncio event loop on a daemon thread, for callers outside asyncio (Kivy)."""
+
+    def __init__(self, name="can-async"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule coro on the loop; returns a concurrent.futures.Future.
+
+        future.cancel() cancels the coroutine at its next await.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
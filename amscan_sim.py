@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Key-strip simulator for AMS_CAN.
+
+Speaks the same arbitration-id protocol as the physical key strips so that
+amscan.AMS_CAN, hardware_sync.sync_hardware_to_db and
+peg_registration.register_pegs can run without hardware:
+
+  * UNIQUE_ID / NEW_DEVICE init handshake for strips without an id
+  * VERSION, ALL_LEDS, SINGLE_LED, ALL_KEYLOCKS, SINGLE_KEYLOCK (ACK)
+  * KEY_ID remote frames (RESPONSE with the 5 peg id bytes)
+  * KEY_TAKEN / KEY_INSERTED events via take_key() / insert_key()
+  * the echoed-GET firmware quirk (echo_rate)
+
+Run it as a separate process on a Linux vcan interface:
+
+    sudo ip link add dev vcan0 type vcan && sudo ip link set vcan0 up
+    python3 amscan_sim.py --channel vcan0 --strips 2 --latency 0.005
+
+and point the app at it with AMS_CAN(channel="vcan0"). In-process, use
+python-can's virtual bus on both sides:
+
+    sim = KeyStripSimulator(channel="sim", interface="virtual", strips=2)
+    sim.start()
+    ams_can = AMS_CAN(channel="sim", interface="virtual")
+"""
+
+import argparse
+import heapq
+import random
+import threading
+import time
+
+import can
+
+from amscan import (
+    CAN_BITRATE,
+    CAN_DESTINATION_MASK,
+    CAN_FUNCTION_ALL_KEYLOCKS,
+    CAN_FUNCTION_ALL_LEDS,
+    CAN_FUNCTION_KEY_ID,
+    CAN_FUNCTION_KEY_INSERTED,
+    CAN_FUNCTION_KEY_TAKEN,
+    CAN_FUNCTION_MASK,
+    CAN_FUNCTION_NEW_DEVICE,
+    CAN_FUNCTION_SINGLE_KEYLOCK,
+    CAN_FUNCTION_SINGLE_LED,
+    CAN_FUNCTION_UNIQUE_ID,
+    CAN_FUNCTION_VERSION,
+    CAN_IMX_ID,
+    CAN_KEY_LOCKED,
+    CAN_KEY_POSITION_MASK,
+    CAN_LED_STATE_OFF,
+    CAN_MSG_TYPE_ACK,
+    CAN_MSG_TYPE_GET,
+    CAN_MSG_TYPE_MASK,
+    CAN_MSG_TYPE_RESPONSE,
+    CAN_MSG_TYPE_SET,
+    CAN_SOURCE_MASK,
+    SLOTS_PER_STRIP,
+    create_arbitration_id,
+)
+
+DEFAULT_VERSION = [1, 0, 0]
+
+
+def default_peg_bytes(strip_id, slot):
+    """Deterministic 5-byte peg id for a slot (decodes to e.g. '10203')."""
+    return [1, 0, strip_id & 0xFF, 0, slot & 0xFF]
+
+
+class VirtualKeyStrip(object):
+    """State of one simulated key strip. Slots are 1–14."""
+
+    def __init__(self, strip_id, pegs=None, version=None, assigned=True):
+        self.strip_id = strip_id
+        self.version = list(version or DEFAULT_VERSION)
+        # assigned=False: strip boots without an id and announces itself
+        # with UNIQUE_ID until AMS_CAN hands it one via NEW_DEVICE.
+        self.assigned = assigned
+        self.current_id = strip_id if assigned else 0
+
+        if pegs is None:
+            pegs = {
+                slot: default_peg_bytes(strip_id, slot)
+                for slot in range(1, SLOTS_PER_STRIP + 1)
+            }
+        # slot -> 5 peg id bytes, or None when the slot is empty
+        self.pegs = dict(pegs)
+
+        # Raw values as last commanded, indexed by the position byte sent.
+        self.leds = {}
+        self.locks = {}
+        self.all_leds = CAN_LED_STATE_OFF
+        self.all_locks = CAN_KEY_LOCKED
+
+
+class KeyStripSimulator(object):
+    def __init__(self, channel="vcan0", interface="socketcan", strips=2,
+                 latency=0.002, drop_rate=0.0, echo_rate=0.0, seed=None,
+                 announce_interval=1.0):
+        """
+        Args:
+            channel / interface: python-can bus to attach to
+            strips: number of strips (ids 1..n) or a list of VirtualKeyStrip
+            latency: seconds between a request and the strip's reply
+            drop_rate: probability (0–1) that a reply is never sent
+            echo_rate: probability (0–1) that a GET is answered by echoing
+                       the request id with data instead of a RESPONSE
+            seed: seed for the drop/echo random generator
+            announce_interval: seconds between UNIQUE_ID repeats while an
+                       unassigned strip waits for its id
+        """
+        if isinstance(strips, int):
+            strips = [VirtualKeyStrip(i) for i in range(1, strips + 1)]
+        self.strips = list(strips)
+
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.echo_rate = echo_rate
+        self._random = random.Random(seed)
+
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+        self.bus = can.Bus(
+            channel=channel,
+            bustype=interface,
+            bitrate=CAN_BITRATE,
+            can_filters=[{
+                "can_id": CAN_IMX_ID << 20,
+                "can_mask": CAN_SOURCE_MASK,
+                "extended": True,
+            }],
+        )
+
+        self._running = False
+        self._rx_thread = None
+        self._tx_thread = None
+        self._tx_heap = []
+        self._tx_seq = 0
+        self._tx_cond = threading.Condition()
+        self.announce_interval = announce_interval
+        self._announcing = None
+        self._last_announce = 0.0
+
+    # ---------------------------------------------------------
+    # LIFECYCLE
+    # ---------------------------------------------------------
+    def start(self):
+        self._running = True
+        self._rx_thread = threading.Thread(target=self._rx_loop, daemon=True)
+        self._tx_thread = threading.Thread(target=self._tx_loop, daemon=True)
+        self._rx_thread.start()
+        self._tx_thread.start()
+        self._announce_next()
+
+    def stop(self):
+        self._running = False
+        with self._tx_cond:
+            self._tx_cond.notify_all()
+        for thread in (self._rx_thread, self._tx_thread):
+            if thread:
+                thread.join(timeout=1)
+        self.bus.shutdown()
+
+    def strip(self, strip_id):
+        for strip in self.strips:
+            if strip.current_id == strip_id:
+                return strip
+        return None
+
+    # ---------------------------------------------------------
+    # KEY EVENTS (driven by the test / benchmark)
+    # ---------------------------------------------------------
+    def take_key(self, strip_id, slot):
+        """Remove the key at slot and emit KEY_TAKEN with its peg id."""
+        strip = self.strip(strip_id)
+        peg = strip.pegs.get(slot)
+        strip.pegs[slot] = None
+        self._send_now(
+            strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_SET,
+            CAN_FUNCTION_KEY_TAKEN | (slot - 1), peg or [0] * 5,
+        )
+
+    def insert_key(self, strip_id, slot, peg_bytes):
+        """Insert a key with peg_bytes at slot and emit KEY_INSERTED."""
+        strip = self.strip(strip_id)
+        strip.pegs[slot] = list(peg_bytes)
+        self._send_now(
+            strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_SET,
+            CAN_FUNCTION_KEY_INSERTED | (slot - 1), peg_bytes,
+        )
+
+    # ---------------------------------------------------------
+    # TRANSMIT
+    # ---------------------------------------------------------
+    def _send_now(self, source, destination, message_type, function, data):
+        self._schedule(0.0, source, destination, message_type, function, data)
+
+    def _reply(self, source, destination, message_type, function, data=None):
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.frames_dropped += 1
+            return
+        self._schedule(
+            self.latency, source, destination, message_type, function, data
+        )
+
+    def _schedule(self, delay, source, destination, message_type, function, data):
+        msg = can.Message(
+            arbitration_id=create_arbitration_id(
+                source, destination, message_type, function
+            ),
+            data=list(data or []),
+            is_extended_id=True,
+        )
+        with self._tx_cond:
+            self._tx_seq += 1
+            heapq.heappush(
+                self._tx_heap, (time.monotonic() + delay, self._tx_seq, msg)
+            )
+            self._tx_cond.notify()
+
+    def _tx_loop(self):
+        while self._running:
+            with self._tx_cond:
+                while self._running and not self._tx_heap:
+                    self._tx_cond.wait()
+                if not self._running:
+                    return
+                due, _seq, msg = self._tx_heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._tx_cond.wait(delay)
+                    continue
+                heapq.heappop(self._tx_heap)
+            try:
+                self.bus.send(msg)
+                self.frames_sent += 1
+            except can.CanError as e:
+                print(f"[SIM] send failed: {e}")
+
+    # ---------------------------------------------------------
+    # RECEIVE
+    # ---------------------------------------------------------
+    def _rx_loop(self):
+        while self._running:
+            if (
+                self._announcing is not None
+                and time.monotonic() - self._last_announce > self.announce_interval
+            ):
+                self._announce_next()
+            msg = self.bus.recv(0.1)
+            if msg is None:
+                continue
+            self.frames_received += 1
+            self._handle(msg)
+
+    def _handle(self, msg):
+        destination = (msg.arbitration_id & CAN_DESTINATION_MASK) >> 12
+        message_type = (msg.arbitration_id & CAN_MSG_TYPE_MASK) >> 9
+        function = msg.arbitration_id & CAN_FUNCTION_MASK
+        data = list(msg.data)
+
+        if function == CAN_FUNCTION_NEW_DEVICE or function == CAN_FUNCTION_UNIQUE_ID:
+            self._handle_init(destination, message_type, function, data)
+            return
+
+        strip = self.strip(destination)
+        if strip is None or not strip.assigned:
+            return
+
+        if message_type == CAN_MSG_TYPE_GET:
+            if function == CAN_FUNCTION_VERSION:
+                self._answer_get(strip, function, strip.version)
+            elif (function & ~CAN_KEY_POSITION_MASK) == CAN_FUNCTION_KEY_ID:
+                slot = (function & CAN_KEY_POSITION_MASK) + 1
+                peg = strip.pegs.get(slot)
+                if peg:
+                    self._answer_get(strip, function, peg)
+            return
+
+        if message_type != CAN_MSG_TYPE_SET:
+            return
+
+        if function == CAN_FUNCTION_ALL_LEDS:
+            strip.all_leds = data[0] & 0x0F if data else CAN_LED_STATE_OFF
+            strip.leds.clear()
+        elif function == CAN_FUNCTION_SINGLE_LED and len(data) >= 2:
+            strip.leds[data[0]] = data[1]
+        elif function == CAN_FUNCTION_ALL_KEYLOCKS:
+            strip.all_locks = data[0] & 0x0F if data else CAN_KEY_LOCKED
+            strip.locks.clear()
+        elif function == CAN_FUNCTION_SINGLE_KEYLOCK and len(data) >= 2:
+            strip.locks[data[0]] = data[1]
+        else:
+            return
+        self._reply(strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_ACK, function)
+
+    def _answer_get(self, strip, function, data):
+        if self.echo_rate and self._random.random() < self.echo_rate:
+            # Firmware quirk: echo the request id (IMX -> strip, GET) with data
+            self._reply(CAN_IMX_ID, strip.current_id, CAN_MSG_TYPE_GET, function, data)
+        else:
+            self._reply(
+                strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_RESPONSE, function, data
+            )
+
+    # ---------------------------------------------------------
+    # INIT HANDSHAKE
+    # ---------------------------------------------------------
+    def _announce_next(self):
+        """Send UNIQUE_ID for the next strip that has no id yet."""
+        for strip in self.strips:
+            if not strip.assigned:
+                self._announcing = strip
+                self._last_announce = time.monotonic()
+                self._send_now(
+                    0, CAN_IMX_ID, CAN_MSG_TYPE_SET, CAN_FUNCTION_UNIQUE_ID,
+                    [strip.strip_id],
+                )
+                return
+        self._announcing = None
+
+    def _handle_init(self, destination, message_type, function, data):
+        if function != CAN_FUNCTION_NEW_DEVICE or message_type != CAN_MSG_TYPE_SET:
+            return
+
+        if destination == 0 and self._announcing is not None and data:
+            # 1st DEVICE ID: ACK as the unassigned device, then ask to confirm
+            strip = self._announcing
+            strip.current_id = data[0]
+            self._reply(0, CAN_IMX_ID, CAN_MSG_TYPE_ACK, CAN_FUNCTION_NEW_DEVICE)
+            self._reply(
+                strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_GET,
+                CAN_FUNCTION_NEW_DEVICE,
+            )
+            return
+
+        strip = self.strip(destination)
+        if strip is not None and not strip.assigned:
+            # 2nd DEVICE ID: confirm and start answering commands
+            strip.assigned = True
+            self._reply(
+                strip.current_id, CAN_IMX_ID, CAN_MSG_TYPE_ACK,
+                CAN_FUNCTION_NEW_DEVICE,
+            )
+            self._announce_next()
+
+
+def run_benchmark(channel, interface, strip_ids, rounds=20):
+    """Time common AMS_CAN operations against a running simulator."""
+    from amscan import AMS_CAN
+
+    ams_can = AMS_CAN(channel=channel, interface=interface)
+    try:
+        def timed(label, fn):
+            start = time.monotonic()
+            for _ in range(rounds):
+                fn()
+            elapsed = (time.monotonic() - start) / rounds
+            print(f"  {label:<40} {elapsed * 1000:8.2f} ms")
+
+        print(f"[BENCH] {rounds} rounds, strips {strip_ids}")
+        timed("get_version_number (per strip)",
+              lambda: [ams_can.get_version_number(s) for s in strip_ids])
+        timed("set_all_LED_ON (per strip)",
+              lambda: [ams_can.set_all_LED_ON(s, False) for s in strip_ids])
+        timed("unlock_single_key x6",
+              lambda: [ams_can.unlock_single_key(strip_ids[0], p) for p in range(1, 7)])
+        timed("execute_batch LED ON (all strips)",
+              lambda: ams_can.execute_batch(
+                  [("set_all_LED_ON", s, False) for s in strip_ids]))
+        timed("get_key_id x14 (first strip)",
+              lambda: [ams_can.get_key_id(strip_ids[0], p) for p in range(1, 15)])
+    finally:
+        ams_can.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated AMS key strips")
+    parser.add_argument("--channel", default="vcan0")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--strips", type=int, default=2)
+    parser.add_argument("--unassigned", action="store_true",
+                        help="boot strips without ids (exercise the init handshake)")
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--echo-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bench", action="store_true",
+                        help="run an AMS_CAN benchmark against the simulator and exit")
+    args = parser.parse_args()
+
+    strips = [
+        VirtualKeyStrip(i, assigned=not args.unassigned)
+        for i in range(1, args.strips + 1)
+    ]
+    sim = KeyStripSimulator(
+        channel=args.channel,
+        interface=args.interface,
+        strips=strips,
+        latency=args.latency,
+        drop_rate=args.drop_rate,
+        echo_rate=args.echo_rate,
+        seed=args.seed,
+    )
+    sim.start()
+    print(f"[SIM] {args.strips} strip(s) on {args.interface}:{args.channel}")
+
+    try:
+        if args.bench:
+            run_benchmark(
+                args.channel, args.interface, list(range(1, args.strips + 1))
+            )
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        print(
+            f"[SIM] rx={sim.frames_received} tx={sim.frames_sent} "
+            f"dropped={sim.frames_dropped}"
+        )
+
+
+if __name__ == "__main__":
+    main()
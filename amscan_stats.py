@@ -0,0 +1,144 @@
+"""
+Round-trip statistics for AMS_CAN.
+
+Keeps, per (strip id, function), a latency histogram of ACK/RESPONSE times
+plus timeout and retransmit counters, and a global bus error counter.
+Everything is in memory; dump() / start_periodic_dump() write a JSON
+snapshot to a local file for field diagnostics.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Upper bucket bounds in milliseconds; the last bucket catches the rest.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _FunctionStats(object):
+    __slots__ = ("count", "timeouts", "retransmits", "total_ms", "min_ms",
+                 "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.retransmits = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def as_dict(self):
+        histogram = {}
+        for bound, value in zip(LATENCY_BUCKETS_MS, self.buckets):
+            histogram["<=" + str(bound)] = value
+        histogram[">" + str(LATENCY_BUCKETS_MS[-1])] = self.buckets[-1]
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "retransmits": self.retransmits,
+            "min_ms": round(self.min_ms, 3) if self.min_ms is not None else None,
+            "max_ms": round(self.max_ms, 3) if self.max_ms is not None else None,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "histogram_ms": histogram,
+        }
+
+
+class CanStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._started = time.monotonic()
+        self.bus_errors = 0
+        self._dump_thread = None
+        self._dump_stop = threading.Event()
+
+    def _entry(self, strip_id, function_name):
+        key = (strip_id, function_name)
+        entry = self._functions.get(key)
+        if entry is None:
+            entry = self._functions[key] = _FunctionStats()
+        return entry
+
+    def record_latency(self, strip_id, function_name, seconds):
+        ms = seconds * 1000.0
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                bucket = index
+                break
+        with self._lock:
+            entry = self._entry(strip_id, function_name)
+            entry.count += 1
+            entry.total_ms += ms
+            entry.buckets[bucket] += 1
+            if entry.min_ms is None or ms < entry.min_ms:
+                entry.min_ms = ms
+            if entry.max_ms is None or ms > entry.max_ms:
+                entry.max_ms = ms
+
+    def record_timeout(self, strip_id, function_name):
+        with self._lock:
+            self._entry(strip_id, function_name).timeouts += 1
+
+    def record_retransmit(self, strip_id, function_name):
+        with self._lock:
+            self._entry(strip_id, function_name).retransmits += 1
+
+    def record_bus_error(self):
+        with self._lock:
+            self.bus_errors += 1
+
+    def snapshot(self, extra=None):
+        """Plain-dict copy of all counters, keyed "<strip>/<function>"."""
+        with self._lock:
+            functions = {
+                str(strip_id) + "/" + name: entry.as_dict()
+                for (strip_id, name), entry in sorted(
+                    self._functions.items(), key=lambda item: (str(item[0][0]), item[0][1])
+                )
+            }
+            data = {
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "uptime_s": round(time.monotonic() - self._started, 1),
+                "bus_errors": self.bus_errors,
+                "functions": functions,
+            }
+        if extra:
+            data.update(extra)
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._functions = {}
+            self.bus_errors = 0
+            self._started = time.monotonic()
+
+    def dump(self, path, extra=None):
+        """Write a JSON snapshot to path (atomically, via a temp file)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(extra), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_periodic_dump(self, path, interval=60.0, extra_fn=None):
+        """Dump to path every interval seconds on a daemon thread."""
+        self.stop_periodic_dump()
+        self._dump_stop.clear()
+
+        def loop():
+            while not self._dump_stop.wait(interval):
+                try:
+                    self.dump(path, extra_fn() if extra_fn else None)
+                except Exception as e:
+                    print(f"[CAN STATS] dump to {path} failed: {e}")
+
+        self._dump_thread = threading.Thread(target=loop, daemon=True)
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self):
+        if self._dump_thread:
+            self._dump_stop.set()
+            self._dump_thread.join(timeout=1)
+            self._dump_thread = None
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+CAN traffic recorder and replay tool for AMS_CAN.
+
+CanRecorder keeps the last N sent/received frames in a fixed-size binary
+ring file (22 bytes per frame, monotonic timestamps), so a recording can be
+left running in the field and pulled after a lost key event or a strip
+re-initialising:
+
+    ams_can = AMS_CAN(record_path="/home/ams/can_trace.bin")
+    # or: ams_can.start_recording(path) / ams_can.stop_recording()
+
+replay() feeds the received frames of a recording back through
+AMS_CAN._on_message_received at the original pace, faster, or as fast as
+possible, which makes recordings usable as regression fixtures and as
+throughput benchmarks for the decode path:
+
+    python3 amscan_trace.py dump   can_trace.bin
+    python3 amscan_trace.py replay can_trace.bin --speed 10
+    python3 amscan_trace.py replay can_trace.bin --bench
+"""
+
+import argparse
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import can
+
+TRACE_MAGIC = b"AMSTRACE"
+TRACE_VERSION = 1
+TRACE_DEFAULT_RECORDS = 65536
+
+# magic, version, record size, capacity (records), total frames written
+_HEADER = struct.Struct("<8sHHIQ")
+# monotonic timestamp, arbitration id, dlc, flags, data
+_RECORD = struct.Struct("<dIBB8s")
+
+TRACE_FLAG_TX = 0x01
+TRACE_FLAG_REMOTE = 0x02
+TRACE_FLAG_EXTENDED = 0x04
+TRACE_FLAG_ERROR = 0x08
+
+TraceRecord = namedtuple("TraceRecord", "timestamp tx message")
+
+
+class CanRecorder(object):
+    """Append frames to a ring file holding the last max_records frames."""
+
+    def __init__(self, path, max_records=TRACE_DEFAULT_RECORDS):
+        self.path = path
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._written = 0
+        # Unbuffered: every frame reaches the file even if the app dies.
+        self._file = open(path, "w+b", buffering=0)
+        self._file.write(self._header())
+        self._file.truncate(_HEADER.size + max_records * _RECORD.size)
+
+    def _header(self):
+        return _HEADER.pack(TRACE_MAGIC, TRACE_VERSION, _RECORD.size,
+                            self.max_records, self._written)
+
+    def record(self, msg, tx=False):
+        flags = TRACE_FLAG_TX if tx else 0
+        if msg.is_remote_frame:
+            flags |= TRACE_FLAG_REMOTE
+        if msg.is_extended_id:
+            flags |= TRACE_FLAG_EXTENDED
+        if msg.is_error_frame:
+            flags |= TRACE_FLAG_ERROR
+        record = _RECORD.pack(time.monotonic(), msg.arbitration_id, msg.dlc,
+                              flags, bytes(msg.data[:8]))
+        with self._lock:
+            if self._file is None:
+                return
+            slot = self._written % self.max_records
+            self._file.seek(_HEADER.size + slot * _RECORD.size)
+            self._file.write(record)
+            self._written += 1
+            self._file.seek(0)
+            self._file.write(self._header())
+
+    @property
+    def frames_written(self):
+        return self._written
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """Return the frames of a recording as TraceRecords, oldest first."""
+    with open(path, "rb") as f:
+        magic, version, record_size, capacity, written = _HEADER.unpack(
+            f.read(_HEADER.size)
+        )
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f"{path}: not an AMS CAN recording")
+        if record_size != _RECORD.size:
+            raise ValueError(f"{path}: unexpected record size {record_size}")
+        body = f.read(capacity * record_size)
+
+    count = min(written, capacity)
+    first = written % capacity if written > capacity else 0
+    records = []
+    for index in range(count):
+        offset = ((first + index) % capacity) * record_size
+        timestamp, arbitration_id, dlc, flags, data = _RECORD.unpack_from(body, offset)
+        remote = bool(flags & TRACE_FLAG_REMOTE)
+        msg = can.Message(
+            timestamp=timestamp,
+            arbitration_id=arbitration_id,
+            is_extended_id=bool(flags & TRACE_FLAG_EXTENDED),
+            is_remote_frame=remote,
+            is_error_frame=bool(flags & TRACE_FLAG_ERROR),
+            dlc=dlc,
+            data=b"" if remote else data[:dlc],
+        )
+        records.append(TraceRecord(timestamp, bool(flags & TRACE_FLAG_TX), msg))
+    return records
+
+
+def replay(path, handler, speed=1.0, include_tx=False):
+    """Feed a recording into handler (e.g. ams_can._on_message_received).
+
+    speed scales the original inter-frame gaps (2.0 = twice as fast);
+    speed=None replays back-to-back. Sent frames are skipped unless
+    include_tx is set. Returns (frames replayed, elapsed seconds).
+    """
+    records = [r for r in read_recording(path) if include_tx or not r.tx]
+    if not records:
+        return 0, 0.0
+
+    base = records[0].timestamp
+    start = time.monotonic()
+    for record in records:
+        if speed:
+            delay = (record.timestamp - base) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        handler(record.message)
+    return len(records), time.monotonic() - start
+
+
+def _describe(msg):
+    arbitration_id = msg.arbitration_id
+    return (
+        f"src={(arbitration_id >> 20) & 0xFF:#04x} "
+        f"dst={(arbitration_id >> 12) & 0xFF:#04x} "
+        f"type={(arbitration_id >> 9) & 0x7} "
+        f"fn={arbitration_id & 0x1FF:#05x} "
+        + ("remote" if msg.is_remote_frame else msg.data.hex())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AMS CAN recordings")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dump = sub.add_parser("dump", help="print the frames of a recording")
+    dump.add_argument("path")
+
+    play = sub.add_parser("replay", help="replay received frames into AMS_CAN")
+    play.add_argument("path")
+    play.add_argument("--speed", type=float, default=1.0,
+                      help="time scale, 0 = as fast as possible")
+    play.add_argument("--bench", action="store_true",
+                      help="replay as fast as possible and report frames/s")
+    play.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        records = read_recording(args.path)
+        base = records[0].timestamp if records else 0.0
+        for record in records:
+            direction = "TX" if record.tx else "RX"
+            print(f"{record.timestamp - base:10.4f} {direction} {_describe(record.message)}")
+        print(f"{len(records)} frame(s)")
+        return
+
+    # Replies the decode path sends (handshake ACKs) go to a private
+    # virtual bus so a replay never touches real strips. Every repeat gets
+    # a fresh AMS_CAN so each pass starts from the same state.
+    from amscan import AMS_CAN
+
+    speed = None if args.bench or not args.speed else args.speed
+    total_frames = 0
+    total_time = 0.0
+    key_events = []
+    for _ in range(args.repeat):
+        ams_can = AMS_CAN(channel="amscan-replay-" + str(os.getpid()),
+                          interface="virtual")
+        ams_can.subscribe_key_events(key_events.append)
+        try:
+            frames, elapsed = replay(args.path, ams_can._on_message_received, speed)
+        finally:
+            ams_can.cleanup()
+        total_frames += frames
+        total_time += elapsed
+    rate = total_frames / total_time if total_time else 0.0
+    print(
+        f"[REPLAY] {total_frames} frame(s) in {total_time:.3f} s "
+        f"({rate:.0f} frames/s), strips {ams_can.key_lists}, "
+        f"key events {len(key_events)}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Battery telemetry from the BMS lines on /dev/ttyAML1.
+
+BatteryTelemetry samples the latest BATT= / CHARGE values from AMSBMS in
+the background, keeps an exponentially smoothed voltage and a fixed-size
+history (array-backed ring of time / voltage / charging), and persists the
+history to a ring file so it survives restarts. Readers get cached values:
+
+    telemetry = get_battery_telemetry()
+    telemetry.percent()          # smoothed, 0–100
+    telemetry.trend()            # volts per hour over the last hour
+    telemetry.time_to_empty()    # seconds, None while not discharging
+
+    python3 battery_telemetry.py dump battery_history.bin
+"""
+
+import argparse
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from amsbms import FRAME_BATTERY, FRAME_CHARGING, get_bms
+
+BATTERY_HISTORY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "battery_history.bin"
+)
+
+BATTERY_SAMPLE_INTERVAL = 30.0
+# 24 hours at the default interval
+BATTERY_HISTORY_RECORDS = 2880
+BATTERY_EMA_ALPHA = 0.2
+BATTERY_TREND_WINDOW = 3600.0
+# How long the first reader waits for the board's first BATT= line
+BATTERY_FIRST_READ_TIMEOUT = 5.0
+# The persisted last sample only seeds the smoothed value if it is at most
+# this many sample intervals old; an older one says little about now
+BATTERY_SEED_MAX_INTERVALS = 4
+
+# Voltage range mapped to 0–100 % (same as csi_ams/utils/bms.py)
+BATTERY_LOW_VOLT = 9.7
+BATTERY_HIGH_VOLT = 11.1
+
+HISTORY_MAGIC = b"AMSBATT\0"
+HISTORY_VERSION = 1
+
+# magic, version, record size, capacity (records), total samples written
+_HEADER = struct.Struct("<8sHHIQ")
+# wall-clock time, voltage, flags
+_RECORD = struct.Struct("<dfB")
+
+SAMPLE_FLAG_CHARGING = 0x01
+
+BatterySample = namedtuple("BatterySample", "timestamp voltage charging")
+
+
+def voltage_to_percent(voltage):
+    voltage = min(max(voltage, BATTERY_LOW_VOLT), BATTERY_HIGH_VOLT)
+    span = BATTERY_HIGH_VOLT - BATTERY_LOW_VOLT
+    return math.floor((voltage - BATTERY_LOW_VOLT) / span * 100)
+
+
+def is_charging(status):
+    """Interpret a CHARGE... line; anything saying OFF/NOT/DIS is not charging."""
+    if not status:
+        return False
+    status = status.upper()
+    return not any(word in status for word in ("OFF", "NOT", "DIS"))
+
+
+class BatteryTelemetry(object):
+    def __init__(self, bms, path=BATTERY_HISTORY_PATH,
+                 interval=BATTERY_SAMPLE_INTERVAL,
+                 capacity=BATTERY_HISTORY_RECORDS, alpha=BATTERY_EMA_ALPHA):
+        self.bms = bms
+        self.path = path
+        self.interval = interval
+        self.capacity = capacity
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._times = array("d", bytes(8 * capacity))
+        self._volts = array("f", bytes(4 * capacity))
+        self._flags = array("B", bytes(capacity))
+        self._written = 0
+
+        self.smoothed = None
+        self.charging = False
+        self.ready = threading.Event()
+
+        self._file = None
+        self._running = False
+        self._thread = None
+        if path:
+            self._open_history()
+
+    # ---------------- Persistence ----------------
+    def _header(self):
+        return _HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, _RECORD.size,
+                            self.capacity, self._written)
+
+    def _open_history(self):
+        try:
+            for sample in read_history(self.path):
+                self._append(sample)
+        except (OSError, ValueError, struct.error):
+            pass
+
+        # Rewrite the file with our capacity (file slots mirror the arrays)
+        # into a temp file and swap it in, so a crash meanwhile keeps the
+        # old history. If the path is not writable, keep it in memory only.
+        image = bytearray(self._header())
+        for slot in range(self.capacity):
+            image += _RECORD.pack(self._times[slot], self._volts[slot], self._flags[slot])
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(image)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, "r+b", buffering=0)
+        except OSError as e:
+            print(f"[BATT] History file {self.path} not writable ({e}); keeping it in memory")
+            self._file = None
+
+        last = self.latest()
+        max_age = BATTERY_SEED_MAX_INTERVALS * self.interval
+        if last is not None and abs(time.time() - last.timestamp) <= max_age:
+            self.smoothed = last.voltage
+            self.charging = last.charging
+
+    def _store(self, slot):
+        self._file.seek(_HEADER.size + slot * _RECORD.size)
+        self._file.write(_RECORD.pack(
+            self._times[slot], self._volts[slot], self._flags[slot]
+        ))
+
+    # ---------------- Sampling ----------------
+    def _append(self, sample):
+        slot = self._written % self.capacity
+        self._times[slot] = sample.timestamp
+        self._volts[slot] = sample.voltage
+        self._flags[slot] = SAMPLE_FLAG_CHARGING if sample.charging else 0
+        self._written += 1
+        return slot
+
+    def add_sample(self, voltage, charging=False, timestamp=None):
+        sample = BatterySample(
+            time.time() if timestamp is None else timestamp, float(voltage), bool(charging)
+        )
+        with self._lock:
+            if self.smoothed is None:
+                self.smoothed = sample.voltage
+            else:
+                self.smoothed += self.alpha * (sample.voltage - self.smoothed)
+            self.charging = sample.charging
+            slot = self._append(sample)
+            if self._file is not None:
+                try:
+                    self._store(slot)
+                    self._file.seek(0)
+                    self._file.write(self._header())
+                except OSError as e:
+                    print(f"[BATT] Writing history failed ({e}); keeping it in memory")
+                    self._file.close()
+                    self._file = None
+        self.ready.set()
+
+    def sample(self):
+        """Take one sample from the BMS; False if it has not reported recently."""
+        value = self.bms.get_latest(FRAME_BATTERY, max_age=2 * self.interval)
+        if value is None:
+            return False
+        try:
+            voltage = float(value[:5])
+        except ValueError:
+            return False
+        self.add_sample(voltage, is_charging(self.bms.get_latest(FRAME_CHARGING)))
+        return True
+
+    def _run(self):
+        if self.bms.wait_latest(FRAME_BATTERY, BATTERY_FIRST_READ_TIMEOUT) is not None:
+            self.sample()
+        while self._running:
+            time.sleep(self.interval)
+            if self._running:
+                self.sample()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ---------------- Queries ----------------
+    def voltage(self):
+        return self.smoothed
+
+    def percent(self, wait=0):
+        """Smoothed charge in %, None before the first sample."""
+        if self.smoothed is None and wait:
+            self.ready.wait(wait)
+        smoothed = self.smoothed
+        return None if smoothed is None else voltage_to_percent(smoothed)
+
+    def latest(self):
+        with self._lock:
+            if not self._written:
+                return None
+            slot = (self._written - 1) % self.capacity
+            return BatterySample(
+                self._times[slot], self._volts[slot],
+                bool(self._flags[slot] & SAMPLE_FLAG_CHARGING),
+            )
+
+    def history(self, since=None):
+        """Samples oldest first, optionally only those at or after `since`."""
+        with self._lock:
+            count = min(self._written, self.capacity)
+            first = self._written - count
+            samples = []
+            for index in range(first, self._written):
+                slot = index % self.capacity
+                if since is not None and self._times[slot] < since:
+                    continue
+                samples.append(BatterySample(
+                    self._times[slot], self._volts[slot],
+                    bool(self._flags[slot] & SAMPLE_FLAG_CHARGING),
+                ))
+            return samples
+
+    def trend(self, window=BATTERY_TREND_WINDOW):
+        """Least-squares slope of voltage over the last window s, in V/hour."""
+        samples = self.history(since=time.time() - window)
+        if len(samples) < 2:
+            return None
+        t0 = samples[0].timestamp
+        n = len(samples)
+        mean_t = sum(s.timestamp - t0 for s in samples) / n
+        mean_v = sum(s.voltage for s in samples) / n
+        var_t = sum((s.timestamp - t0 - mean_t) ** 2 for s in samples)
+        if var_t == 0:
+            return None
+        cov = sum((s.timestamp - t0 - mean_t) * (s.voltage - mean_v) for s in samples)
+        return cov / var_t * 3600.0
+
+    def time_to_empty(self, window=BATTERY_TREND_WINDOW):
+        """Seconds until BATTERY_LOW_VOLT at the current trend; None if not discharging."""
+        slope = self.trend(window)
+        if self.charging or slope is None or slope >= 0 or self.smoothed is None:
+            return None
+        return max(0.0, (self.smoothed - BATTERY_LOW_VOLT) / -slope * 3600.0)
+
+    def get_stats(self):
+        return {
+            "voltage": round(self.smoothed, 3) if self.smoothed is not None else None,
+            "percent": self.percent(),
+            "charging": self.charging,
+            "trend_v_per_hour": self.trend(),
+            "time_to_empty_s": self.time_to_empty(),
+            "samples": min(self._written, self.capacity),
+        }
+
+
+def read_history(path):
+    """Return the samples of a history file, oldest first."""
+    with open(path, "rb") as f:
+        magic, version, record_size, capacity, written = _HEADER.unpack(
+            f.read(_HEADER.size)
+        )
+        if magic != HISTORY_MAGIC or version != HISTORY_VERSION:
+            raise ValueError(f"{path}: not an AMS battery history")
+        if record_size != _RECORD.size:
+            raise ValueError(f"{path}: unexpected record size {record_size}")
+        body = f.read(capacity * record_size)
+
+    count = min(written, capacity)
+    first = written % capacity if written > capacity else 0
+    samples = []
+    for index in range(count):
+        offset = ((first + index) % capacity) * record_size
+        timestamp, voltage, flags = _RECORD.unpack_from(body, offset)
+        samples.append(BatterySample(timestamp, voltage, bool(flags & SAMPLE_FLAG_CHARGING)))
+    return samples
+
+
+_battery_telemetry = None
+_battery_telemetry_guard = threading.Lock()
+
+
+def get_battery_telemetry():
+    """Process-wide, started BatteryTelemetry on get_bms()."""
+    global _battery_telemetry
+    with _battery_telemetry_guard:
+        if _battery_telemetry is None:
+            _battery_telemetry = BatteryTelemetry(get_bms())
+            _battery_telemetry.start()
+        return _battery_telemetry
+
+
+def stop_battery_telemetry():
+    global _battery_telemetry
+    with _battery_telemetry_guard:
+        telemetry, _battery_telemetry = _battery_telemetry, None
+    if telemetry is not None:
+        telemetry.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AMS battery history")
+    sub = parser.add_subparsers(dest="command", required=True)
+    dump = sub.add_parser("dump", help="print the samples of a history file")
+    dump.add_argument("path", nargs="?", default=BATTERY_HISTORY_PATH)
+    args = parser.parse_args()
+
+    for sample in read_history(args.path):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sample.timestamp))
+        print(f"{stamp}  {sample.voltage:6.2f} V  "
+              f"{voltage_to_percent(sample.voltage):3d} %"
+              f"{'  charging' if sample.charging else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-import cv2
+import hal
 
 # Test video1
-cap = cv2.VideoCapture(1)
+cap = hal.open_camera(1)
 if cap.isOpened():
     print("Camera 1 opened successfully!")
     ret, frame = cap.read()
@@ -1,10 +1,15 @@
-from time import sleep
+from time import sleep, time
 import can
+import threading
 import ctypes
 import logging
 
+import hal
+
 
 CHANNEL_NAME = "can0"
+CAN_INTERFACE = "socketcan"
+CAN_BITRATE = 125000
 CAN_SOURCE_MASK = 0x0FF00000
 CAN_DESTINATION_MASK = 0x000FF000
 CAN_MSG_TYPE_MASK = 0x00000E00
@@ -67,7 +72,11 @@ class AMS_CAN(object):
 
         self.key_lists = []
         self.key_lists_version = {}
-        self.bus = can.Bus(channel="can0", bustype="socketcan", bitrate=125000)
+        self.ready = threading.Event()
+        bus = hal.can_bus_kwargs(CHANNEL_NAME, CAN_INTERFACE)
+        self.bus = can.Bus(
+            channel=bus["channel"], bustype=bus["interface"], bitrate=CAN_BITRATE
+        )
 
         self.buffer = can.BufferedReader()
         self.buffer.on_message_received = self._on_message_received
@@ -272,6 +281,42 @@ class AMS_CAN(object):
                 print("#### AMS_CAN - Key fob id" + key_fob_id)
                 self.key_inserted_id = int(key_fob_id)
 
+    def discover_strips(self, candidates=(1, 2), timeout=8, probe_interval=1):
+        """
+        Send VERSION requests to every candidate strip back-to-back and return
+        as soon as all of them are in key_lists (or the timeout expires).
+        Strips still running the UNIQUE_ID handshake are picked up too, and
+        unanswered candidates are re-probed every probe_interval seconds.
+        Sets the ready event when done.
+        """
+        self.ready.clear()
+        deadline = time() + timeout
+        next_probe = 0
+
+        while time() < deadline:
+            missing = [c for c in candidates if c not in self.key_lists]
+            if not missing:
+                break
+            if time() >= next_probe:
+                self._current_function = CAN_FUNCTION_VERSION
+                self._current_function_ack = False
+                self._current_function_response = False
+                for list_ID in missing:
+                    arb_id = self.create_arbitration_id(
+                        self._can_controller_id,
+                        list_ID,
+                        CAN_MSG_TYPE_GET,
+                        CAN_FUNCTION_VERSION,
+                    )
+                    self.send_message(
+                        can.Message(arbitration_id=arb_id, data=[], is_extended_id=True)
+                    )
+                next_probe = time() + probe_interval
+            sleep(0.02)
+
+        self.ready.set()
+        return [c for c in candidates if c in self.key_lists]
+
     def get_version_number(self, list_ID):
         arb_id = self.create_arbitration_id(
             self._can_controller_id, list_ID, CAN_MSG_TYPE_GET, CAN_FUNCTION_VERSION
@@ -8,6 +8,7 @@ from utils.commons import *
 from datetime import datetime
 from sqlalchemy import create_engine, or_
 from sqlalchemy.orm import sessionmaker
+from event_types import load_event_types
 
 
 LAST_ACK_TIME = datetime.now(TZ_INDIA)
@@ -410,6 +411,7 @@ if __name__ == "__main__":
     Session = sessionmaker()
     Session.configure(bind=engine, autocommit=False, autoflush=False)
     session = Session()
+    load_event_types(session)
     mutex = Lock()
     cabinet = session.query(AMS_Cabinet).one_or_none()
 
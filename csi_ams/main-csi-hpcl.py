@@ -1,6 +1,8 @@
 import os
-import mraa
 import pytz
+import hal
+from db_migrations import migrate
+from event_types import load_event_types
 from model import *
 from amscan import *
 from time import sleep
@@ -21,11 +23,12 @@ lcd.lcd_init()
 lcd.lcd_string("POWERED BY CSI", lcd.LCD_LINE_1)
 sleep(2)
 
-print("Bring up CAN0....")
-os.system("sudo ip link set can0 down")
-sleep(3)
-os.system("sudo ip link set can0 up type can bitrate 125000")
-sleep(2)
+if not hal.is_fake("can"):
+    print("Bring up CAN0....")
+    os.system("sudo ip link set can0 down")
+    sleep(3)
+    os.system("sudo ip link set can0 up type can bitrate 125000")
+    sleep(2)
 
 
 counter = 0
@@ -79,15 +82,10 @@ def main():
         lcd.lcd_string(current_date, lcd.LCD_LINE_2)
         sleep(2)
 
+        # One bus owner; returns as soon as strips 1 and 2 have answered
+        # (or after the old worst-case boot wait if one of them is missing)
         ams_can = AMS_CAN()
-        ams_can.get_version_number(1)
-        ams_can.get_version_number(2)
-        sleep(2)
-
-        ams_can = AMS_CAN()
-        sleep(6)
-        ams_can.get_version_number(1)
-        ams_can.get_version_number(2)
+        ams_can.discover_strips([1, 2], timeout=8)
 
         print("\nNo of key-lists : " + str(len(ams_can.key_lists)))
 
@@ -1735,6 +1733,12 @@ def main():
 
 
 if __name__ == "__main__":
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    # Raises MigrationError (and exits) if the schema cannot be brought up
+    migrate(engine)
+    with sessionmaker(bind=engine)() as session:
+        load_event_types(session)
+
     while True:
         try:
             main()
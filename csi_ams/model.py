@@ -274,6 +274,24 @@ class AMS_Users(Base):
                 return dic_result
 
 
+# Membership of AMS_Activities.users / .keys, one row per id. The CSV
+# columns stay the source of truth written by the backend; triggers from
+# db_migrations.py keep these rows in step with them.
+activity_users = Table(
+    "activity_users",
+    Base.metadata,
+    Column("activity_id", Integer, ForeignKey("activities.id"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+)
+
+activity_keys = Table(
+    "activity_keys",
+    Base.metadata,
+    Column("activity_id", Integer, ForeignKey("activities.id"), primary_key=True),
+    Column("key_id", Integer, ForeignKey("keys.id"), primary_key=True),
+)
+
+
 class AMS_Activities(Base):
     __tablename__ = "activities"
     id = Column(Integer, primary_key=True)
@@ -292,77 +310,24 @@ class AMS_Activities(Base):
     updatedAt = Column(DateTime)
     deletedAt = Column(DateTime)
 
-    def get_keys_allowed(self, session, userid, activity_code, access_time):
-
-        dic_result = {}
-        recordset = (
-            session.query(AMS_Activities)
-            .filter(AMS_Activities.activityCode == activity_code)
+    def has_user(self, session, user_id):
+        return (
+            session.query(activity_users.c.user_id)
+            .filter(
+                activity_users.c.activity_id == self.id,
+                activity_users.c.user_id == int(user_id),
+            )
             .first()
+            is not None
         )
 
-        if recordset:
-            user_exist = str(userid) in str(recordset.users).split(",")
-            if user_exist:
-                allowed_now = (access_time.time() >= recordset.timeSlotFrom) and (
-                    access_time.time() <= recordset.timeSlotTo
-                )
-                if allowed_now:
-                    allowed_today = str(access_time.today().weekday()) in str(
-                        recordset.weekDays
-                    ).split(",")
-                    if allowed_today:
-                        recordCount = (
-                            session.query(AMS_Access_Log)
-                            .filter(
-                                AMS_Access_Log.activityCode == activity_code,
-                                func.date(AMS_Access_Log.activityCodeEntryTime)
-                                == date.today(),
-                                AMS_Access_Log.keysTaken != "[]",
-                            )
-                            .count()
-                        )
-                        if (
-                            recordCount <= recordset.frequency
-                            or recordset.frequency == 0
-                        ):
-                            dic_result = {
-                                "ResultCode": ACTIVITY_ALLOWED,
-                                "Message": str(recordset.keys),
-                                "Description": recordset.activityName,
-                            }
-                            return dic_result
-
-                        else:
-                            dic_result = {
-                                "ResultCode": ACTIVITY_ERROR_FREQUENCY_EXCEEDED,
-                                "Message": "Frequency exceed",
-                            }
-                            return dic_result
-                    else:
-                        dic_result = {
-                            "ResultCode": ACTIVITY_ERROR_WEEKDAY_INVALID,
-                            "Message": "Not allowed today",
-                        }
-                        return dic_result
-                else:
-                    dic_result = {
-                        "ResultCode": ACTIVITY_ERROR_TIME_INVALID,
-                        "Message": "Wrong time slot",
-                    }
-                    return dic_result
-            else:
-                dic_result = {
-                    "ResultCode": ACTIVITY_ERROR_USER_INVALID,
-                    "Message": "User not allowed",
-                }
-                return dic_result
-        else:
-            dic_result = {
-                "ResultCode": ACTIVITY_ERROR_CODE_INCORRECT,
-                "Message": "Wrong Act. Code",
-            }
-            return dic_result
+    def get_keys_allowed(self, session, userid, activity_code, access_time):
+        # Decided from the in-memory index (rebuilt when activities change)
+        from activity_auth import get_activity_index
+
+        return get_activity_index().get_keys_allowed(
+            session, userid, activity_code, access_time
+        )
 
 
 class AMS_Access_Log(Base):
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-import smbus2
+import hal
 
 
 def _bcd_to_int(bcd):
@@ -41,7 +41,7 @@ class SDL_DS1307():
 
 
     def __init__(self, twi=1, addr=0x68):
-        self._bus = smbus2.SMBus(twi)
+        self._bus = hal.open_i2c_bus(twi)
         self._addr = addr
 
 
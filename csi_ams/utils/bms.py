@@ -1,15 +1,14 @@
-import math
-import serial
 from time import sleep
 
-ser = serial.Serial(
-    port="/dev/ttyAML1",  # Replace ttyS0 with ttyAM0 for Pi1,Pi2,Pi0
-    baudrate=9600,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=5,
-)
+from amsbms import get_bms
+from battery_telemetry import BATTERY_FIRST_READ_TIMEOUT, get_battery_telemetry
+
+# Shared reader of /dev/ttyAML1 (card_reader.py uses the same one); kept
+# under the old name since callers pass it back in: get_batt_pct(bms.ser)
+ser = get_bms()
+
+# Only the first call blocks for the board's first BATT= line
+_first_read_waited = False
 
 
 def convert_volt_to_pct(value, low_volt=9.7, high_volt=11.1, low_pct=0, high_pct=100):
@@ -20,30 +19,15 @@ def convert_volt_to_pct(value, low_volt=9.7, high_volt=11.1, low_pct=0, high_pct
 
 
 def get_batt_pct(ser):
-    ser.close()
-    ser.open()
-    batt_volt = 0
-    try:
-        while True:
-            x = ser.readline()
-            x = x.decode()
-            
-            if x[:4] == "BATT":
-                batt_volt = float(x[5:10])
-                print(batt_volt)
-                if batt_volt < 9.7:
-                    batt_volt = 9.7
-                elif batt_volt > 11.1:
-                    batt_volt = 11.1
-                batt_volt = math.floor(convert_volt_to_pct(batt_volt))
-                print(f'battery percentage is: {batt_volt}')
-                break
-            
-    except Exception as e:
-        print(e)
-    return batt_volt
+    """Smoothed battery percentage from the telemetry cache (0 if none yet)."""
+    global _first_read_waited
+    wait = 0 if _first_read_waited else BATTERY_FIRST_READ_TIMEOUT
+    pct = get_battery_telemetry().percent(wait=wait)
+    _first_read_waited = True
+    return 0 if pct is None else pct
             
 
 if __name__ == "__main__":
     while True:
-        get_batt_pct(ser)
\ No newline at end of file
+        print(f'battery percentage is: {get_batt_pct(ser)}')
+        sleep(1)
@@ -1,9 +1,9 @@
-import mraa
 import time
 
+import hal
 
-SOL = mraa.Gpio(37)
-SOL.dir(mraa.DIR_OUT)
+
+SOL = hal.gpio_output(37)
 
 
 try:
@@ -1,36 +1,25 @@
-import math
-import serial
 from time import sleep
 
+from amsbms import get_bms
 
-ser = serial.Serial(
-    port="/dev/ttyAML1",  # Replace ttyS0 with ttyAM0 for Pi1,Pi2,Pi0
-    baudrate=9600,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=5,
-)
+# Shared reader of /dev/ttyAML1 (bms.py uses the same one); kept under the
+# old name since callers pass it back in: get_card_no(card_reader.ser)
+ser = get_bms()
 
-def get_card_no(ser):
-    ser.close()
-    ser.open()
+# get_card_no() waits this long for a swipe; login loops call it repeatedly
+CARD_WAIT_TIMEOUT = 1.0
+# A swipe made just before the call still counts, an older one does not
+CARD_MAX_AGE = 2.0
+
+
+def get_card_no(ser, timeout=CARD_WAIT_TIMEOUT):
+    """Next card number swiped, or 0 if none within timeout seconds."""
     card_no = 0
     try:
-        cnt = 0
-        while True:
-            sleep(0.1)
-            cnt += 1
-            print('reading')
-            x = ser.readline()
-            x = x.decode()
-            if x[:2] == "ID":
-                card_no = x[3:]
-                print(f'card number is: {card_no}')
-                break
-            if cnt >= 300:
-                break
-            
+        swiped = ser.wait_card(timeout, max_age=CARD_MAX_AGE)
+        if swiped:
+            card_no = swiped
+            print(f'card number is: {card_no}')
     except Exception as e:
         print(e)
     return card_no
@@ -39,4 +28,4 @@ def get_card_no(ser):
 if __name__ == "__main__":
     while True:
         get_card_no(ser)
-    
\ No newline at end of file
+        sleep(0.1)
@@ -1,6 +1,7 @@
 import sys
-# import mraa   # ❌ COMMENTED
 import threading
+import hal
+import event_types
 from . import bms
 from csi_ams.model import *
 from csi_ams.amscan import *
@@ -56,18 +57,17 @@ SLOT_STATUS_KEY_NOT_PRESENT = 0
 SLOT_STATUS_KEY_PRESENT_RIGHT_SLOT = 1
 SLOT_STATUS_KEY_PRESENT_WRONG_SLOT = 2
 
-# ================= GPIO CONSTANTS (COMMENTED) =================
-# BUZZER_PIN = 37
-# DOOR_LOCK_PIN = 40
-# LIMIT_SWITCH_PIN = 32
+# ================= GPIO CONSTANTS =================
+BUZZER_PIN = 37
+DOOR_LOCK_PIN = 40
+LIMIT_SWITCH_PIN = 32
 
-# BUZZ = mraa.Gpio(BUZZER_PIN)
-# DOOR_LOCK = mraa.Gpio(DOOR_LOCK_PIN)
-# LIMIT_SWITCH = mraa.Gpio(LIMIT_SWITCH_PIN)
-
-# DOOR_LOCK.dir(mraa.DIR_OUT)
-# BUZZ.dir(mraa.DIR_OUT)
-# LIMIT_SWITCH.dir(mraa.DIR_IN)
+# Through the HAL (mraa on the board, fake pins with AMS_HAL=gpio=fake).
+# The pins are only opened on their first read/write, so importing this
+# module (db.py does) touches no GPIO.
+BUZZ = hal.gpio_output(BUZZER_PIN)
+DOOR_LOCK = hal.gpio_output(DOOR_LOCK_PIN)
+LIMIT_SWITCH = hal.gpio_input(LIMIT_SWITCH_PIN)
 
 # ================= TIMEZONE =================
 TZ_INDIA = pytz.timezone("Asia/Kolkata")
@@ -170,15 +170,7 @@ def take_key_pad_input(session, key_pad):
 
 def get_event_description(session, event_status):
     """
-    Fetch event description from DB using event ID
+    Event description for an event ID, from the process-wide event type
+    cache (see event_types.py)
     """
-    event_type = (
-        session.query(AMS_Event_Types)
-        .filter(AMS_Event_Types.eventId == event_status)
-        .one_or_none()
-    )
-
-    if event_type:
-        return event_type.eventDescription
-
-    return ""
+    return event_types.get_event_description(session, event_status)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
-import smbus2
 import sys
 import time
 
+import hal
+
 """ this is an example on how to create a keypad using the pcf8475
 
     I use an old telephone keypad and this is the layout of it
@@ -36,10 +37,17 @@ class MyKeyboard:
     def __init__(self, I2CBus=3, I2CAddress=0x20):
         self.I2CAddress = I2CAddress
         self.I2CBus = I2CBus
-        # open smbus pcf8574
-        self.bus = smbus2.SMBus(self.I2CBus)
-        # set pcf to input
-        self.bus.write_byte(self.I2CAddress, 0xFF)
+        # smbus pcf8574, opened on first use (see bus)
+        self._bus = None
+
+    @property
+    def bus(self):
+        if self._bus is None:
+            # open smbus pcf8574
+            self._bus = hal.open_i2c_bus(self.I2CBus)
+            # set pcf to input
+            self._bus.write_byte(self.I2CAddress, 0xFF)
+        return self._bus
 
         # ReadRawKey
         # this function will scan and return a key press
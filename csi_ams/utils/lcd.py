@@ -1,8 +1,9 @@
 # Imort required libraries
-import smbus2
 import time
 import datetime
 
+import hal
+
 
 # Define some device parameters
 I2C_ADDR = 0x27  # I2C device address, if any error, change this address to 0x27
@@ -26,9 +27,19 @@ ENABLE = 0b00000100  # Enable bit
 E_PULSE = 0.0005
 E_DELAY = 0.0005
 
-# Open I2C interface
+# I2C interface, opened on first use so importing this module opens nothing
 # bus = smbus.SMBus(0)  # Rev 1 Pi uses 0
-bus = smbus2.SMBus(3)  # Rev 2 Pi uses 1
+I2C_BUS = 3  # Rev 2 Pi uses 1
+bus = None
+
+
+def _bus():
+    global bus
+    if bus is None:
+        bus = hal.open_i2c_bus(I2C_BUS)
+    return bus
+
+
 print("RTC with Pi3 USING SDL_DS1307 Library Version 1.0 - From SwitchDoc Labs")
 
 
@@ -53,20 +64,20 @@ def lcd_byte(bits, mode):
     bits_low = mode | ((bits << 4) & 0xF0) | LCD_BACKLIGHT
 
     # High bits
-    bus.write_byte(I2C_ADDR, bits_high)
+    _bus().write_byte(I2C_ADDR, bits_high)
     lcd_toggle_enable(bits_high)
 
     # Low bits
-    bus.write_byte(I2C_ADDR, bits_low)
+    _bus().write_byte(I2C_ADDR, bits_low)
     lcd_toggle_enable(bits_low)
 
 
 def lcd_toggle_enable(bits):
     # Toggle enable
     time.sleep(E_DELAY)
-    bus.write_byte(I2C_ADDR, (bits | ENABLE))
+    _bus().write_byte(I2C_ADDR, (bits | ENABLE))
     time.sleep(E_PULSE)
-    bus.write_byte(I2C_ADDR, (bits & ~ENABLE))
+    _bus().write_byte(I2C_ADDR, (bits & ~ENABLE))
     time.sleep(E_DELAY)
 
 
@@ -1,9 +1,8 @@
-import mraa
+import hal
 from time import sleep
 import time
 
-LIMIT_SWITCH = mraa.Gpio(32)
-LIMIT_SWITCH.dir(mraa.DIR_IN)
+LIMIT_SWITCH = hal.gpio_input(32)
 
 
 while True:
@@ -1,17 +1,17 @@
-import mraa
 import time
 
+import hal
+
 
 # BUZZ = mraa.Gpio(37)
 # RL1 = mraa.Gpio(10) # 38
 # RL2 = mraa.Gpio(40)
-LS = mraa.Gpio(7)
+LS = hal.gpio_input(7)
 
 # set gpio as outputs
 # BUZZ.dir(mraa.DIR_OUT)
 # RL1.dir(mraa.DIR_OUT)
 # RL2.dir(mraa.DIR_OUT)
-LS.dir(mraa.DIR_IN)
 
 # toggle both gpio's
 while True:
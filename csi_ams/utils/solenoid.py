@@ -1,9 +1,9 @@
-import mraa
 import time
 
+import hal
 
-SOL = mraa.Gpio(40)
-SOL.dir(mraa.DIR_OUT)
+
+SOL = hal.gpio_output(40)
 
 
 try:
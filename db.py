@@ -10,21 +10,21 @@ from model import (
     AMS_Access_Log,
     AMS_Event_Log,
     AMS_Event_Types,
+    activity_keys,
+    activity_users,
 )
 
 from csi_ams.utils.commons import TZ_INDIA
+from log_writer import get_log_writer
+import event_types
 
 
 # ==================================================
 # EVENT DESCRIPTION
 # ==================================================
 def get_event_description(session: Session, event_id: int) -> str:
-    event = (
-        session.query(AMS_Event_Types)
-        .filter(AMS_Event_Types.eventId == event_id)
-        .one_or_none()
-    )
-    return event.eventDescription if event else ""
+    # event_types is reference data: served from the process-wide cache
+    return event_types.get_event_description(session, event_id)
 
 
 # ==================================================
@@ -32,7 +32,6 @@ def get_event_description(session: Session, event_id: int) -> str:
 # ==================================================
 
 def log_access_and_event(
-    session: Session,
     *,
     event_id: int,
     event_type: int,
@@ -48,18 +47,22 @@ def log_access_and_event(
       - AMS_Access_Log
       - AMS_Event_Log
 
+    The rows are queued on the write-behind log writer (log_writer.py)
+    instead of being committed here, so no session is needed.
+
     access_log_updates:
         dict of fields to override on AMS_Access_Log
 
     Returns:
         {
-            "access_log_id": int,
-            "event_log_id": int
+            "access_log": LogTicket,   # .id once written
+            "event_log": LogTicket,
         }
     """
+    writer = get_log_writer()
 
     # ---------------- ACCESS LOG ----------------
-    access_log = AMS_Access_Log(
+    access_log = dict(
         signInTime=datetime.now(TZ_INDIA),
         signInMode=auth_mode,
         signInFailed=0,
@@ -77,15 +80,14 @@ def log_access_and_event(
     )
 
     if access_log_updates:
-        for field, value in access_log_updates.items():
-            setattr(access_log, field, value)
+        access_log.update(access_log_updates)
 
-    session.add(access_log)
-    session.flush()  # get ID without commit
+    access_ticket = writer.add_access_log(**access_log)
 
     # ---------------- EVENT LOG ----------------
-    event_log = AMS_Event_Log(
-        access_log_id=access_log.id,
+    # eventDesc is looked up on the writer thread
+    event_ticket = writer.add_event_log(
+        access_log=access_ticket,
         userId=user_id or 0,
         keyId=key_id,
         activityId=activity_id,
@@ -93,16 +95,12 @@ def log_access_and_event(
         loginType=login_type,
         timeStamp=datetime.now(TZ_INDIA),
         event_type=event_type,
-        eventDesc=get_event_description(session, event_id),
         is_posted=0,
     )
 
-    session.add(event_log)
-    session.commit()
-
     return {
-        "access_log_id": access_log.id,
-        "event_log_id": event_log.id,
+        "access_log": access_ticket,
+        "event_log": event_ticket,
     }
 
 
@@ -151,26 +149,16 @@ def get_keys_for_activity(
     session: Session,
     activity_id: int,
 ):
-    activity = (
-        session.query(AMS_Activities)
-        .filter(
-            AMS_Activities.id == activity_id,
-            AMS_Activities.deletedAt == None,
-        )
-        .first()
-    )
-
-    if not activity or not activity.keys:
-        return []
-
-    key_ids = [int(k) for k in activity.keys.split(",")]
-
     keys = (
         session.query(AMS_Keys)
+        .join(activity_keys, activity_keys.c.key_id == AMS_Keys.id)
+        .join(AMS_Activities, AMS_Activities.id == activity_keys.c.activity_id)
         .filter(
-            AMS_Keys.id.in_(key_ids),
+            activity_keys.c.activity_id == activity_id,
+            AMS_Activities.deletedAt == None,
             AMS_Keys.deletedAt == None,
         )
+        .order_by(AMS_Keys.id)
         .all()
     )
 
@@ -353,7 +341,12 @@ def get_user_activities(
 ):
     activities = (
         session.query(AMS_Activities)
-        .filter(AMS_Activities.deletedAt == None)
+        .join(activity_users, activity_users.c.activity_id == AMS_Activities.id)
+        .filter(
+            activity_users.c.user_id == int(user_id),
+            AMS_Activities.deletedAt == None,
+        )
+        .order_by(AMS_Activities.id)
         .all()
     )
 
@@ -367,7 +360,6 @@ def get_user_activities(
             "key_names": a.keyNames,
         }
         for a in activities
-        if a.users and str(user_id) in a.users.split(",")
     ]
 
 
@@ -391,7 +383,7 @@ def verify_activity_code(
     if not activity:
         return {"valid": False, "message": "Activity code not found"}
 
-    if activity.users and str(user_id) in activity.users.split(","):
+    if activity.has_user(session, user_id):
         return {
             "valid": True,
             "id": activity.id,
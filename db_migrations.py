@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the cabinet SQLite database.
+
+The tables are created by the backend sync, so this only adds what the
+cabinet itself needs on top (indexes, later helper tables). Each migration
+runs once, in its own transaction, and is recorded in schema_migrations:
+
+    from db_migrations import migrate
+    migrate(engine)              # at startup, before the first query
+
+A migration that fails is rolled back and migrate() raises MigrationError:
+db.py queries the tables they add, so the app must not start without them.
+
+    python3 db_migrations.py status
+    python3 db_migrations.py migrate
+    python3 db_migrations.py check      # EXPLAIN the hot lookups
+
+check_query_plans() runs the card / PIN / peg / activity lookups from db.py
+and user_registration_service.py against an in-memory copy of the
+database and reports any statement that SQLite answers with a table scan.
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+SCHEMA_TABLE = "schema_migrations"
+
+
+class MigrationError(Exception):
+    """A migration failed; the schema is left at the last applied version."""
+
+
+def _csv_ids(column):
+    """
+    SQL for a JSON array of the entries of a legacy id list column
+    ("1,2,3", also "[1, 2]"), for json_each(); '[]' if it cannot be parsed.
+    """
+    stripped = f"ifnull({column}, '')"
+    for char in ("'['", "']'", "'\"'", "' '", "char(92)"):
+        stripped = f"replace({stripped}, {char}, '')"
+    array = f"""'["' || replace({stripped}, ',', '","') || '"]'"""
+    return f"CASE WHEN json_valid({array}) THEN {array} ELSE '[]' END"
+
+
+def _insert_members(table, member_column, activity_id, csv_column, source=""):
+    return (
+        f"INSERT OR IGNORE INTO {table} (activity_id, {member_column}) "
+        f"SELECT {activity_id}, CAST(ids.value AS INTEGER) "
+        f"FROM {source}json_each({_csv_ids(csv_column)}) AS ids "
+        "WHERE ids.value != '' AND ids.value NOT GLOB '*[^0-9]*'"
+    )
+
+
+# (version, name, statements); append only, never edit an applied entry.
+# The indexes are partial on "deletedAt" IS NULL, which every lookup below
+# filters on, so soft-deleted rows do not bloat them.
+MIGRATIONS = [
+    (
+        1,
+        "partial indexes on card, PIN, peg and activity code lookups",
+        [
+            'CREATE INDEX IF NOT EXISTS ix_users_cardNo_live '
+            'ON users ("cardNo") WHERE "deletedAt" IS NULL',
+            'CREATE INDEX IF NOT EXISTS ix_users_pinCode_live '
+            'ON users ("pinCode") WHERE "deletedAt" IS NULL',
+            'CREATE INDEX IF NOT EXISTS ix_keys_peg_id_live '
+            'ON keys (peg_id) WHERE "deletedAt" IS NULL',
+            'CREATE INDEX IF NOT EXISTS ix_activities_activityCode_live '
+            'ON activities ("activityCode") WHERE "deletedAt" IS NULL',
+        ],
+    ),
+    (
+        2,
+        "activity_users / activity_keys membership tables",
+        [
+            "CREATE TABLE IF NOT EXISTS activity_users ("
+            "activity_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+            "PRIMARY KEY (activity_id, user_id))",
+            "CREATE INDEX IF NOT EXISTS ix_activity_users_user_id "
+            "ON activity_users (user_id)",
+            "CREATE TABLE IF NOT EXISTS activity_keys ("
+            "activity_id INTEGER NOT NULL, key_id INTEGER NOT NULL, "
+            "PRIMARY KEY (activity_id, key_id))",
+            # Backfill from the CSV columns
+            "DELETE FROM activity_users",
+            "DELETE FROM activity_keys",
+            _insert_members("activity_users", "user_id", "a.id", 'a."users"', "activities AS a, "),
+            _insert_members("activity_keys", "key_id", "a.id", 'a."keys"', "activities AS a, "),
+            # ... and follow every change the backend sync makes to them
+            "CREATE TRIGGER IF NOT EXISTS activities_members_insert "
+            "AFTER INSERT ON activities BEGIN "
+            + _insert_members("activity_users", "user_id", "NEW.id", 'NEW."users"') + "; "
+            + _insert_members("activity_keys", "key_id", "NEW.id", 'NEW."keys"') + "; "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS activities_users_update "
+            'AFTER UPDATE OF id, "users" ON activities BEGIN '
+            "DELETE FROM activity_users WHERE activity_id = OLD.id; "
+            + _insert_members("activity_users", "user_id", "NEW.id", 'NEW."users"') + "; "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS activities_keys_update "
+            'AFTER UPDATE OF id, "keys" ON activities BEGIN '
+            "DELETE FROM activity_keys WHERE activity_id = OLD.id; "
+            + _insert_members("activity_keys", "key_id", "NEW.id", 'NEW."keys"') + "; "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS activities_members_delete "
+            "AFTER DELETE ON activities BEGIN "
+            "DELETE FROM activity_users WHERE activity_id = OLD.id; "
+            "DELETE FROM activity_keys WHERE activity_id = OLD.id; "
+            "END",
+        ],
+    ),
+    (
+        3,
+        "activity revision counter and access_log entry time index",
+        [
+            "CREATE TABLE IF NOT EXISTS activity_revision ("
+            "id INTEGER PRIMARY KEY, revision INTEGER NOT NULL)",
+            "INSERT OR IGNORE INTO activity_revision (id, revision) VALUES (1, 0)",
+        ] + [
+            f"CREATE TRIGGER IF NOT EXISTS activities_revision_{action.lower()} "
+            f"AFTER {action} ON activities BEGIN "
+            "UPDATE activity_revision SET revision = revision + 1 WHERE id = 1; "
+            "END"
+            for action in ("INSERT", "UPDATE", "DELETE")
+        ] + [
+            # Seeds activity_auth's daily usage counter
+            "CREATE INDEX IF NOT EXISTS ix_access_log_activityCodeEntryTime "
+            'ON access_log ("activityCodeEntryTime")',
+        ],
+    ),
+]
+
+# Values the plan check looks up; they only ever touch the in-memory copy
+_PROBE_CARD = "0000000000"
+_PROBE_CARD_NEW = "0000000001"
+_PROBE_PIN = "000000"
+_PROBE_PEG = -1
+_PROBE_ACTIVITY_CODE = "000000"
+
+
+# =====================================================
+# MIGRATIONS
+# =====================================================
+def _ensure_schema_table(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR NOT NULL, "
+        "appliedAt DATETIME NOT NULL)"
+    ))
+
+
+def current_version(conn):
+    _ensure_schema_table(conn)
+    version = conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_TABLE}")).scalar()
+    return version or 0
+
+
+def migrate(engine, target=None):
+    """
+    Apply pending migrations up to target (default: all); returns the version.
+    Raises MigrationError if one fails.
+    """
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for number, name, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        try:
+            with engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+                conn.execute(
+                    text(f"INSERT INTO {SCHEMA_TABLE} (version, name, appliedAt) "
+                         "VALUES (:version, :name, :at)"),
+                    {"version": number, "name": name, "at": datetime.now()},
+                )
+        except Exception as e:
+            print(f"[DB] ❌ Migration {number} ({name}) failed: {e}")
+            print(f"[DB] Schema version {version}")
+            raise MigrationError(f"migration {number} ({name}) failed: {e}") from e
+        version = number
+        print(f"[DB] Applied migration {number}: {name}")
+
+    print(f"[DB] Schema version {version}")
+    return version
+
+
+# =====================================================
+# QUERY PLAN CHECK
+# =====================================================
+def explain(conn, statement, parameters=None):
+    """EXPLAIN QUERY PLAN detail lines for one statement."""
+    rows = conn.exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + statement, parameters or ()
+    ).fetchall()
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(detail):
+    # "SEARCH users USING INDEX ..." is a lookup; "SCAN users" (with or
+    # without a covering index) reads every row
+    return detail.startswith("SCAN ")
+
+
+def _run_hot_lookups(session):
+    import db
+    from user_registration_service import UserRegistrationService
+
+    UserRegistrationService(session).create_new_user(_PROBE_CARD, _PROBE_PIN)
+    db.check_card_exists(session, _PROBE_CARD)
+    db.verify_card_pin(session, _PROBE_CARD, _PROBE_PIN)
+    # Takes the force_update path: PIN lookup, then the other-card check
+    db.verify_or_assign_card_pin(session, _PROBE_CARD_NEW, _PROBE_PIN, force_update=True)
+    db.set_key_status_by_peg_id(session, _PROBE_PEG, 0)
+    db.verify_activity_code(session, 0, _PROBE_ACTIVITY_CODE)
+    db.get_user_activities(session, 0)
+    db.get_keys_for_activity(session, 0)
+    session.rollback()
+
+
+def check_query_plans(engine):
+    """
+    Run the hot lookups on an in-memory copy of the database (migrated to
+    the latest version) and EXPLAIN every SELECT they issue.
+
+    Returns [(sql, [plan details], full_scan)], one entry per statement.
+    """
+    memory = create_engine("sqlite://")
+    source = engine.raw_connection()
+    target = memory.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+    finally:
+        source.close()
+        target.close()
+    migrate(memory)
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(memory, "before_cursor_execute", capture)
+    session = sessionmaker(bind=memory)()
+    try:
+        _run_hot_lookups(session)
+    finally:
+        session.close()
+        event.remove(memory, "before_cursor_execute", capture)
+
+    results = []
+    seen = set()
+    with memory.connect() as conn:
+        for statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            details = explain(conn, statement, parameters)
+            results.append((statement, details, any(is_full_scan(d) for d in details)))
+    memory.dispose()
+    return results
+
+
+# =====================================================
+# CLI
+# =====================================================
+def main():
+    from db_core import SQLALCHEMY_DATABASE_URI
+
+    parser = argparse.ArgumentParser(description="AMS schema migrations")
+    parser.add_argument("command", choices=("status", "migrate", "check"))
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URI, help="SQLAlchemy URI")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db)
+
+    if args.command == "status":
+        with engine.begin() as conn:
+            version = current_version(conn)
+        latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+        print(f"Schema version {version} (latest {latest})")
+        return 0
+
+    if args.command == "migrate":
+        try:
+            migrate(engine)
+        except MigrationError:
+            return 1
+        return 0
+
+    failures = 0
+    for statement, details, full_scan in check_query_plans(engine):
+        failures += full_scan
+        # The column lists are long and say nothing about the plan
+        statement = " ".join(statement.split())
+        statement = "SELECT … " + statement[statement.find(" FROM ") + 1:]
+        print(("FULL SCAN  " if full_scan else "ok         ") + statement)
+        for detail in details:
+            print(f"           {detail}")
+    print(f"{failures} statement(s) scan a whole table")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
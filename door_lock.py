@@ -0,0 +1,154 @@
+"""
+In-process door solenoid and buzzer controller.
+
+Replaces spawning `sudo python3 solenoid.py 0|1` for every lock/unlock: the
+GPIO pins are opened once and each call is a couple of pin writes.
+
+    door_lock = get_door_lock()
+    door_lock.unlock()
+    door_lock.beep(0.2)
+
+Every operation is timed; get_stats() returns count / last / mean / max in
+milliseconds per operation.
+
+GPIO permissions: solenoid.py used to run under sudo, but the pins are now
+opened by the kiosk process itself, so its user needs access to the GPIO
+devices. On the board (user rock):
+
+    sudo groupadd -f gpio && sudo usermod -aG gpio rock
+
+    # /etc/udev/rules.d/99-ams-gpio.rules
+    SUBSYSTEM=="gpio", KERNEL=="gpiochip*", GROUP="gpio", MODE="0660"
+    SUBSYSTEM=="gpio", ACTION=="add", PROGRAM="/bin/sh -c 'chgrp -R gpio /sys/class/gpio /sys/devices/platform/*/gpio* && chmod -R g+w /sys/class/gpio /sys/devices/platform/*/gpio*'"
+
+then reboot (or `sudo udevadm trigger` and log in again). Without it
+get_door_lock() raises and the app runs without the door lock.
+"""
+
+import threading
+import time
+
+import hal
+
+# Same pins as solenoid.py
+BUZZER_PIN = 37
+RL1_PIN = 38
+RL2_PIN = 40
+
+
+class _OpTiming(object):
+    __slots__ = ("count", "total_ms", "last_ms", "max_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.last_ms = None
+        self.max_ms = None
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.last_ms = ms
+        if self.max_ms is None or ms > self.max_ms:
+            self.max_ms = ms
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "last_ms": round(self.last_ms, 3) if self.last_ms is not None else None,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3) if self.max_ms is not None else None,
+        }
+
+
+class DoorLockController(object):
+    def __init__(self, backend=None, relay_pins=(RL1_PIN, RL2_PIN),
+                 buzzer_pin=BUZZER_PIN):
+        self.backend = backend if backend is not None else hal.get_gpio_backend()
+        self.relay_pins = tuple(relay_pins)
+        self.buzzer_pin = buzzer_pin
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._beep_timer = None
+        self.unlocked = False
+        self.buzzing = False
+
+        for pin in self.relay_pins + (self.buzzer_pin,):
+            self.backend.setup_output(pin)
+
+    def _timed(self, name, start):
+        elapsed_ms = (time.monotonic() - start) * 1000.0
+        timing = self._timings.get(name)
+        if timing is None:
+            timing = self._timings[name] = _OpTiming()
+        timing.add(elapsed_ms)
+
+    # ---------------- Solenoid ----------------
+    def set_solenoid(self, on):
+        start = time.monotonic()
+        value = 1 if on else 0
+        with self._lock:
+            for pin in self.relay_pins:
+                self.backend.write(pin, value)
+            self.unlocked = bool(on)
+            self._timed("unlock" if on else "lock", start)
+        print("[DOOR LOCK] Solenoids " + ("activated" if on else "deactivated"))
+
+    def unlock(self):
+        self.set_solenoid(True)
+
+    def lock(self):
+        self.set_solenoid(False)
+
+    # ---------------- Buzzer ----------------
+    def buzz(self, on):
+        start = time.monotonic()
+        with self._lock:
+            if self._beep_timer is not None:
+                self._beep_timer.cancel()
+                self._beep_timer = None
+            self.backend.write(self.buzzer_pin, 1 if on else 0)
+            self.buzzing = bool(on)
+            self._timed("buzz", start)
+
+    def beep(self, duration=0.2):
+        """Sound the buzzer for duration seconds without blocking the caller."""
+        self.buzz(True)
+        timer = threading.Timer(duration, self.buzz, args=(False,))
+        timer.daemon = True
+        with self._lock:
+            self._beep_timer = timer
+        timer.start()
+
+    # ---------------- Metrics ----------------
+    def get_stats(self):
+        with self._lock:
+            return {name: timing.as_dict() for name, timing in self._timings.items()}
+
+    def shutdown(self):
+        """Leave the door locked and the buzzer off."""
+        self.buzz(False)
+        self.lock()
+
+
+_door_lock = None
+_door_lock_guard = threading.Lock()
+
+
+def get_door_lock():
+    """
+    Process-wide DoorLockController, created on first use. Raises if the
+    GPIO pins cannot be opened; the next call tries again.
+    """
+    global _door_lock
+    with _door_lock_guard:
+        if _door_lock is None:
+            _door_lock = DoorLockController()
+        return _door_lock
+
+
+def set_door_lock(controller):
+    """Install the process-wide controller (e.g. one with a fake backend)."""
+    global _door_lock
+    with _door_lock_guard:
+        _door_lock = controller
@@ -0,0 +1,206 @@
+"""
+In-process door sensor monitor.
+
+Watches the door limit switch (GPIO 32, 1 = open) and hands debounced
+DoorEvents straight to subscribers, replacing pub.py polling every 100 ms
+and publishing to the local MQTT broker.
+
+    monitor = get_door_monitor()
+    monitor.subscribe(on_door_event)      # called on the monitor thread
+
+Edge interrupts are used when the GPIO backend supports them, otherwise
+the pin is polled every poll_interval seconds. A transition is reported
+once the level has been stable for `debounce` seconds; its timestamp is
+the first edge of the burst, not the end of the debounce window.
+
+If the pin cannot be opened (no mraa, no GPIO permission) the monitor
+stays stopped with state DOOR_UNKNOWN and no events; get_door_monitor()
+tries to start it again on the next call.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+import hal
+
+DOOR_SENSOR_PIN = 32
+
+DOOR_CLOSED = 0
+DOOR_OPEN = 1
+DOOR_UNKNOWN = 0xFF
+
+DOOR_DEBOUNCE = 0.05
+DOOR_POLL_INTERVAL = 0.02
+
+# state: DOOR_OPEN / DOOR_CLOSED, timestamp: time.time() of the first edge
+DoorEvent = namedtuple("DoorEvent", ["state", "timestamp"])
+
+
+class DoorMonitor(object):
+    def __init__(self, backend=None, pin=DOOR_SENSOR_PIN, debounce=DOOR_DEBOUNCE,
+                 poll_interval=DOOR_POLL_INTERVAL):
+        # Opened in start(), so a GPIO failure does not stop construction
+        self.backend = backend
+        self.pin = pin
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self.state = DOOR_UNKNOWN
+        self.edge_driven = False
+        self.events = 0
+        # Seconds from the first edge of a transition to its delivery
+        self.last_delay = None
+
+        self._subscribers = []
+        self._cond = threading.Condition()
+        self._burst_start = None
+        self._last_edge = None
+        self._raw_level = None
+        self._running = False
+        self._thread = None
+
+    # ---------------- Lifecycle ----------------
+    def start(self):
+        """Start watching the pin; False (state unknown) if it cannot be opened."""
+        if self._running:
+            return True
+        try:
+            if self.backend is None:
+                self.backend = hal.get_gpio_backend()
+            self.backend.setup_input(self.pin)
+        except Exception as e:
+            self.state = DOOR_UNKNOWN
+            print(f"[DOOR] Sensor unavailable ({e}); door state unknown")
+            return False
+        self.state = self._read()
+        self._raw_level = self.state
+        self.edge_driven = self.backend.watch_edges(self.pin, self._on_edge)
+        print(
+            f"[DOOR] Monitoring pin {self.pin} "
+            f"({'edge interrupts' if self.edge_driven else 'polling'}), "
+            f"initial state {self.state}"
+        )
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    # ---------------- Subscribers ----------------
+    def subscribe(self, callback):
+        """callback(DoorEvent) on every debounced transition (monitor thread)."""
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def is_open(self):
+        return self.state == DOOR_OPEN
+
+    def is_running(self):
+        return self._running
+
+    # ---------------- Internals ----------------
+    def _read(self):
+        try:
+            return DOOR_OPEN if self.backend.read(self.pin) == 1 else DOOR_CLOSED
+        except Exception:
+            return DOOR_UNKNOWN
+
+    def _on_edge(self):
+        """Runs in the interrupt (or polling) context: just note the edge."""
+        now = time.monotonic()
+        with self._cond:
+            if self._burst_start is None:
+                self._burst_start = (now, time.time())
+            self._last_edge = now
+            self._cond.notify()
+
+    def _poll(self):
+        level = self._read()
+        if level != self._raw_level:
+            self._raw_level = level
+            self._on_edge()
+
+    def _run(self):
+        while self._running:
+            with self._cond:
+                if self._burst_start is None:
+                    self._cond.wait(1.0 if self.edge_driven else self.poll_interval)
+                burst = self._burst_start
+                last_edge = self._last_edge
+            if not self._running:
+                break
+
+            if burst is None:
+                if not self.edge_driven:
+                    self._poll()
+                continue
+
+            # Wait until the pin has been quiet for the debounce period
+            quiet_for = last_edge + self.debounce - time.monotonic()
+            if quiet_for > 0:
+                time.sleep(quiet_for)
+                continue
+
+            with self._cond:
+                if self._last_edge != last_edge:
+                    continue
+                self._burst_start = None
+                self._last_edge = None
+
+            level = self._read()
+            self._raw_level = level
+            if level == DOOR_UNKNOWN or level == self.state:
+                continue
+            self.state = level
+            self._emit(DoorEvent(level, burst[1]), burst[0])
+
+    def _emit(self, event, edge_monotonic):
+        self.events += 1
+        self.last_delay = time.monotonic() - edge_monotonic
+        print(
+            f"[DOOR] {'OPEN' if event.state == DOOR_OPEN else 'CLOSED'} "
+            f"({self.last_delay * 1000:.0f} ms after edge)"
+        )
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"[DOOR] Subscriber failed: {e}")
+
+
+_door_monitor = None
+_door_monitor_guard = threading.Lock()
+
+
+def get_door_monitor():
+    """
+    Process-wide DoorMonitor, created on first use. Started if the sensor
+    can be opened; otherwise it reports DOOR_UNKNOWN and the next call
+    tries again.
+    """
+    global _door_monitor
+    with _door_monitor_guard:
+        if _door_monitor is None:
+            _door_monitor = DoorMonitor()
+        if not _door_monitor.is_running():
+            _door_monitor.start()
+        return _door_monitor
+
+
+def set_door_monitor(monitor):
+    """Install the process-wide monitor (e.g. one with a fake backend)."""
+    global _door_monitor
+    with _door_monitor_guard:
+        _door_monitor = monitor
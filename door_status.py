@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import time
-import mraa
 from csi_ams.utils.commons import LIMIT_SWITCH, read_limit_switch
 
 while True:
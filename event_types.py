@@ -0,0 +1,93 @@
+"""
+Process-wide cache of event_types descriptions.
+
+event_types is reference data synced from the backend, but every logged
+event used to query it for its eventDesc. EventTypeCache loads the table
+once (at startup, or on first use) and then answers from memory:
+
+    load_event_types(session)                    # at startup
+    get_event_description(session, EVENT_DOOR_OPEN)
+    invalidate_event_types()                     # after the table changed
+
+An id that is not cached is read through from the database once; ids
+that do not exist map to "", as before.
+"""
+
+import threading
+
+
+class EventTypeCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = None
+        self.loads = 0
+        self.misses = 0
+
+    def load(self, session):
+        """(Re)load every event type; returns how many there are."""
+        from model import AMS_Event_Types
+
+        rows = session.query(
+            AMS_Event_Types.eventId, AMS_Event_Types.eventDescription
+        ).all()
+        descriptions = {event_id: description or "" for event_id, description in rows}
+        with self._lock:
+            self._descriptions = descriptions
+            self.loads += 1
+        print(f"[DB] Loaded {len(descriptions)} event types")
+        return len(descriptions)
+
+    def invalidate(self):
+        with self._lock:
+            self._descriptions = None
+
+    def description(self, session, event_id):
+        with self._lock:
+            descriptions = self._descriptions
+        if descriptions is None:
+            self.load(session)
+            with self._lock:
+                descriptions = self._descriptions
+
+        try:
+            return descriptions[event_id]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable id: nothing could match it
+            return ""
+
+        # Not in the table when it was loaded: read this one id through
+        from model import AMS_Event_Types
+
+        self.misses += 1
+        event_type = (
+            session.query(AMS_Event_Types)
+            .filter(AMS_Event_Types.eventId == event_id)
+            .one_or_none()
+        )
+        description = (event_type.eventDescription or "") if event_type else ""
+        with self._lock:
+            if self._descriptions is descriptions:
+                descriptions[event_id] = description
+        return description
+
+
+_event_types = EventTypeCache()
+
+
+def get_event_types():
+    return _event_types
+
+
+def load_event_types(session):
+    return _event_types.load(session)
+
+
+def invalidate_event_types():
+    _event_types.invalidate()
+
+
+def get_event_description(session, event_id):
+    """eventDescription for an event id ("" if unknown), from the cache."""
+    return _event_types.description(session, event_id)
@@ -0,0 +1,131 @@
+"""
+GPIO backends for the in-process hardware controllers.
+
+MraaGpioBackend drives the board pins through libmraa (what solenoid.py and
+pub.py use); FakeGpioBackend keeps pin values in memory and records recent
+writes, for running without hardware and for tests.
+
+watch_edges(pin, callback) asks for callback() on every level change of an
+input pin and returns False when the backend cannot deliver interrupts, in
+which case the caller has to poll.
+"""
+
+import threading
+import time
+from collections import deque
+
+# FakeGpioBackend keeps this many of the most recent writes
+FAKE_GPIO_WRITE_HISTORY = 1000
+
+
+class MraaGpioBackend(object):
+    def __init__(self):
+        import mraa
+
+        self._mraa = mraa
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    def _pin(self, pin, direction):
+        gpio = self._pins.get(pin)
+        if gpio is None:
+            gpio = self._mraa.Gpio(pin)
+            gpio.dir(direction)
+            self._pins[pin] = gpio
+        return gpio
+
+    def setup_output(self, pin):
+        with self._lock:
+            self._pin(pin, self._mraa.DIR_OUT)
+
+    def setup_input(self, pin):
+        with self._lock:
+            self._pin(pin, self._mraa.DIR_IN)
+
+    def write(self, pin, value):
+        with self._lock:
+            self._pin(pin, self._mraa.DIR_OUT).write(value)
+
+    def read(self, pin):
+        with self._lock:
+            return self._pin(pin, self._mraa.DIR_IN).read()
+
+    def watch_edges(self, pin, callback):
+        try:
+            with self._lock:
+                gpio = self._pin(pin, self._mraa.DIR_IN)
+            result = gpio.isr(self._mraa.EDGE_BOTH, lambda _arg: callback(), None)
+        except Exception as e:
+            print(f"[GPIO] Edge interrupts unavailable on pin {pin}: {e}")
+            return False
+        return result == self._mraa.SUCCESS
+
+
+class FakeGpioBackend(object):
+    def __init__(self):
+        self.values = {}
+        # (time.monotonic(), pin, value) for the most recent writes
+        self.writes = deque(maxlen=FAKE_GPIO_WRITE_HISTORY)
+        self._edge_callbacks = {}
+        self._lock = threading.Lock()
+
+    def setup_output(self, pin):
+        self.values.setdefault(pin, 0)
+
+    def setup_input(self, pin):
+        self.values.setdefault(pin, 0)
+
+    def write(self, pin, value):
+        with self._lock:
+            self.values[pin] = value
+            self.writes.append((time.monotonic(), pin, value))
+
+    def read(self, pin):
+        return self.values.get(pin, 0)
+
+    def watch_edges(self, pin, callback):
+        self._edge_callbacks.setdefault(pin, []).append(callback)
+        return True
+
+    def set_input(self, pin, value):
+        """Simulate an external level change on an input pin."""
+        changed = self.values.get(pin, 0) != value
+        self.values[pin] = value
+        if changed:
+            for callback in self._edge_callbacks.get(pin, ()):
+                callback()
+
+
+class GpioPin(object):
+    """
+    mraa.Gpio-shaped handle on one pin (for csi_ams code). The backend comes
+    from get_backend() and the pin is set up on the first read or write, so
+    creating a GpioPin (e.g. at import time) opens nothing.
+    """
+
+    def __init__(self, get_backend, pin, output=True):
+        self._get_backend = get_backend
+        self._backend = None
+        self.pin = pin
+        self.output = output
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend = self._get_backend()
+            if self.output:
+                backend.setup_output(self.pin)
+            else:
+                backend.setup_input(self.pin)
+            self._backend = backend
+        return self._backend
+
+    def dir(self, direction):
+        pass
+
+    def write(self, value):
+        self.backend.write(self.pin, value)
+
+    def read(self):
+        return self.backend.read(self.pin)
+
@@ -0,0 +1,246 @@
+"""
+Hardware abstraction layer: the one place that opens cabinet devices.
+
+Drivers ask the HAL for their device instead of opening a hardcoded path,
+and the AMS_HAL environment variable decides whether they get the real
+device or an in-process fake (see hal_fakes.py):
+
+    AMS_HAL=fake python3 main.py                  # every device fake
+    AMS_HAL=can=fake,i2c=fake python3 csi_ams/main-csi-hpcl.py
+
+Devices: can, gpio, serial, i2c, camera; each is "real" (default) or
+"fake". Scripts can also call hal.configure("fake") before the first
+device is opened.
+
+Fake devices are shared per path, so a test or load script can reach the
+same instance the application uses:
+
+    hal.get_can_simulator().take_key(1, 3)
+    hal.open_serial("/dev/ttyAML1").feed("ID=0012345678")
+    hal.get_i2c_device(3, KEYPAD_I2C_ADDR).press("12345#")
+    hal.get_gpio_backend().set_input(DOOR_SENSOR_PIN, 1)
+
+Real serial ports, I2C buses and cameras are opened anew on every call,
+as the drivers did before.
+"""
+
+import os
+import threading
+
+from gpio_backend import (
+    FakeGpioBackend,
+    GpioPin,
+    MraaGpioBackend,
+)
+from hal_fakes import (
+    KEYPAD_I2C_ADDR,
+    LCD_I2C_ADDR,
+    RTC_I2C_ADDR,
+    FakeCamera,
+    FakeDs1307,
+    FakeHd44780Lcd,
+    FakeI2CBus,
+    FakePcf8574Keypad,
+    FakeSerial,
+)
+
+HAL_ENV = "AMS_HAL"
+HAL_REAL = "real"
+HAL_FAKE = "fake"
+HAL_DEVICES = ("can", "gpio", "serial", "i2c", "camera")
+
+# Fake CAN: python-can virtual bus with simulated key strips 1..n
+FAKE_CAN_CHANNEL = "ams-fake-can"
+FAKE_CAN_INTERFACE = "virtual"
+FAKE_CAN_STRIPS = 2
+
+# What the fake serial ports report while nothing else is pending
+FAKE_SERIAL_IDLE_LINES = {
+    "/dev/ttyAML1": ("BATT=11.10",),
+}
+
+_modes = None
+_devices = {}
+_lock = threading.RLock()
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+def parse_config(spec):
+    """'fake' or 'can=fake,serial=real' -> {device: mode}."""
+    modes = dict.fromkeys(HAL_DEVICES, HAL_REAL)
+    for item in (spec or "").split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        device, sep, mode = item.partition("=")
+        if not sep:
+            device, mode = None, device
+        if mode not in (HAL_REAL, HAL_FAKE):
+            raise ValueError(f"{HAL_ENV}: unknown mode {mode!r}")
+        if device is None:
+            modes = dict.fromkeys(HAL_DEVICES, mode)
+        elif device in modes:
+            modes[device] = mode
+        else:
+            raise ValueError(f"{HAL_ENV}: unknown device {device!r}")
+    return modes
+
+
+def configure(spec=None):
+    """Select backends (default: $AMS_HAL); must run before devices open."""
+    global _modes
+    with _lock:
+        _modes = parse_config(os.environ.get(HAL_ENV) if spec is None else spec)
+        fakes = [device for device, mode in _modes.items() if mode == HAL_FAKE]
+        if fakes:
+            print(f"[HAL] Fake devices: {', '.join(fakes)}")
+        return dict(_modes)
+
+
+def mode(device):
+    with _lock:
+        if _modes is None:
+            configure()
+        return _modes[device]
+
+
+def is_fake(device):
+    return mode(device) == HAL_FAKE
+
+
+def _shared(key, factory):
+    with _lock:
+        device = _devices.get(key)
+        if device is None:
+            device = _devices[key] = factory()
+        return device
+
+
+def reset():
+    """Forget configuration and shared devices (stops the CAN simulator)."""
+    global _modes
+    with _lock:
+        simulator = _devices.get("can")
+        _devices.clear()
+        _modes = None
+    if simulator is not None:
+        simulator.stop()
+
+
+# =====================================================
+# CAN
+# =====================================================
+def get_can_simulator():
+    """The key-strip simulator behind the fake CAN bus (started on first use)."""
+    def create():
+        from amscan_sim import KeyStripSimulator
+
+        simulator = KeyStripSimulator(
+            channel=FAKE_CAN_CHANNEL,
+            interface=FAKE_CAN_INTERFACE,
+            strips=FAKE_CAN_STRIPS,
+        )
+        simulator.start()
+        return simulator
+
+    return _shared("can", create)
+
+
+def can_bus_kwargs(channel, interface):
+    """channel/interface for can.Bus: the given ones, or the fake bus."""
+    if not is_fake("can"):
+        return {"channel": channel, "interface": interface}
+    get_can_simulator()
+    return {"channel": FAKE_CAN_CHANNEL, "interface": FAKE_CAN_INTERFACE}
+
+
+# =====================================================
+# GPIO
+# =====================================================
+def get_gpio_backend():
+    """
+    Process-wide GPIO backend. In real mode a missing or broken mraa raises
+    (ImportError) rather than quietly driving no pins; set AMS_HAL=gpio=fake
+    to run without the board.
+    """
+    if is_fake("gpio"):
+        return _shared("gpio", FakeGpioBackend)
+    return _shared("gpio", MraaGpioBackend)
+
+
+def gpio_output(pin):
+    """mraa.Gpio-style handle on an output pin, opened on first write."""
+    return GpioPin(get_gpio_backend, pin, output=True)
+
+
+def gpio_input(pin):
+    """mraa.Gpio-style handle on an input pin, opened on first read."""
+    return GpioPin(get_gpio_backend, pin, output=False)
+
+
+# =====================================================
+# SERIAL
+# =====================================================
+def open_serial(port, baudrate=9600, timeout=1):
+    """8N1 serial port, as every device on the board uses."""
+    if is_fake("serial"):
+        return _shared(
+            ("serial", port),
+            lambda: FakeSerial(
+                port, baudrate, timeout, idle_lines=FAKE_SERIAL_IDLE_LINES.get(port, ())
+            ),
+        )
+
+    import serial
+
+    return serial.Serial(
+        port=port,
+        baudrate=baudrate,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        timeout=timeout,
+    )
+
+
+# =====================================================
+# I2C
+# =====================================================
+def _fake_i2c_bus(bus):
+    fake = FakeI2CBus(bus)
+    fake.attach(LCD_I2C_ADDR, FakeHd44780Lcd())
+    fake.attach(KEYPAD_I2C_ADDR, FakePcf8574Keypad())
+    fake.attach(RTC_I2C_ADDR, FakeDs1307())
+    return fake
+
+
+def open_i2c_bus(bus):
+    """smbus2.SMBus for the bus number (fake: LCD, keypad and RTC attached)."""
+    if is_fake("i2c"):
+        return _shared(("i2c", bus), lambda: _fake_i2c_bus(bus))
+
+    import smbus2
+
+    return smbus2.SMBus(bus)
+
+
+def get_i2c_device(bus, addr):
+    """The fake device at addr on a fake bus (e.g. to press keypad keys)."""
+    if not is_fake("i2c"):
+        raise RuntimeError("I2C devices are only reachable in fake mode")
+    return open_i2c_bus(bus).devices[addr]
+
+
+# =====================================================
+# CAMERA
+# =====================================================
+def open_camera(index):
+    """cv2.VideoCapture for the camera index."""
+    if is_fake("camera"):
+        return FakeCamera(index)
+
+    import cv2
+
+    return cv2.VideoCapture(index)
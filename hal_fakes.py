@@ -0,0 +1,353 @@
+"""
+Fake devices for running the cabinet software without hardware.
+
+Each class has the surface of the driver object it replaces, so the code
+using it does not change:
+
+    FakeSerial      serial.Serial      readline / write / open / close
+    FakeI2CBus      smbus2.SMBus       read/write_byte(_data), routed to the
+                                       devices attached at each address
+    FakeHd44780Lcd  16x2 LCD behind the PCF8574 backpack (csi_ams/utils/lcd.py)
+    FakePcf8574Keypad  3x4 matrix keypad (csi_ams/utils/keypad.py)
+    FakeDs1307      DS1307 RTC (csi_ams/utils/SDL_DS1307.py), system clock
+    FakeCamera      cv2.VideoCapture   blank BGR frames at the set frame rate
+
+GPIO fakes live in gpio_backend.py and the CAN fake is amscan_sim.py.
+Tests and load scripts drive the fakes through hal.py, e.g.
+hal.open_serial("/dev/ttyAML1").feed("ID=0012345678") or
+hal.get_i2c_device(3, KEYPAD_I2C_ADDR).press("1234#").
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Seconds a FakeSerial.readline() waits for a fed line before returning the
+# next idle line (the BMS reports its battery state continuously)
+FAKE_SERIAL_IDLE_INTERVAL = 0.1
+
+# One byte at 100 kHz plus addressing
+FAKE_I2C_LATENCY = 0.0001
+
+LCD_I2C_ADDR = 0x27
+KEYPAD_I2C_ADDR = 0x20
+RTC_I2C_ADDR = 0x68
+
+
+# =====================================================
+# SERIAL
+# =====================================================
+class FakeSerial(object):
+    def __init__(self, port, baudrate=9600, timeout=1, idle_lines=(),
+                 idle_interval=FAKE_SERIAL_IDLE_INTERVAL):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self.idle_lines = [self._encode(line) for line in idle_lines]
+        self.idle_interval = idle_interval
+        # Everything the application wrote, in order
+        self.written = []
+        self._lines = deque()
+        self._cond = threading.Condition()
+        self._idle_index = 0
+
+    @staticmethod
+    def _encode(line):
+        if isinstance(line, str):
+            line = line.encode("ascii")
+        if not line.endswith(b"\n"):
+            line += b"\r\n"
+        return line
+
+    def feed(self, line):
+        """Queue a line as if the device had sent it."""
+        with self._cond:
+            self._lines.append(self._encode(line))
+            self._cond.notify()
+
+    def readline(self):
+        wait = self.idle_interval
+        if self.timeout is not None:
+            wait = min(wait, self.timeout)
+        with self._cond:
+            if not self._lines:
+                self._cond.wait(wait)
+            if self._lines:
+                return self._lines.popleft()
+        if not self.idle_lines:
+            return b""
+        line = self.idle_lines[self._idle_index % len(self.idle_lines)]
+        self._idle_index += 1
+        return line
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return sum(len(line) for line in self._lines)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._lines.clear()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+# =====================================================
+# I2C
+# =====================================================
+class FakeI2CBus(object):
+    def __init__(self, bus, latency=FAKE_I2C_LATENCY):
+        self.bus = bus
+        self.latency = latency
+        self.devices = {}
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    def attach(self, addr, device):
+        self.devices[addr] = device
+        return device
+
+    def _device(self, addr):
+        device = self.devices.get(addr)
+        if device is None:
+            # What smbus2 raises when nothing acknowledges the address
+            raise OSError(121, "Remote I/O error")
+        self.transactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return device
+
+    def write_byte(self, addr, value):
+        with self._lock:
+            self._device(addr).write_byte(value & 0xFF)
+
+    def read_byte(self, addr):
+        with self._lock:
+            return self._device(addr).read_byte()
+
+    def write_byte_data(self, addr, register, value):
+        with self._lock:
+            self._device(addr).write_byte_data(register, value & 0xFF)
+
+    def read_byte_data(self, addr, register):
+        with self._lock:
+            return self._device(addr).read_byte_data(register)
+
+    def close(self):
+        pass
+
+
+class _I2CDevice(object):
+    def write_byte(self, value):
+        pass
+
+    def read_byte(self):
+        return 0xFF
+
+    def write_byte_data(self, register, value):
+        pass
+
+    def read_byte_data(self, register):
+        return 0xFF
+
+
+class FakeHd44780Lcd(_I2CDevice):
+    """
+    Decodes the 4-bit HD44780 writes lcd.py sends through the PCF8574 so
+    the screen contents can be read back from `lines`.
+    """
+
+    ENABLE = 0x04
+    # DDRAM offset of each display line (LCD_LINE_1..4 without the 0x80)
+    LINE_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+    def __init__(self, width=16, rows=2):
+        self.width = width
+        self.rows = rows
+        self._last = 0
+        self._high_nibble = None
+        self._address = 0
+        self._ddram = bytearray(b" " * 0x80)
+
+    def write_byte(self, value):
+        # Data is latched on the falling edge of ENABLE
+        if self._last & self.ENABLE and not value & self.ENABLE:
+            nibble = self._last & 0xF0
+            if self._high_nibble is None:
+                self._high_nibble = nibble
+            else:
+                self._receive(self._high_nibble | (nibble >> 4), self._last & 0x01)
+                self._high_nibble = None
+        self._last = value
+
+    def _receive(self, byte, is_data):
+        if is_data:
+            self._ddram[self._address & 0x7F] = byte
+            self._address += 1
+        elif byte & 0x80:
+            self._address = byte & 0x7F
+        elif byte == 0x01:
+            self._ddram[:] = b" " * 0x80
+            self._address = 0
+
+    @property
+    def lines(self):
+        return [
+            self._ddram[offset:offset + self.width].decode("ascii", "replace")
+            for offset in self.LINE_OFFSETS[:self.rows]
+        ]
+
+
+class FakePcf8574Keypad(_I2CDevice):
+    """
+    3x4 keypad wired to a PCF8574 the way keypad.py scans it: columns on
+    P4-P6 driven low one at a time, rows read back on P0-P3.
+    """
+
+    LAYOUT = ("123", "456", "789", "*0#")
+    # Low nibble read back when the key's row is pulled low
+    ROW_BITS = (0x0E, 0x0D, 0x0B, 0x07)
+
+    def __init__(self, hold=0.06, gap=0.06):
+        self.hold = hold
+        self.gap = gap
+        self._output = 0xFF
+        self._queue = deque()
+        self._key = None
+        self._key_until = 0.0
+        self._released_until = 0.0
+        self._lock = threading.Lock()
+
+    def press(self, keys):
+        """Queue key presses; each is held for `hold` s, then released."""
+        with self._lock:
+            for key in keys:
+                if not any(key in row for row in self.LAYOUT):
+                    raise ValueError(f"no key {key!r} on the keypad")
+                self._queue.append(key)
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue) + (1 if self._key else 0)
+
+    def _current_key(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._key is not None:
+                if now < self._key_until:
+                    return self._key
+                self._key = None
+                self._released_until = now + self.gap
+            if now < self._released_until or not self._queue:
+                return None
+            self._key = self._queue.popleft()
+            self._key_until = now + self.hold
+            return self._key
+
+    def write_byte(self, value):
+        self._output = value
+
+    def read_byte(self):
+        key = self._current_key()
+        if key is not None:
+            for row, keys in enumerate(self.LAYOUT):
+                column = keys.find(key)
+                if column >= 0 and not self._output & (0x10 << column):
+                    return (self._output & 0xF0) | self.ROW_BITS[row]
+        return (self._output & 0xF0) | 0x0F
+
+
+def _to_bcd(value):
+    return ((value // 10) << 4) | (value % 10)
+
+
+class FakeDs1307(_I2CDevice):
+    """DS1307 registers backed by the system clock; writes are kept, not applied."""
+
+    def __init__(self):
+        self.registers = {}
+
+    def write_byte_data(self, register, value):
+        self.registers[register] = value
+
+    def read_byte_data(self, register):
+        now = datetime.now()
+        fields = {
+            0x00: now.second,
+            0x01: now.minute,
+            0x02: now.hour,
+            0x03: now.isoweekday(),
+            0x04: now.day,
+            0x05: now.month,
+            0x06: now.year % 100,
+        }
+        if register in fields:
+            return _to_bcd(fields[register])
+        return self.registers.get(register, 0)
+
+
+# =====================================================
+# CAMERA
+# =====================================================
+class FakeCamera(object):
+    # cv2.CAP_PROP_* values the pages use
+    PROP_FRAME_WIDTH = 3
+    PROP_FRAME_HEIGHT = 4
+    PROP_FPS = 5
+
+    def __init__(self, index, width=640, height=480, fps=30):
+        self.index = index
+        self.frames = 0
+        self._props = {
+            self.PROP_FRAME_WIDTH: width,
+            self.PROP_FRAME_HEIGHT: height,
+            self.PROP_FPS: fps,
+        }
+        self._opened = True
+        self._next_frame = time.monotonic()
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        try:
+            import numpy
+        except ImportError:
+            return False, None
+
+        # Deliver frames no faster than the configured frame rate
+        fps = self._props.get(self.PROP_FPS) or 30
+        delay = self._next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame = max(self._next_frame, time.monotonic()) + 1.0 / fps
+
+        self.frames += 1
+        shape = (
+            int(self._props[self.PROP_FRAME_HEIGHT]),
+            int(self._props[self.PROP_FRAME_WIDTH]),
+            3,
+        )
+        return True, numpy.zeros(shape, dtype=numpy.uint8)
+
+    def set(self, prop, value):
+        self._props[prop] = value
+        return True
+
+    def get(self, prop):
+        return self._props.get(prop, 0)
+
+    def release(self):
+        self._opened = False
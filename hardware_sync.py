@@ -1,5 +1,8 @@
 # hardware_sync.py
 
+from amscan import CAN_DISCOVERY_TIMEOUT
+
+
 def sync_hardware_to_db(session, ams_can):
     """
     Sync hardware status to database using existing AMS_CAN instance.
@@ -23,18 +26,17 @@ def sync_hardware_to_db(session, ams_can):
         print("[SYNC] No CAN instance available.")
         return False
 
-    # Detect strips if none found yet (scan 1–4 only; each strip already
-    # has a 0.2 s sleep inside get_version_number so no extra delay needed)
+    # Boot discovery (main.py) may still be running — wait for it rather
+    # than probing the same strips again.
+    if not ams_can.key_lists and not ams_can.wait_until_ready(CAN_DISCOVERY_TIMEOUT * 2):
+        print("[SYNC] Strip discovery still running, continuing without it")
+
+    # Detect strips if none found yet (probes 1–4 in parallel)
     if not ams_can.key_lists:
         print("[SYNC] Detecting key strips (1–4)...")
-        for strip_id in range(1, 5):
-            version = ams_can.get_version_number(strip_id)
-            if version:
-                if strip_id not in ams_can.key_lists:
-                    ams_can.key_lists.append(strip_id)
-                print(f"  ✓ Strip {strip_id} detected (v{version})")
-            else:
-                print(f"  ✗ Strip {strip_id} not found")
+        for strip_id in ams_can.discover_strips():
+            version = ams_can.key_lists_version.get(strip_id)
+            print(f"  ✓ Strip {strip_id} detected (v{version})")
     else:
         print(f"[SYNC] Strips already detected: {ams_can.key_lists}")
 
@@ -0,0 +1,324 @@
+"""
+Write-behind writer for access_log / eventlogs rows (and the key / access
+log updates the screens make).
+
+Screens used to insert each log row and commit on the Kivy thread, paying
+an eMMC fsync (tens of ms) per event. LogWriter queues the rows and a
+background thread inserts them in one transaction every `interval`
+seconds, or as soon as `batch_size` rows are waiting:
+
+    writer = get_log_writer()
+    access = writer.add_access_log(signInTime=..., signInUserId=user_id)
+    writer.add_event_log(access_log=access, eventId=EVENT_LOGIN_SUCCEES, ...)
+    access.wait(1.0)            # -> access_log.id once committed
+
+An event can point at an access-log ticket that has not been written yet;
+its access_log_id is filled in when the batch is written. eventDesc is
+looked up (in the event type cache) when not given.
+
+Updates go through the same queue, so they land in order with the inserts:
+
+    writer.update_key(key_id, keyStatus=1, updatedAt=now)
+    writer.update_access_log(access, activityCode=code)
+    ticket.add_done_callback(fn)    # fn(ticket) on the writer thread
+
+Durability: a ticket completes only after its batch has committed, and
+the writer's connection runs with PRAGMA synchronous=FULL, so a committed
+batch survives power loss. Rows still queued are lost in a crash; the
+window is at most `interval` seconds. stop() (also run at exit) and
+flush() write out everything queued before returning.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from event_types import get_event_description
+
+LOG_FLUSH_INTERVAL = 0.2
+LOG_BATCH_SIZE = 50
+# PRAGMA synchronous for the writer's connections: FULL fsyncs every commit
+LOG_SYNCHRONOUS = "FULL"
+# Seconds to wait for the UI's own commits to release the database
+LOG_BUSY_TIMEOUT = 30
+
+ACCESS_LOG = "access_log"
+EVENT_LOG = "event_log"
+KEY_UPDATE = "key_update"
+ACCESS_LOG_UPDATE = "access_log_update"
+
+
+class LogTicket(object):
+    """Handle on a queued row; id is set once its batch has committed."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.id = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """The row id, or None if not written within timeout (or failed)."""
+        self._done.wait(timeout)
+        return self.id
+
+    def add_done_callback(self, fn):
+        """Call fn(ticket) once finished: on the writer thread, or now if done."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, row_id=None, error=None):
+        with self._lock:
+            self.id = row_id
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"[LOG] Ticket callback failed: {e}")
+
+
+class LogWriter(object):
+    def __init__(self, uri=None, interval=LOG_FLUSH_INTERVAL,
+                 batch_size=LOG_BATCH_SIZE, synchronous=LOG_SYNCHRONOUS):
+        if uri is None:
+            from db_core import SQLALCHEMY_DATABASE_URI as uri
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.engine = create_engine(
+            uri,
+            connect_args={"check_same_thread": False, "timeout": LOG_BUSY_TIMEOUT},
+        )
+        if synchronous:
+            event.listen(
+                self.engine, "connect",
+                lambda conn, record: conn.execute(f"PRAGMA synchronous={synchronous}"),
+            )
+        self._Session = sessionmaker(bind=self.engine, autoflush=False)
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._writing = 0
+        self._running = False
+        self._thread = None
+
+        self.batches = 0
+        self.rows = 0
+        self.failed = 0
+        self.last_commit = None
+
+    # ---------------- Lifecycle ----------------
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Write out everything queued, then stop the thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything the thread did not get to (not started, or timed out)
+        while self._queue:
+            self._write_batch()
+        self.engine.dispose()
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far has been written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._running:
+                pending = bool(self._queue)
+            else:
+                self._cond.notify()
+                while self._queue or self._writing:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+        while pending and self._queue:
+            self._write_batch()
+        return True
+
+    # ---------------- Queueing ----------------
+    def _submit(self, kind, fields):
+        ticket = LogTicket(kind)
+        with self._cond:
+            self._queue.append((ticket, fields))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return ticket
+
+    def add_access_log(self, **fields):
+        """Queue an AMS_Access_Log row; returns its LogTicket."""
+        return self._submit(ACCESS_LOG, fields)
+
+    def add_event_log(self, access_log=None, **fields):
+        """
+        Queue an AMS_Event_Log row. access_log may be a LogTicket from
+        add_access_log(); otherwise pass access_log_id as usual.
+        """
+        if access_log is not None:
+            fields["access_log_id"] = access_log
+        return self._submit(EVENT_LOG, fields)
+
+    def update_key(self, key_id, **values):
+        """Queue an UPDATE of one AMS_Keys row; the ticket's id is key_id."""
+        return self._submit(KEY_UPDATE, {"id": key_id, "values": values})
+
+    def update_access_log(self, access_log, **values):
+        """
+        Queue an UPDATE of one AMS_Access_Log row. access_log is its id or
+        the LogTicket from add_access_log().
+        """
+        return self._submit(ACCESS_LOG_UPDATE, {"id": access_log, "values": values})
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue) + self._writing
+
+    # ---------------- Writing ----------------
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.interval)
+                if not self._queue:
+                    if not self._running:
+                        break
+                    continue
+            self._write_batch()
+
+    def _take_batch(self):
+        with self._cond:
+            count = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._writing += count
+            return batch
+
+    def _write_batch(self):
+        batch = self._take_batch()
+        if not batch:
+            return
+        try:
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Find the bad row(s) instead of dropping the whole batch
+                print(f"[LOG] Batch of {len(batch)} failed ({e}); writing rows one by one")
+                for entry in batch:
+                    if entry[0].done():
+                        continue
+                    try:
+                        self._commit([entry])
+                    except Exception as row_error:
+                        self.failed += 1
+                        print(f"[LOG] ❌ Dropped {entry[0].kind} row: {row_error}")
+                        entry[0]._finish(error=row_error)
+        finally:
+            with self._cond:
+                self._writing -= len(batch)
+                self._cond.notify_all()
+
+    def _commit(self, batch):
+        from model import AMS_Access_Log, AMS_Event_Log, AMS_Keys
+
+        session = self._Session()
+        try:
+            rows = []
+            for ticket, fields in batch:
+                fields = dict(fields)
+                if ticket.kind in (KEY_UPDATE, ACCESS_LOG_UPDATE):
+                    table = AMS_Keys if ticket.kind == KEY_UPDATE else AMS_Access_Log
+                    row_id = fields["id"]
+                    if isinstance(row_id, LogTicket):
+                        row_id = row_id.id
+                    if row_id is None:
+                        raise ValueError(f"{ticket.kind} without a row id")
+                    session.query(table).filter(table.id == row_id).update(
+                        fields["values"], synchronize_session=False
+                    )
+                    ticket.id = row_id
+                    rows.append((ticket, None))
+                    continue
+                if ticket.kind == ACCESS_LOG:
+                    row = AMS_Access_Log(**fields)
+                else:
+                    parent = fields.get("access_log_id")
+                    if isinstance(parent, LogTicket):
+                        fields["access_log_id"] = parent.id
+                    if fields.get("eventDesc") is None and fields.get("eventId") is not None:
+                        fields["eventDesc"] = get_event_description(session, fields["eventId"])
+                    row = AMS_Event_Log(**fields)
+                session.add(row)
+                # Assign the id now so later events in the batch can use it
+                session.flush()
+                ticket.id = row.id
+                rows.append((ticket, row))
+            session.commit()
+        except Exception:
+            session.rollback()
+            for ticket, _ in batch:
+                ticket.id = None
+            raise
+        finally:
+            session.close()
+
+        for ticket, row in rows:
+            ticket._finish(ticket.id)
+        self.batches += 1
+        self.rows += len(rows)
+        self.last_commit = time.time()
+
+    def get_stats(self):
+        return {
+            "pending": self.pending(),
+            "batches": self.batches,
+            "rows": self.rows,
+            "failed": self.failed,
+            "last_commit": self.last_commit,
+        }
+
+
+_log_writer = None
+_log_writer_guard = threading.Lock()
+
+
+def get_log_writer():
+    """Process-wide, started LogWriter on the cabinet database."""
+    global _log_writer
+    with _log_writer_guard:
+        if _log_writer is None:
+            _log_writer = LogWriter()
+            _log_writer.start()
+            atexit.register(stop_log_writer)
+        return _log_writer
+
+
+def stop_log_writer():
+    global _log_writer
+    with _log_writer_guard:
+        writer, _log_writer = _log_writer, None
+    if writer is not None:
+        writer.stop()
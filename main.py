@@ -79,9 +79,26 @@ class MainApp(App):
             SQLALCHEMY_DATABASE_URI,
             connect_args={"check_same_thread": False},
         )
+        # Indexes etc. the cabinet adds on top of the synced schema. A failed
+        # migration raises MigrationError and stops the app here: the
+        # activity / key lookups in db.py need those tables.
+        from db_migrations import migrate
+        migrate(engine)
+
         Session = sessionmaker(bind=engine)
         db_session = Session()
 
+        # Event type descriptions: read once, then served from memory
+        from event_types import load_event_types
+        try:
+            load_event_types(db_session)
+        except Exception as e:
+            print(f"[MAIN] Failed to load event types: {e}")
+
+        # Access / event log rows are committed in batches off the UI thread
+        from log_writer import get_log_writer
+        get_log_writer()
+
         # -------------------------------------------------
         # SCREEN MANAGER
         # -------------------------------------------------
@@ -91,23 +108,47 @@ class MainApp(App):
         # SHARED STATE
         # -------------------------------------------------
         from amscan import AMS_CAN
+        from amscan_async import AsyncAMS_CAN, CanLoopThread
         import threading
-        import time
 
         try:
             print("[MAIN] Initializing Global AMS_CAN")
             ams_can = AMS_CAN()
-            
-            def init_can():
-                for strip_id in range(1, 5):   # scan strips 1–4 only
-                    ams_can.get_version_number(strip_id)
-                time.sleep(0.5)
-            
-            threading.Thread(target=init_can, daemon=True).start()
+            ams_can.start_stats_dump(os.path.join(BASE_DIR, "can_stats.json"))
+            # Re-creates the bus after bus-off / a dead notifier thread
+            ams_can.start_supervisor()
+
+            # Probes strips 1–4 in parallel; screens wait on ams_can.ready
+            threading.Thread(target=ams_can.discover_strips, daemon=True).start()
         except Exception as e:
             print(f"[MAIN] Failed to initialize AMS_CAN: {e}")
             ams_can = None
 
+        # Door solenoid / buzzer: open the GPIOs now, not on the first unlock
+        from door_lock import get_door_lock
+        try:
+            sm.door_lock = get_door_lock()
+        except Exception as e:
+            print(f"[MAIN] Failed to initialize door lock: {e}")
+            sm.door_lock = None
+
+        # Door sensor: watched in-process from boot (replaces pub.py + MQTT)
+        # (door state unknown if the sensor pin cannot be opened)
+        from door_monitor import get_door_monitor
+        sm.door_monitor = get_door_monitor()
+
+        # Card reader + battery monitor: one owner of /dev/ttyAML1; screens subscribe
+        from amsbms import get_bms
+        sm.card_reader = get_bms()
+
+        # Smoothed battery level + history, sampled in the background
+        from battery_telemetry import get_battery_telemetry
+        sm.battery = get_battery_telemetry()
+
+        # Event loop for async CAN flows (screens submit coroutines to it)
+        sm.can_loop = CanLoopThread()
+        sm.can_async = AsyncAMS_CAN(ams_can) if ams_can else None
+
         sm.db_session = db_session
         sm.ams_can = ams_can
         sm.auth_mode = None
@@ -147,6 +188,43 @@ class MainApp(App):
     def on_stop(self):
         print("[MAIN] Shutting down application")
 
+        try:
+            # Write out queued log rows before anything else goes away
+            from log_writer import stop_log_writer
+            stop_log_writer()
+        except Exception:
+            pass
+
+        try:
+            if getattr(self.root, 'door_lock', None):
+                self.root.door_lock.shutdown()
+        except Exception:
+            pass
+
+        try:
+            if hasattr(self.root, 'door_monitor'):
+                self.root.door_monitor.stop()
+        except Exception:
+            pass
+
+        try:
+            from battery_telemetry import stop_battery_telemetry
+            stop_battery_telemetry()
+        except Exception:
+            pass
+
+        try:
+            from amsbms import stop_bms
+            stop_bms()
+        except Exception:
+            pass
+
+        try:
+            if hasattr(self.root, 'can_loop'):
+                self.root.can_loop.stop()
+        except Exception:
+            pass
+
         try:
             if hasattr(self.root, 'ams_can') and self.root.ams_can:
                 self.root.ams_can.cleanup()
@@ -165,3 +243,4 @@ if __name__ == "__main__":
 
 # sudo ip link set can0 up type can bitrate 125000
 # sudo ip link set can0 up
+# (AMS_CAN's supervisor re-runs these itself after a bus-off)
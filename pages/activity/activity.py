@@ -3,12 +3,11 @@ from components.base_screen import BaseScreen
 from db import verify_activity_code
 
 from datetime import datetime
-from csi_ams.model import AMS_Event_Log
+from log_writer import get_log_writer
 from csi_ams.utils.commons import (
     TZ_INDIA,
     EVENT_ACTIVITY_CODE_CORRECT,
     EVENT_TYPE_EVENT,
-    get_event_description,
 )
 
 
@@ -95,21 +94,22 @@ class ActivityCodeScreen(BaseScreen):
                 # --------------------------------------------------
                 # 1️⃣ UPDATE GLOBAL ACCESS LOG
                 # --------------------------------------------------
+                # Written in the background, ahead of the event below
                 if ams_access_log:
-                    ams_access_log.activityCodeEntryTime = datetime.now(TZ_INDIA)
-                    ams_access_log.activityCode = int(entered_code)
-                    ams_access_log.event_type_id = EVENT_TYPE_EVENT
-                    session.commit()
+                    get_log_writer().update_access_log(
+                        ams_access_log.id,
+                        activityCodeEntryTime=datetime.now(TZ_INDIA),
+                        activityCode=int(entered_code),
+                        event_type_id=EVENT_TYPE_EVENT,
+                    )
 
                 # --------------------------------------------------
                 # 2️⃣ CREATE EVENT LOG (ACTIVITY CODE CORRECT)
                 # --------------------------------------------------
-                eventDesc = get_event_description(
-                    session, EVENT_ACTIVITY_CODE_CORRECT
-                )
+                # Written in the background; eventDesc is filled in there
                 card_info = getattr(self.manager, "card_info", None)
                 user_id = card_info["id"]
-                ams_event_log = AMS_Event_Log(
+                get_log_writer().add_event_log(
                     userId=user_id,
                     keyId=None,
                     activityId=int(entered_code),
@@ -118,13 +118,8 @@ class ActivityCodeScreen(BaseScreen):
                     access_log_id=ams_access_log.id if ams_access_log else None,
                     timeStamp=datetime.now(TZ_INDIA),
                     event_type=EVENT_TYPE_EVENT,
-                    eventDesc=eventDesc,
                     is_posted=0,
                 )
-                print(ams_event_log)
-
-                session.add(ams_event_log)
-                session.commit()
 
             except Exception as e:
                 session.rollback()
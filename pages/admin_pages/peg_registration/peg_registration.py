@@ -79,12 +79,10 @@ class PegScanScreen(BaseScreen):
             if not self.ams_can:
                 raise Exception("Global CAN instance not found")
 
-            # Quick refresh ping
-            for strip_id in range(1, 10):
-                self.ams_can.get_version_number(strip_id)
-            
+            # Quick refresh ping (all ids probed in parallel)
+            self.ams_can.discover_strips(candidates=range(1, 10))
+
             from time import sleep
-            sleep(1)
             
             Clock.schedule_once(
                 lambda dt: self._update_status("CAN bus ready", 20)
@@ -14,6 +14,8 @@ import time
 import json
 import requests
 
+import hal
+
 
 # Import the generalized face recognition system
 from face_recognition_system import FaceRecognitionSystem
@@ -36,7 +38,7 @@ class KivyCamera(Image):
         """Start camera with background thread - ONLY camera index 1"""
         try:
             print(f"Starting camera with index {camera_index}...")
-            self.capture = cv2.VideoCapture(camera_index)
+            self.capture = hal.open_camera(camera_index)
             
             if not self.capture.isOpened():
                 print(f"✗ ERROR: Could not open camera at index {camera_index}")
@@ -15,6 +15,8 @@ import numpy as np
 import time
 import requests  # Add this import for HTTP requests
 
+import hal
+
 
 # Import the face recognition system
 from face_recognition_system import FaceRecognitionSystem
@@ -52,7 +54,7 @@ class KivyCamera(Image):
         """Start camera with background thread - ONLY camera index 1"""
         try:
             print(f"Starting camera with index {camera_index}...")
-            self.capture = cv2.VideoCapture(camera_index)
+            self.capture = hal.open_camera(camera_index)
 
             if not self.capture.isOpened():
                 print(f"✗ ERROR: Could not open camera at index {camera_index}")
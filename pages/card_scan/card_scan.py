@@ -6,12 +6,10 @@ from kivy.uix.popup import Popup
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
-from threading import Thread
 from db import check_card_exists
 from datetime import datetime
-import time
 from components.base_screen import BaseScreen
-from amsbms import AMSBMS
+from amsbms import get_bms
 
 
 class CardScanScreen(BaseScreen):
@@ -21,7 +19,7 @@ class CardScanScreen(BaseScreen):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.bms = None
+        self.card_reader = None
         self.card_reading = False
         self._event = None
         self._timeout_event = None
@@ -38,20 +36,18 @@ class CardScanScreen(BaseScreen):
         self.instruction_text = "Show your card"
         Clock.schedule_interval(self.update_time, 1)
 
-        # Init AMSBMS
-        try:
-            self.bms = AMSBMS(port="/dev/ttyAML1", baud=9600)
-        except Exception as e:
-            print(f"Error opening /dev/ttyAML1: {e}")
+        # Card reader service runs from boot; just listen for swipes
+        self.card_reader = get_bms()
+        if self.card_reader.ser is None:
+            print("Card reader not available on /dev/ttyAML1")
             self.instruction_text = "Reader error"
-            self.bms = None
+            self.card_reader = None
             self.card_reading = False
             self.manager.current = "home"
             return
 
-        # Start card reading in background
         self.card_reading = True
-        Thread(target=self.poll_card, daemon=True).start()
+        self.card_reader.subscribe_cards(self.on_card_swiped)
 
         # Animate progress bar (30s total, tick every 0.5s)
         self._event = Clock.schedule_interval(self.update_progress, 0.5)
@@ -70,14 +66,11 @@ class CardScanScreen(BaseScreen):
         Clock.unschedule(self.update_time)
 
     def stop_card_reading(self):
-        """Stop card reading and cleanup the BMS/bus."""
+        """Stop listening for swipes (the reader itself keeps running)."""
         self.card_reading = False
-        if self.bms:
-            try:
-                self.bms.stop()
-            except Exception as e:
-                print(f"Error stopping BMS: {e}")
-            self.bms = None
+        if self.card_reader:
+            self.card_reader.unsubscribe_cards(self.on_card_swiped)
+            self.card_reader = None
 
     def update_time(self, dt):
         """Update time display."""
@@ -114,22 +107,12 @@ class CardScanScreen(BaseScreen):
         btn.bind(on_release=_back)
         popup.open()
 
-    def poll_card(self):
-        """Background thread to continuously poll for cards until valid or timeout."""
-        while self.card_reading:
-            try:
-                if not self.bms:
-                    break
-                card_no = self.bms.get_cardNo()
-                if card_no:
-                    Clock.schedule_once(
-                        lambda dt, c=card_no: self.handle_card_result(c), 0
-                    )
-                    # Do NOT return here; we keep scanning until valid card
-                time.sleep(0.2)
-            except Exception as e:
-                print(f"Error polling card: {e}")
-                break
+    def on_card_swiped(self, card_no):
+        """Runs on the card reader thread for every new swipe."""
+        if not self.card_reading:
+            return
+        # Keep listening after an invalid card; handle_card_result decides
+        Clock.schedule_once(lambda dt: self.handle_card_result(card_no), 0)
 
     def handle_card_result(self, card_no):
         """Handle card read result (runs on main thread)."""
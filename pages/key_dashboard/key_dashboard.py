@@ -1,10 +1,8 @@
 from datetime import datetime
-import subprocess
 import logging
 import time
 import threading
-
-import paho.mqtt.client as mqtt
+import asyncio
 
 from kivy.uix.modalview import ModalView
 from kivy.uix.boxlayout import BoxLayout
@@ -22,14 +20,21 @@ from kivy.properties import (
 from kivy.clock import Clock
 
 from components.base_screen import BaseScreen
-from db import get_keys_for_activity, set_key_status_by_peg_id
-from amscan import AMS_CAN, CAN_LED_STATE_ON
+from db import get_keys_for_activity
+from amscan import (
+    AMS_CAN,
+    CAN_LED_STATE_ON,
+    KEY_EVENT_TAKEN,
+    KEY_EVENT_INSERTED,
+)
 from hardware_sync import sync_hardware_to_db
+from door_lock import get_door_lock
+from door_monitor import DOOR_CLOSED, DOOR_OPEN, get_door_monitor
+from log_writer import get_log_writer
 
 from csi_ams.model import (
     AMS_Keys,
     AMS_Access_Log,
-    AMS_Event_Log,
     EVENT_DOOR_OPEN,
     EVENT_KEY_TAKEN_CORRECT,
     EVENT_TYPE_EVENT,
@@ -37,7 +42,6 @@ from csi_ams.model import (
 from csi_ams.utils.commons import (
     SLOT_STATUS_KEY_NOT_PRESENT,
     TZ_INDIA,
-    get_event_description,
 )
 
 # =========================================================
@@ -49,6 +53,9 @@ logging.basicConfig(
 )
 log = logging.getLogger("KEY_DASHBOARD")
 
+# Seconds the UI waits for the CAN tasks to stop and the shutdown batch
+CAN_SHUTDOWN_TIMEOUT = 5.0
+
 
 # =========================================================
 # LOADING POPUP — NO WHITE BORDER
@@ -174,10 +181,11 @@ class KeyDashboardScreen(BaseScreen):
         self._door_opened_timestamp = None
 
         self._door_timer_event = None
-        self._mqtt_client = None
+        self._door_monitor = None
 
         self.ams_can = None
         self._screen_active = False
+        self._entered_at = None
         self._loading_popup = None
 
         # Misplaced key blinking
@@ -185,9 +193,8 @@ class KeyDashboardScreen(BaseScreen):
         self._blink_state = False
         self._misplaced_slots = set()
 
-        # Background CAN poll thread
-        self._can_poll_thread_running = False
-        self._can_poll_thread = None
+        # asyncio tasks on the shared CAN loop; only touched on that loop
+        self._can_tasks = []
 
     # =====================================================
     # SCREEN LIFECYCLE
@@ -195,6 +202,7 @@ class KeyDashboardScreen(BaseScreen):
     def on_enter(self, *args):
         log.info("[ENTER] KeyDashboard entered")
         self._screen_active = True
+        self._entered_at = time.monotonic()
         self._show_loading_popup()
         threading.Thread(target=self._initialize_hardware_thread, daemon=True).start()
 
@@ -289,14 +297,11 @@ class KeyDashboardScreen(BaseScreen):
         self.time_remaining = str(self.MAX_DOOR_TIME)
         self.progress_value = 0.0
 
-        # MQTT subscriber for door sensor
-        self.start_gpio_subscriber()
+        # Door sensor events straight from the in-process monitor
+        self.start_door_monitor()
 
-        # CAN sequence runs in its own thread (avoids blocking main thread)
-        threading.Thread(target=self._run_can_sequence, daemon=True).start()
-
-        # CAN event poll loop runs in its own thread
-        self._start_can_poll_thread()
+        # CAN sequence and key event watcher run on the CAN event loop
+        self._start_can_tasks()
 
     def on_leave(self, *args):
         """Called when leaving the screen."""
@@ -305,7 +310,7 @@ class KeyDashboardScreen(BaseScreen):
         self._dismiss_loading_popup()
         self._stop_misplaced_blink()
         self._misplaced_slots.clear()
-        self._shutdown_can_and_mqtt()
+        self._shutdown_can_and_door()
 
     # =====================================================
     # LOADING POPUP HELPERS
@@ -324,67 +329,59 @@ class KeyDashboardScreen(BaseScreen):
             self._loading_popup = None
 
     # =====================================================
-    # CAN INITIALIZATION SEQUENCE (background thread)
+    # CAN INITIALIZATION SEQUENCE (CAN event loop)
     # =====================================================
-    def _run_can_sequence(self):
+    async def _can_sequence(self, can):
         """
-        Run the full LED/lock CAN init sequence off the main thread.
-        All sleep() calls stay here, not on the UI thread.
+        Run the full LED/lock CAN init sequence on the shared CAN event loop.
+        Leaving the screen cancels it at the next await.
         """
         try:
-            if not self._screen_active or not self.ams_can:
+            if not self._screen_active or not can:
                 Clock.schedule_once(lambda dt: self._dismiss_loading_popup(), 0)
                 return
 
             # Guard: need at least one strip
-            if not self.ams_can.key_lists:
+            if not can.key_lists:
                 log.warning("[CAN SEQ] No strips — skipping sequence")
                 Clock.schedule_once(lambda dt: self._activate_solenoid_and_finish(), 0)
                 return
 
+            strips = list(can.key_lists)
+
             # Step 1 — LED ON (all)
             Clock.schedule_once(lambda dt: self._update_popup_status("Activating LEDs..."), 0)
             log.info("[CAN-1] LED ON (ALL)")
-            for strip in list(self.ams_can.key_lists):
-                self.ams_can.set_all_LED_ON(strip, False)
-
-            if not self._screen_active:
-                return
-            time.sleep(0.8)
+            await can.batch([("set_all_LED_ON", strip, False) for strip in strips])
+            await asyncio.sleep(0.8)
 
             # Step 2 — LOCK ALL
             Clock.schedule_once(lambda dt: self._update_popup_status("Securing locks..."), 0)
             log.info("[CAN-2] LOCK ALL KEYS")
-            for strip in list(self.ams_can.key_lists):
-                self.ams_can.lock_all_positions(strip)
-
-            if not self._screen_active:
-                return
-            time.sleep(0.8)
+            await can.batch([("lock_all_positions", strip) for strip in strips])
+            await asyncio.sleep(0.8)
 
             # Step 3 — LED OFF (all)
             Clock.schedule_once(lambda dt: self._update_popup_status("Configuring access..."), 0)
             log.info("[CAN-3] LED OFF (ALL)")
-            for strip in list(self.ams_can.key_lists):
-                self.ams_can.set_all_LED_OFF(strip)
-
-            if not self._screen_active:
-                return
-            time.sleep(0.8)
+            await can.batch([("set_all_LED_OFF", strip) for strip in strips])
+            await asyncio.sleep(0.8)
 
             # Step 4 — UNLOCK activity keys + LED ON
             Clock.schedule_once(lambda dt: self._update_popup_status("Unlocking authorized keys..."), 0)
             log.info("[CAN-4] UNLOCK ACTIVITY KEYS")
-            for key in list(self.keys_data):
-                if not self._screen_active:
-                    return
-                strip = int(key["strip"])
-                pos = int(key["position"])
-                self.ams_can.unlock_single_key(strip, pos)
+            keys = [(int(key["strip"]), int(key["position"])) for key in list(self.keys_data)]
+            results = await asyncio.gather(*[can.unlock(strip, pos) for strip, pos in keys])
+            for (strip, pos), ok in zip(keys, results):
+                if not ok:
+                    log.warning(f"[CAN-4] unlock failed for strip={strip} pos={pos}")
 
             # Done — open solenoid on main thread
             Clock.schedule_once(lambda dt: self._activate_solenoid_and_finish(), 0)
 
+        except asyncio.CancelledError:
+            log.info("[CAN SEQ] Cancelled")
+            raise
         except Exception as e:
             log.error(f"[CAN SEQ] Error: {e}")
             import traceback
@@ -394,16 +391,25 @@ class KeyDashboardScreen(BaseScreen):
     def _activate_solenoid_and_finish(self):
         """Runs on main thread — open door solenoid and dismiss popup."""
         self._update_popup_status("Opening door lock...")
-        subprocess.Popen(
-            ["sudo", "python3", "pub.py"],
-            cwd="/home/rock/Desktop/ams_v2",
-        )
-        subprocess.Popen(
-            ["sudo", "python3", "solenoid.py", "1"],
-            cwd="/home/rock/Desktop/ams_v2",
-        )
+        self._set_door_lock(unlocked=True)
+        if self._entered_at is not None:
+            log.info(
+                f"[DOOR] Unlocked {(time.monotonic() - self._entered_at) * 1000:.0f} ms "
+                "after entering the dashboard"
+            )
         Clock.schedule_once(lambda dt: self._dismiss_loading_popup(), 1.0)
 
+    def _set_door_lock(self, unlocked):
+        """Switch the solenoid; a GPIO failure is logged, not raised."""
+        try:
+            door_lock = get_door_lock()
+            if unlocked:
+                door_lock.unlock()
+            else:
+                door_lock.lock()
+        except Exception as e:
+            log.error(f"[DOOR] Door lock unavailable: {e}")
+
     # =====================================================
     # MISPLACED KEY BLINKING
     # =====================================================
@@ -437,51 +443,60 @@ class KeyDashboardScreen(BaseScreen):
                 pass
 
     # =====================================================
-    # CAN POLL — BACKGROUND THREAD
+    # CAN KEY EVENTS (CAN event loop)
     # =====================================================
-    def _start_can_poll_thread(self):
-        self._can_poll_thread_running = True
-        self._can_poll_thread = threading.Thread(
-            target=self._can_poll_loop, daemon=True
-        )
-        self._can_poll_thread.start()
+    def _start_can_tasks(self):
+        """Run the CAN sequence and the key event watcher on the shared loop."""
+        can = self.manager.can_async
+        can_loop = self.manager.can_loop
+        if not can or not can_loop:
+            log.warning("[CAN] Async CAN front-end not available")
+            Clock.schedule_once(lambda dt: self._dismiss_loading_popup(), 0)
+            return
+        can_loop.submit(self._spawn_can_tasks(can))
 
-    def _stop_can_poll_thread(self):
-        self._can_poll_thread_running = False
-        # Thread is daemon so it will die with the process; no join needed.
+    async def _spawn_can_tasks(self, can):
+        self._can_tasks = [
+            asyncio.ensure_future(self._can_sequence(can)),
+            asyncio.ensure_future(self._watch_key_events(can)),
+        ]
 
-    def _can_poll_loop(self):
+    async def _stop_can_tasks(self, can, commands):
         """
-        Runs in a background thread.
-        Reads CAN event flags and delegates handling to the main thread
+        Cancel the CAN sequence / key event watcher, wait until they have
+        unwound, then run the shutdown commands, so no LED-ON or unlock
+        frame from the sequence can follow them. Runs after
+        _spawn_can_tasks because the loop runs submissions in order.
+        """
+        tasks, self._can_tasks = self._can_tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if commands:
+            await can.batch(commands)
+
+    async def _watch_key_events(self, can):
+        """
+        Awaits AMS_CAN key events and delegates handling to the main thread
         via Clock.schedule_once so Kivy/DB/UI are only touched from main.
+        Every event is delivered in order, even when several keys are moved
+        at once. Only events arriving after the screen opened are seen.
         """
-        while self._can_poll_thread_running:
-            time.sleep(0.1)
-
-            if not self.ams_can or not self._screen_active:
+        async for event in can.key_events():
+            if not self._screen_active:
                 continue
 
-            # KEY TAKEN (removed from peg)
-            if self.ams_can.key_taken_event:
-                peg_id = self.ams_can.key_taken_id
-                actual_pos = self.ams_can.key_taken_position_slot
-                actual_strip = self.ams_can.key_taken_position_list
-                self.ams_can.key_taken_event = False  # clear before scheduling
+            if event.kind == KEY_EVENT_TAKEN:
+                # KEY TAKEN (removed from peg)
                 Clock.schedule_once(
-                    lambda dt, p=peg_id, s=actual_strip, o=actual_pos:
-                    self._handle_key_taken(p, s, o)
+                    lambda dt, e=event:
+                    self._handle_key_taken(e.peg_id, e.strip, e.slot)
                 )
-
-            # KEY INSERTED (returned to peg)
-            if self.ams_can.key_inserted_event:
-                peg_id = self.ams_can.key_inserted_id
-                actual_pos = self.ams_can.key_inserted_position_slot
-                actual_strip = self.ams_can.key_inserted_position_list
-                self.ams_can.key_inserted_event = False
+            elif event.kind == KEY_EVENT_INSERTED:
+                # KEY INSERTED (returned to peg)
                 Clock.schedule_once(
-                    lambda dt, p=peg_id, s=actual_strip, o=actual_pos:
-                    self._handle_key_inserted(p, s, o)
+                    lambda dt, e=event:
+                    self._handle_key_inserted(e.peg_id, e.strip, e.slot)
                 )
 
     # =====================================================
@@ -505,9 +520,7 @@ class KeyDashboardScreen(BaseScreen):
             "returned_timestamp": None,
         })
 
-        set_key_status_by_peg_id(self.manager.db_session, peg_id, 1)
-        self.reload_keys_from_db()
-        self.update_key_widgets()
+        self._set_key_status(peg_id, 1)
 
     def _handle_key_inserted(self, peg_id, actual_strip, actual_pos):
         """Handle a key-inserted event (main thread)."""
@@ -544,6 +557,7 @@ class KeyDashboardScreen(BaseScreen):
                     self._stop_misplaced_blink()
 
         # -------- DB + SELF-HEALING --------
+        # Lookups only: the updates are written by the log writer
         updated = False
         session = self.manager.db_session
         key_record = session.query(AMS_Keys).filter(
@@ -566,8 +580,7 @@ class KeyDashboardScreen(BaseScreen):
                     f"[DB] Self-healing (INSERT): Updating "
                     f"{key_record.keyName} to peg_id {peg_id}"
                 )
-                key_record.peg_id = str(peg_id)
-                session.commit()
+                get_log_writer().update_key(key_record.id, peg_id=str(peg_id))
                 key_name = key_record.keyName
 
                 for k in self.keys_data:
@@ -596,45 +609,32 @@ class KeyDashboardScreen(BaseScreen):
                 "returned_timestamp": returned_time,
             })
 
-        set_key_status_by_peg_id(self.manager.db_session, peg_id, 0)
-        self.reload_keys_from_db()
-        self.update_key_widgets()
+        self._set_key_status(peg_id, 0)
 
     # =====================================================
-    # MQTT GPIO
+    # DOOR SENSOR
     # =====================================================
-    def start_gpio_subscriber(self):
+    def start_door_monitor(self):
         try:
-            self._mqtt_client = mqtt.Client(
-                mqtt.CallbackAPIVersion.VERSION1, "kivy-door-subscriber"
-            )
-        except AttributeError:
-            # Fallback for Paho MQTT < 2.0
-            self._mqtt_client = mqtt.Client("kivy-door-subscriber")
-
-        self._mqtt_client.on_connect = self.on_mqtt_connect
-        self._mqtt_client.on_message = self.on_mqtt_message
-        try:
-            self._mqtt_client.connect("localhost", 1883, 60)
-            self._mqtt_client.loop_start()
+            self._door_monitor = get_door_monitor()
+            self._door_monitor.subscribe(self.on_door_event)
         except Exception as e:
-            log.warning(f"[MQTT] Failed to connect: {e}")
+            self._door_monitor = None
+            log.warning(f"[DOOR] Sensor monitor unavailable: {e}")
 
-    def on_mqtt_connect(self, client, userdata, flags, rc):
-        client.subscribe("gpio/pin32")
+    def stop_door_monitor(self):
+        if self._door_monitor:
+            self._door_monitor.unsubscribe(self.on_door_event)
+            self._door_monitor = None
 
-    def on_mqtt_message(self, client, userdata, msg):
+    def on_door_event(self, event):
+        """Runs on the door monitor thread."""
         if not self._screen_active:
             return
 
-        try:
-            value = int(msg.payload.decode())
-        except ValueError:
-            return
-
-        if value == 1 and not self.is_door_open:
+        if event.state == DOOR_OPEN and not self.is_door_open:
             Clock.schedule_once(lambda dt: self.on_door_opened())
-        elif value == 0 and self.is_door_open:
+        elif event.state == DOOR_CLOSED and self.is_door_open:
             Clock.schedule_once(lambda dt: self.on_door_closed())
 
     # =====================================================
@@ -645,10 +645,7 @@ class KeyDashboardScreen(BaseScreen):
             return
 
         log.info("[DOOR] Opened")
-        subprocess.Popen(
-            ["sudo", "python3", "solenoid.py", "0"],
-            cwd="/home/rock/Desktop/ams_v2",
-        )
+        self._set_door_lock(unlocked=False)
 
         self.is_door_open = True
         self._door_opened_timestamp = datetime.now()
@@ -685,8 +682,6 @@ class KeyDashboardScreen(BaseScreen):
         log.info("[DOOR] Closed")
         self.is_door_open = False
 
-        subprocess.Popen(["sudo", "pkill", "-f", "pub.py"])
-
         if self._door_timer_event:
             self._door_timer_event.cancel()
             self._door_timer_event = None
@@ -710,19 +705,16 @@ class KeyDashboardScreen(BaseScreen):
         self._dismiss_loading_popup()
         self._stop_misplaced_blink()
         self._misplaced_slots.clear()
-        self._shutdown_can_and_mqtt()
+        self._shutdown_can_and_door()
         self.key_interactions = []
         self.manager.current = "activity_done"
 
     # =====================================================
     # SHUTDOWN HELPER
     # =====================================================
-    def _shutdown_can_and_mqtt(self):
+    def _shutdown_can_and_door(self):
         log.info("[SHUTDOWN] Cleaning up resources...")
 
-        # Stop poll thread first
-        self._stop_can_poll_thread()
-
         # Stop door timer
         if self._door_timer_event:
             self._door_timer_event.cancel()
@@ -732,27 +724,30 @@ class KeyDashboardScreen(BaseScreen):
         self._stop_misplaced_blink()
         self._misplaced_slots.clear()
 
-        # Disconnect MQTT
-        if self._mqtt_client:
-            try:
-                self._mqtt_client.loop_stop()
-                self._mqtt_client.disconnect()
-            except Exception:
-                pass
-            self._mqtt_client = None
-            log.info("[SHUTDOWN] MQTT disconnected")
-
-        subprocess.Popen(["sudo", "pkill", "-f", "pub.py"])
+        # Stop listening to the door sensor
+        self.stop_door_monitor()
 
-        # CAN cleanup
+        # CAN cleanup: stop the CAN sequence / key event watcher, then
+        # release every key and turn the LEDs off
+        commands = []
         if hasattr(self, 'ams_can') and self.ams_can:
-            try:
-                for strip in self.ams_can.key_lists:
-                    self.ams_can.unlock_all_positions(strip)
-                    self.ams_can.set_all_LED_OFF(strip)
-            except Exception as e:
-                log.error(f"[SHUTDOWN] CAN error: {e}")
+            for strip in self.ams_can.key_lists:
+                commands.append(("unlock_all_positions", strip))
+                commands.append(("set_all_LED_OFF", strip))
+
+        can = self.manager.can_async
+        can_loop = self.manager.can_loop
+        try:
+            if can and can_loop:
+                can_loop.submit(self._stop_can_tasks(can, commands)).result(
+                    CAN_SHUTDOWN_TIMEOUT
+                )
+            elif commands:
+                self.ams_can.execute_batch(commands)
+        except Exception as e:
+            log.error(f"[SHUTDOWN] CAN error: {e!r}")
 
+        if hasattr(self, 'ams_can') and self.ams_can:
             self.ams_can = None
             log.info("[SHUTDOWN] CAN activities stopped")
 
@@ -795,8 +790,7 @@ class KeyDashboardScreen(BaseScreen):
                 log.info(
                     f"[DB] Self-healing: Updating {key_record.keyName} to peg_id {peg_id}"
                 )
-                key_record.peg_id = str(peg_id)
-                session.commit()
+                get_log_writer().update_key(key_record.id, peg_id=str(peg_id))
 
                 for k in self.keys_data:
                     if k.get("id") == key_record.id:
@@ -806,32 +800,74 @@ class KeyDashboardScreen(BaseScreen):
             log.error(f"[DB] Failed to bind key taken: Strip {strip} Slot {slot} not in DB")
             return
 
-        session.query(AMS_Keys).filter(
-            AMS_Keys.id == key_record.id
-        ).update({
-            "keyTakenBy": user["id"],
-            "keyTakenByUser": user["name"],
-            "current_pos_strip_id": None,
-            "current_pos_slot_no": None,
-            "keyTakenAtTime": datetime.now(TZ_INDIA),
-            "keyStatus": SLOT_STATUS_KEY_NOT_PRESENT,
-        })
+        # Written in the background, in order with the other log rows
+        writer = get_log_writer()
+        writer.update_key(
+            key_record.id,
+            keyTakenBy=user["id"],
+            keyTakenByUser=user["name"],
+            current_pos_strip_id=None,
+            current_pos_slot_no=None,
+            keyTakenAtTime=datetime.now(TZ_INDIA),
+            keyStatus=SLOT_STATUS_KEY_NOT_PRESENT,
+        )
+        writer.add_event_log(
+            userId=user["id"],
+            keyId=key_record.id,
+            activityId=self.activity_info["id"],
+            eventId=EVENT_KEY_TAKEN_CORRECT,
+            loginType=self.manager.final_auth_mode,
+            access_log_id=self.manager.ams_access_log.id,
+            timeStamp=datetime.now(TZ_INDIA),
+            event_type=EVENT_TYPE_EVENT,
+            is_posted=0,
+        )
 
-        session.add(
-            AMS_Event_Log(
-                userId=user["id"],
-                keyId=key_record.id,
-                activityId=self.activity_info["id"],
-                eventId=EVENT_KEY_TAKEN_CORRECT,
-                loginType=self.manager.final_auth_mode,
-                access_log_id=self.manager.ams_access_log.id,
-                timeStamp=datetime.now(TZ_INDIA),
-                event_type=EVENT_TYPE_EVENT,
-                eventDesc=get_event_description(session, EVENT_KEY_TAKEN_CORRECT),
-                is_posted=0,
-            )
+    # =====================================================
+    # DB WRITE — KEY STATUS
+    # =====================================================
+    def _set_key_status(self, peg_id, status):
+        """
+        Show the new status (0 = IN, 1 = OUT) now and queue the keyStatus
+        update on the log writer; the keys are reloaded from the database
+        once it has been written, so the Kivy thread never commits.
+        """
+        key_id = None
+        for k in self.keys_data:
+            if str(k.get("peg_id")) == str(peg_id):
+                k["status"] = status
+                key_id = k["id"]
+                break
+
+        if key_id is None:
+            # Not one of this activity's keys
+            key_record = self.manager.db_session.query(AMS_Keys).filter(
+                AMS_Keys.peg_id == str(peg_id),
+                AMS_Keys.deletedAt == None,
+            ).first()
+            if not key_record:
+                log.warning(f"[DB] No key found for peg_id={peg_id}")
+                return
+            key_id = key_record.id
+
+        self.update_key_widgets()
+
+        ticket = get_log_writer().update_key(
+            key_id, keyStatus=status, updatedAt=datetime.now()
+        )
+        ticket.add_done_callback(
+            lambda t: Clock.schedule_once(lambda dt: self._on_key_status_written(t))
         )
-        session.commit()
+
+    def _on_key_status_written(self, ticket):
+        if ticket.error is not None:
+            log.error(f"[DB] Key status update failed: {ticket.error}")
+        if not self._screen_active:
+            return
+        # Objects loaded before the writer committed are stale
+        self.manager.db_session.expire_all()
+        self.reload_keys_from_db()
+        self.update_key_widgets()
 
     # =====================================================
     # UI HELPERS
@@ -885,7 +921,7 @@ class KeyDashboardScreen(BaseScreen):
         self._dismiss_loading_popup()
         self._stop_misplaced_blink()
         self._misplaced_slots.clear()
-        self._shutdown_can_and_mqtt()
+        self._shutdown_can_and_door()
         self.key_interactions = []
         self.manager.current = "activity_done"
 
@@ -898,12 +934,9 @@ class KeyDashboardScreen(BaseScreen):
         self._dismiss_loading_popup()
         self._stop_misplaced_blink()
         self._misplaced_slots.clear()
-        self._shutdown_can_and_mqtt()
+        self._shutdown_can_and_door()
 
-        subprocess.Popen(
-            ["sudo", "python3", "solenoid.py", "0"],
-            cwd="/home/rock/Desktop/ams_v2",
-        )
+        self._set_door_lock(unlocked=False)
 
         self.key_interactions = []
         self.manager.current = "activity"
@@ -1,4 +1,5 @@
 from kivy.properties import ListProperty, StringProperty, NumericProperty
+from kivy.clock import Clock
 from kivy.uix.popup import Popup
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
@@ -228,7 +229,6 @@ class PinScreen(BaseScreen):
             self.reset_pin()
 
             log_access_and_event(
-                session=session,
                 event_id=EVENT_LOGIN_FAILED,
                 event_type=EVENT_TYPE_ALARM,
                 auth_mode=self.manager.auth_mode,
@@ -249,7 +249,6 @@ class PinScreen(BaseScreen):
         print(f"✓ User ID: {user_id}")
 
         result = log_access_and_event(
-            session=session,
             event_id=EVENT_LOGIN_SUCCEES,
             event_type=EVENT_TYPE_EVENT,
             auth_mode=self.manager.auth_mode,
@@ -261,7 +260,14 @@ class PinScreen(BaseScreen):
             },
         )
 
-        self.manager.access_log_id = result["access_log_id"]
+        # The access_log id is kept for the rest of the session; it is
+        # set once the writer has committed the row
+        self.manager.access_log_id = None
+        result["access_log"].add_done_callback(
+            lambda ticket: Clock.schedule_once(
+                lambda dt: self._set_access_log_id(ticket)
+            )
+        )
 
         self.reset_pin()
         self.manager.transition.direction = "left"
@@ -270,6 +276,11 @@ class PinScreen(BaseScreen):
     # --------------------------------------------------
     # HELPERS
     # --------------------------------------------------
+    def _set_access_log_id(self, ticket):
+        if ticket.error is not None:
+            print(f"[AUTH] Access log not written: {ticket.error}")
+        self.manager.access_log_id = ticket.id
+
     def reset_pin(self):
         self.pin.clear()
         self.pin_length = 0
@@ -66,11 +66,10 @@ def main():
     print("Old peg records cleared")
 
     # ---------------- PEG SCAN ----------------
-    for keylistid in ams_can.key_lists:
-        print(f"\nScanning Strip {keylistid}")
+    for keylistid, slots in ams_can.scan_all().items():
+        print(f"\nStrip {keylistid}")
 
-        for slot in range(1, 15):
-            peg_id = ams_can.get_key_id(keylistid, slot)
+        for slot, peg_id in sorted(slots.items()):
             print(f"Strip {keylistid} Slot {slot} → peg_id = {peg_id}")
 
             if not peg_id:
@@ -84,7 +83,6 @@ def main():
                     keyslot_no=slot,
                 )
             )
-            session.commit()
 
             # Update key table
             key = (
@@ -100,10 +98,9 @@ def main():
                 key.peg_id = peg_id
                 key.current_pos_strip_id = keylistid
                 key.current_pos_slot_no = slot
-                session.commit()
                 print("  → DB updated")
 
-            sleep(0.2)
+    session.commit()
 
     # ---------------- EVENT LOG ----------------
     session.add(
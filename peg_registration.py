@@ -3,7 +3,6 @@
 from time import sleep
 from datetime import datetime
 import pytz
-import paho.mqtt.client as mqtt
 from threading import Event
 
 from csi_ams.model import (
@@ -19,11 +18,22 @@ from csi_ams.model import (
 from csi_ams.utils.commons import get_event_description
 from amscan import CAN_LED_STATE_BLINK, CAN_LED_STATE_OFF
 from hardware_sync import sync_hardware_to_db
+from door_lock import get_door_lock
+from door_monitor import DOOR_CLOSED, DOOR_OPEN, get_door_monitor
 
 TZ_INDIA = pytz.timezone("Asia/Kolkata")
 
 
-def register_pegs(session, ams_can, user_id, status_callback=None):
+def _release_all_strips(ams_can):
+    """Unlock every position and switch all LEDs off on every strip in one batch."""
+    commands = []
+    for strip in ams_can.key_lists:
+        commands.append(("unlock_all_positions", strip))
+        commands.append(("set_all_LED_OFF", strip))
+    ams_can.execute_batch(commands)
+
+
+def register_pegs(session, ams_can, user_id, status_callback=None, scan_hardware=False):
     """
     Complete peg registration flow:
     1. Sync hardware to DB
@@ -37,6 +47,9 @@ def register_pegs(session, ams_can, user_id, status_callback=None):
         ams_can: Existing AMS_CAN instance (must be initialized)
         user_id: User performing registration
         status_callback: Optional callable for live GUI updates
+        scan_hardware: Read peg IDs from the strips (AMS_CAN.scan_all) instead
+            of copying them from the DB; slots that do not answer fall back
+            to the DB / placeholder values
     
     Returns:
         dict with 'success', 'message', and optional 'pegs_registered'
@@ -81,9 +94,11 @@ def register_pegs(session, ams_can, user_id, status_callback=None):
     # ========================================
     print("\n[3/5] Unlocking all positions and turning LEDs on...")
     
+    commands = []
     for strip in ams_can.key_lists:
-        ams_can.unlock_all_positions(strip)
-        ams_can.set_all_LED_ON(strip, False)
+        commands.append(("unlock_all_positions", strip))
+        commands.append(("set_all_LED_ON", strip, False))
+    ams_can.execute_batch(commands)
     
     # Create access log
     access_log = AMS_Access_Log(
@@ -109,93 +124,84 @@ def register_pegs(session, ams_can, user_id, status_callback=None):
     if status_callback:
         status_callback("Please open the cabinet door...", 50)
     
-    import subprocess
-    # Start the door publishing monitor
-    subprocess.Popen(
-        ["sudo", "python3", "pub.py"],
-        cwd="/home/rock/Desktop/ams_v2",
-    )
     # Unlock the solenoid
-    subprocess.Popen(
-        ["sudo", "python3", "solenoid.py", "1"],
-        cwd="/home/rock/Desktop/ams_v2",
-    )
+    try:
+        door_lock = get_door_lock()
+        door_lock.unlock()
+    except Exception as e:
+        print(f"✗ Door lock unavailable: {e}")
+        _release_all_strips(ams_can)
+        return {
+            'success': False,
+            'message': 'Door lock unavailable'
+        }
     
     door_event = Event()
     door_opened = {'value': False}
     
-    def on_connect(client, userdata, flags, rc):
-        client.subscribe("gpio/pin32")
-        print("✓ Connected to MQTT, monitoring door sensor")
-    
-    def on_message(client, userdata, msg):
-        value = int(msg.payload.decode())
-        
-        if value == 1 and not door_opened['value']:
+    def on_door_event(event):
+        if event.state == DOOR_OPEN and not door_opened['value']:
             door_opened['value'] = True
             print("✓ Door opened")
             if status_callback:
                 status_callback("Door opened. Please close door to scan lock...", 55)
             # Standard practice is to also lock the solenoid when opened so it can latch shut.
-            subprocess.Popen(
-                ["sudo", "python3", "solenoid.py", "0"],
-                cwd="/home/rock/Desktop/ams_v2",
-            )
+            door_lock.lock()
         
-        elif value == 0 and door_opened['value']:
+        elif event.state == DOOR_CLOSED and door_opened['value']:
             print("✓ Door closed - starting peg scan")
-            subprocess.Popen(
-                ["sudo", "python3", "solenoid.py", "0"],
-                cwd="/home/rock/Desktop/ams_v2",
-            )
-            # Door closed, stop publishing script
-            subprocess.Popen(["sudo", "pkill", "-f", "pub.py"])
+            door_lock.lock()
             door_event.set()
     
-    try:
-        # Paho MQTT 2.0+ requires callback_api_version
-        mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, "peg-registration")
-    except AttributeError:
-        # Fallback for Paho MQTT 1.x
-        mqtt_client = mqtt.Client("peg-registration")
-    mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message
-    mqtt_client.connect("localhost", 1883, 60)
-    mqtt_client.loop_start()
+    door_monitor = get_door_monitor()
+    door_monitor.subscribe(on_door_event)
+    print("✓ Monitoring door sensor")
     
     # Wait for door cycle (with timeout)
-    if not door_event.wait(timeout=300):  # 5 minute timeout
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
-        
+    door_cycled = door_event.wait(timeout=300)  # 5 minute timeout
+    door_monitor.unsubscribe(on_door_event)
+    if not door_cycled:
         # Cleanup
-        subprocess.Popen(["sudo", "pkill", "-f", "pub.py"])
-        for strip in ams_can.key_lists:
-            ams_can.unlock_all_positions(strip)
-            ams_can.set_all_LED_OFF(strip)
+        door_lock.lock()
+        _release_all_strips(ams_can)
         
         return {
             'success': False,
             'message': 'Timeout waiting for door cycle'
         }
     
-    mqtt_client.loop_stop()
-    mqtt_client.disconnect()
-    
     # ========================================
     # STEP 5: SCAN PEGS
     # ========================================
     print("\n[5/5] Scanning peg IDs...")
     
     scanned_pegs = []
+    hardware_pegs = ams_can.scan_all() if scan_hardware else {}
     
     for strip in ams_can.key_lists:
         print(f"\n  Scanning strip {strip}...")
         
+        # Blink the whole strip while it is being read
+        ams_can.execute_batch([
+            ("set_single_LED_state", strip, slot, CAN_LED_STATE_BLINK)
+            for slot in range(1, 15)
+        ])
+        strip_pegs = hardware_pegs.get(strip, {})
+        
         for slot in range(1, 15):  # positions 1-14
-            # Blink LED for current position
-            ams_can.set_single_LED_state(strip, slot, CAN_LED_STATE_BLINK)
-            sleep(0.15)
+            hw_peg = strip_pegs.get(slot)
+            if hw_peg:
+                try:
+                    peg_int = int(hw_peg)
+                    scanned_pegs.append({
+                        'peg_id': peg_int,
+                        'strip': strip,
+                        'slot': slot
+                    })
+                    print(f"    Slot {slot:2d}: Peg ID {peg_int}")
+                    continue
+                except ValueError:
+                    print(f"    Slot {slot:2d}: Invalid peg ID from strip '{hw_peg}'")
             
             # HARDCODED ASSIGNMENT (Developer request to skip hardware scan)
             key = session.query(AMS_Keys).filter(
@@ -224,15 +230,16 @@ def register_pegs(session, ams_can, user_id, status_callback=None):
                     'slot': slot
                 })
                 print(f"    Slot {slot:2d}: Generated dummy peg {peg_int}")
-            
-            # Turn LED off
-            ams_can.set_single_LED_state(strip, slot, CAN_LED_STATE_OFF)
+        
+        # Turn LEDs off
+        ams_can.execute_batch([
+            ("set_single_LED_state", strip, slot, CAN_LED_STATE_OFF)
+            for slot in range(1, 15)
+        ])
     
     if not scanned_pegs:
         # Cleanup
-        for strip in ams_can.key_lists:
-            ams_can.unlock_all_positions(strip)
-            ams_can.set_all_LED_OFF(strip)
+        _release_all_strips(ams_can)
         
         return {
             'success': False,
@@ -299,9 +306,7 @@ def register_pegs(session, ams_can, user_id, status_callback=None):
     # CLEANUP
     # ========================================
     print("\nCleaning up...")
-    for strip in ams_can.key_lists:
-        ams_can.unlock_all_positions(strip)
-        ams_can.set_all_LED_OFF(strip)
+    _release_all_strips(ams_can)
     
     print("\n" + "="*60)
     print(f"PEG REGISTRATION COMPLETE - {len(scanned_pegs)} pegs registered")
@@ -1,52 +1,52 @@
 #!/usr/bin/env python3
+"""
+Print door sensor transitions (GPIO 32) for bench checks.
+
+The application no longer needs this script: door_monitor.py watches the
+sensor in-process and hands events to the screens directly. Pass --mqtt to
+also publish each transition on "gpio/pin32" for anything still listening
+on the local broker.
+"""
+import sys
 import time
-import mraa
-import paho.mqtt.client as mqtt
+
+from door_monitor import DOOR_OPEN, DOOR_SENSOR_PIN, DoorMonitor
+import hal
 
 
 # Config
-GPIO_PIN = 32
 MQTT_TOPIC = "gpio/pin32"
 
 
-# MQTT
-client = mqtt.Client("door-publisher-mraa")
-client.connect("localhost", 1883, 60)
-client.loop_start()
-
+client = None
+if "--mqtt" in sys.argv:
+    import paho.mqtt.client as mqtt
 
-# GPIO with MRAA
-gpio = mraa.Gpio(GPIO_PIN)
-gpio.dir(mraa.DIR_IN)
+    client = mqtt.Client("door-publisher-mraa")
+    client.connect("localhost", 1883, 60)
+    client.loop_start()
 
 
-print(f"✓ Monitoring GPIO pin {GPIO_PIN}")
-print(f"Initial pin state: {gpio.read()}\n")
+def on_door_event(event):
+    status = "OPEN" if event.state == DOOR_OPEN else "CLOSED"
+    print(f"📢 Door {status} (state={event.state})")
+    if client:
+        client.publish(MQTT_TOPIC, str(event.state), qos=1)
 
 
-# Track previous state to detect changes
-previous_state = gpio.read()
+monitor = DoorMonitor(backend=hal.get_gpio_backend())
+monitor.subscribe(on_door_event)
+monitor.start()
+print(f"✓ Monitoring GPIO pin {DOOR_SENSOR_PIN}")
 
 
-# Keep running with polling
 try:
     print("Press Ctrl+C to exit\n")
     while True:
-        current_state = gpio.read()
-        
-        # Display current state continuously
-        print(f"Pin {GPIO_PIN} state: {current_state}", end='\r')
-        
-        # Detect state change and publish
-        if current_state != previous_state:
-            client.publish(MQTT_TOPIC, str(current_state), qos=1)
-            status = "OPEN" if current_state == 1 else "CLOSED"
-            print(f"\n📢 Door {status} (state={current_state})")
-            previous_state = current_state
-        
-        time.sleep(0.1)  # Poll every 100ms
-        
+        time.sleep(1)
 except KeyboardInterrupt:
     print("\n\nStopping...")
-    client.disconnect()
+    monitor.stop()
+    if client:
+        client.disconnect()
     print("✓ Cleanup completed")
@@ -1,20 +1,14 @@
 #!/usr/bin/env python3
-import sys
-import mraa
-import time
-
-# ---------------- GPIO SETUP ----------------
-BUZZER_PIN = 37
-RL1_PIN = 38
-RL2_PIN = 40
+"""
+Manual solenoid switch: sudo python3 solenoid.py <0|1>
 
-buzzer = mraa.Gpio(BUZZER_PIN)
-rl1 = mraa.Gpio(RL1_PIN)
-rl2 = mraa.Gpio(RL2_PIN)
+The app no longer spawns this script; it drives the same pins in-process
+through door_lock.DoorLockController.
+"""
+import sys
 
-buzzer.dir(mraa.DIR_OUT)
-rl1.dir(mraa.DIR_OUT)
-rl2.dir(mraa.DIR_OUT)
+from door_lock import DoorLockController
+import hal
 
 # ---------------- ARGUMENT CHECK ----------------
 if len(sys.argv) != 2:
@@ -30,15 +24,5 @@ except ValueError:
     sys.exit(1)
 
 # ---------------- ACTION ----------------
-if state == 1:
-    print("[GPIO] Activating solenoids")
-    rl1.write(1)
-    rl2.write(1)
-    
-else:
-    print("[GPIO] Deactivating solenoids")
-    rl1.write(0)
-    rl2.write(0)
-  
-
-time.sleep(0.2)
+door_lock = DoorLockController(backend=hal.get_gpio_backend())
+door_lock.set_solenoid(state == 1)
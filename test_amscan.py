@@ -0,0 +1,290 @@
+"""
+AMS_CAN against the key-strip simulator on python-can's virtual bus.
+
+Covers request/reply matching, execute_batch, key events, the shadow
+cache, scan_strip, retransmits and the asyncio front-end; no hardware
+needed:
+
+    python3 -m pytest test_amscan.py
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+
+from amscan import (
+    AMS_CAN,
+    CAN_FUNCTION_VERSION,
+    CAN_KEY_UNLOCKED,
+    CAN_LED_STATE_BLINK,
+    CAN_LED_STATE_OFF,
+    CAN_LED_STATE_ON,
+    CAN_MSG_TYPE_GET,
+    KEY_EVENT_INSERTED,
+    KEY_EVENT_TAKEN,
+    SHADOW_LED,
+    SLOTS_PER_STRIP,
+)
+from amscan_async import AsyncAMS_CAN, CanLoopThread
+from amscan_sim import KeyStripSimulator, default_peg_bytes
+
+_channels = itertools.count()
+
+
+def peg_id(strip, slot):
+    """Peg id string get_key_id() reports for the simulator's default pegs."""
+    return "".join(str(b) for b in default_peg_bytes(strip, slot))
+
+
+def function_stats(ams_can, strip, name):
+    return ams_can.stats.snapshot()["functions"][f"{strip}/{name}"]
+
+
+@pytest.fixture
+def channel():
+    # A fresh virtual channel per test so no frames leak between tests
+    return f"test-amscan-{next(_channels)}"
+
+
+@pytest.fixture
+def sim(channel):
+    simulator = KeyStripSimulator(channel=channel, interface="virtual", strips=2)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def ams_can(sim, channel):
+    ams_can = AMS_CAN(channel=channel, interface="virtual", response_timeout=0.1)
+    yield ams_can
+    ams_can.cleanup()
+
+
+# =====================================================
+# REQUEST / RESPONSE MATCHING
+# =====================================================
+def test_replies_complete_their_own_request(ams_can):
+    assert ams_can.get_version_number(1) == [1, 0, 0]
+    assert ams_can.get_key_id(2, 5) == peg_id(2, 5)
+    assert ams_can._pending == {}
+    assert function_stats(ams_can, 1, "VERSION")["count"] == 1
+
+
+def test_reply_matched_by_strip_and_function(ams_can):
+    # Strip 3 does not exist, so only the replies faked here arrive
+    pending = ams_can._send_request(
+        3, CAN_MSG_TYPE_GET, CAN_FUNCTION_VERSION, expect_data=True
+    )
+    assert not ams_can._complete_request(4, CAN_FUNCTION_VERSION, [2, 0, 0])
+    # An ACK without payload does not complete a request expecting data
+    assert not ams_can._complete_request(3, CAN_FUNCTION_VERSION)
+    assert ams_can._complete_request(3, CAN_FUNCTION_VERSION, [2, 0, 0])
+    assert ams_can._wait_request(pending, 0)
+    assert list(pending.data) == [2, 0, 0]
+    assert ams_can._pending == {}
+
+
+def test_second_claim_on_busy_key_times_out(ams_can):
+    pending = ams_can._send_request(
+        3, CAN_MSG_TYPE_GET, CAN_FUNCTION_VERSION, expect_data=True
+    )
+    second = ams_can._send_request(
+        3, CAN_MSG_TYPE_GET, CAN_FUNCTION_VERSION, expect_data=True,
+        claim_timeout=0.05,
+    )
+    assert second is None
+    assert ams_can.key_claim_timeouts == 1
+    ams_can._release_request(pending)
+    assert ams_can._pending == {}
+
+
+# =====================================================
+# BATCHES
+# =====================================================
+def test_execute_batch_results_in_command_order(sim, ams_can):
+    results = ams_can.execute_batch([
+        ("set_all_LED_ON", 1, False),
+        ("set_all_LED_ON", 2, True),
+        ("get_version_number", 1),
+        ("set_single_LED_state", 1, 3, CAN_LED_STATE_ON),
+        # Same (strip, function) as above: goes out in the next wave
+        ("set_single_LED_state", 1, 3, CAN_LED_STATE_OFF),
+        ("get_key_id", 2, 5),
+    ])
+    assert results == [True, True, [1, 0, 0], True, True, peg_id(2, 5)]
+    assert sim.strip(1).all_leds == CAN_LED_STATE_ON
+    assert sim.strip(2).all_leds == CAN_LED_STATE_BLINK
+    assert sim.strip(1).leds[3] == CAN_LED_STATE_OFF
+    assert ams_can._pending == {}
+
+
+# =====================================================
+# KEY EVENTS
+# =====================================================
+def test_key_events_reach_queue_and_subscribers(sim, ams_can):
+    received = []
+    both = threading.Event()
+
+    def on_event(event):
+        received.append(event)
+        if len(received) == 2:
+            both.set()
+
+    ams_can.subscribe_key_events(on_event)
+    # The queue exists from the first get_key_event() on
+    assert ams_can.get_key_event(timeout=0) is None
+
+    sim.take_key(1, 4)
+    sim.insert_key(2, 6, default_peg_bytes(2, 6))
+
+    taken = ams_can.get_key_event(timeout=1.0)
+    inserted = ams_can.get_key_event(timeout=1.0)
+    assert (taken.kind, taken.peg_id, taken.strip, taken.slot) == (
+        KEY_EVENT_TAKEN, int(peg_id(1, 4)), 1, 4
+    )
+    assert (inserted.kind, inserted.peg_id, inserted.strip, inserted.slot) == (
+        KEY_EVENT_INSERTED, int(peg_id(2, 6)), 2, 6
+    )
+    assert both.wait(1.0)
+    assert received == [taken, inserted]
+
+    ams_can.unsubscribe_key_events(on_event)
+    assert ams_can._key_event_subscribers == []
+
+
+# =====================================================
+# SHADOW CACHE
+# =====================================================
+def test_shadow_skips_redundant_commands(sim, ams_can):
+    assert ams_can.set_all_LED_ON(1, False)
+    sent = sim.frames_received
+
+    assert ams_can.set_all_LED_ON(1, False)
+    assert ams_can.execute_batch([("set_all_LED_ON", 1, False)]) == [True]
+    assert sim.frames_received == sent
+    assert ams_can.shadow_skipped == 2
+    assert ams_can.get_shadow_state(1, SHADOW_LED) == CAN_LED_STATE_ON
+
+    assert ams_can.set_all_LED_ON(1, False, force=True)
+    assert sim.frames_received == sent + 1
+
+    ams_can.invalidate_shadow(1)
+    assert ams_can.set_all_LED_ON(1, False)
+    assert sim.frames_received == sent + 2
+
+
+# =====================================================
+# PEG SCAN
+# =====================================================
+def test_scan_strip_reads_every_slot(sim, ams_can):
+    sim.strip(1).pegs[2] = None
+
+    result = ams_can.scan_strip(1, retries=1)
+
+    assert sorted(result) == list(range(1, SLOTS_PER_STRIP + 1))
+    assert result[2] is None
+    assert all(
+        result[slot] == peg_id(1, slot) for slot in result if slot != 2
+    )
+    # Only the empty slot is asked again
+    assert function_stats(ams_can, 1, "KEY_ID")["retransmits"] == 1
+
+
+# =====================================================
+# RETRANSMITS
+# =====================================================
+def test_lost_ack_is_retransmitted(sim, ams_can, monkeypatch):
+    reply = sim._reply
+    dropped = []
+
+    def drop_first(*args):
+        if not dropped:
+            dropped.append(args)
+            return
+        reply(*args)
+
+    monkeypatch.setattr(sim, "_reply", drop_first)
+
+    assert ams_can.set_all_LED_ON(1, False)
+    stats = function_stats(ams_can, 1, "ALL_LEDS")
+    assert (stats["timeouts"], stats["retransmits"]) == (1, 1)
+    assert len(dropped) == 1
+
+
+def test_retransmits_give_up_after_the_limit(sim, ams_can):
+    sim.drop_rate = 1.0
+
+    assert ams_can.set_all_LED_OFF(1) is False
+    stats = function_stats(ams_can, 1, "ALL_LEDS")
+    assert stats["retransmits"] == ams_can.max_retransmits
+    assert stats["timeouts"] == ams_can.max_retransmits + 1
+    # Not acknowledged: the shadow must not claim the LEDs are off
+    assert ams_can.get_shadow_state(1, SHADOW_LED) is None
+
+
+# =====================================================
+# ASYNC FRONT-END
+# =====================================================
+def test_async_commands(sim, ams_can):
+    can = AsyncAMS_CAN(ams_can)
+
+    async def run():
+        results = await can.batch([
+            ("get_version_number", 1),
+            ("get_version_number", 2),
+            ("set_all_LED_ON", 2, False),
+        ])
+        unlocked = await can.unlock(1, 5)
+        scan = await can.scan_strip(2, retries=0)
+        return results, unlocked, scan
+
+    results, unlocked, scan = asyncio.run(run())
+    assert results == [[1, 0, 0], [1, 0, 0], True]
+    assert unlocked is True
+    assert sim.strip(1).locks[5] == CAN_KEY_UNLOCKED
+    assert sim.strip(1).leds[5] == CAN_LED_STATE_ON
+    assert scan == {slot: peg_id(2, slot) for slot in range(1, SLOTS_PER_STRIP + 1)}
+    assert ams_can._pending == {}
+
+
+def test_async_command_waits_for_blocking_one_on_same_key(ams_can):
+    can = AsyncAMS_CAN(ams_can)
+    loop_thread = CanLoopThread(name="test-can-async")
+    try:
+        # A blocking command holds (1, VERSION) until its reply is collected
+        spec = ams_can._command_spec("get_version_number", 1)
+        pending = ams_can._send_request(**spec)
+
+        future = loop_thread.submit(can.get_version(1))
+        time.sleep(0.2)
+        assert not future.done()
+
+        assert ams_can._wait_request(pending)
+        assert future.result(1.0) == [1, 0, 0]
+        assert ams_can.key_claim_timeouts == 0
+    finally:
+        loop_thread.stop()
+
+
+def test_async_key_events(sim, ams_can):
+    can = AsyncAMS_CAN(ams_can)
+
+    async def first_event():
+        events = can.key_events()
+        receiving = asyncio.ensure_future(events.__anext__())
+        # Let the generator subscribe before the key moves
+        await asyncio.sleep(0.05)
+        sim.take_key(2, 9)
+        event = await asyncio.wait_for(receiving, 1.0)
+        await events.aclose()
+        return event
+
+    event = asyncio.run(first_event())
+    assert (event.kind, event.peg_id, event.strip, event.slot) == (
+        KEY_EVENT_TAKEN, int(peg_id(2, 9)), 2, 9
+    )
+    assert ams_can._key_event_subscribers == []
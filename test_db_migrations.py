@@ -0,0 +1,56 @@
+"""
+Query plan check for the hot card / PIN / peg / activity lookups.
+
+Builds the schema in an in-memory database and runs db_migrations'
+EXPLAIN check against it; no hardware needed:
+
+    python3 -m pytest test_db_migrations.py
+"""
+
+import os
+
+# db.py pulls in csi_ams.utils.commons, which opens the LCD / keypad / reader
+os.environ.setdefault("AMS_HAL", "fake")
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import db_migrations
+import model
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    model.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_is_idempotent(engine):
+    latest = db_migrations.MIGRATIONS[-1][0]
+    assert db_migrations.migrate(engine) == latest
+    assert db_migrations.migrate(engine) == latest
+    with engine.connect() as conn:
+        applied = conn.execute(
+            text(f"SELECT COUNT(*) FROM {db_migrations.SCHEMA_TABLE}")
+        ).scalar()
+    assert applied == len(db_migrations.MIGRATIONS)
+
+
+def test_failed_migration_stops(engine, monkeypatch):
+    latest = db_migrations.MIGRATIONS[-1][0]
+    broken = (latest + 1, "broken", ["CREATE INDEX ix_missing ON no_such_table (id)"])
+    monkeypatch.setattr(db_migrations, "MIGRATIONS", db_migrations.MIGRATIONS + [broken])
+
+    with pytest.raises(db_migrations.MigrationError):
+        db_migrations.migrate(engine)
+    with engine.connect() as conn:
+        assert db_migrations.current_version(conn) == latest
+
+
+def test_hot_lookups_use_indexes(engine):
+    results = db_migrations.check_query_plans(engine)
+    assert results
+    scans = [(sql, details) for sql, details, full_scan in results if full_scan]
+    assert scans == []